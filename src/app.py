@@ -3,10 +3,6 @@ Application navigation
 """
 
 import streamlit as st
-import torch
-
-# fixes issue with torch loading when using streamlit
-torch.classes.__path__ = []
 
 
 # Define the pages
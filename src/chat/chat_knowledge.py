@@ -2,9 +2,24 @@ import pandas as pd
 import plotly.express as px
 import streamlit as st
 
-from chat.db.database import fetch_all_chat_source
+from chat.db.database import fetch_all_chat_source, fetch_ingestion_jobs
+from chat.ingestion_jobs import get_ingestion_worker
+from chat.ingestion_progress import render_active_ingestion_jobs, render_ingestion_job
+from chat.vector_store import get_retrieval_cache
 from helpers import sqlalchemy_model_to_dict
 
+# jobs queued before a restart resume even if the chat page is never opened
+get_ingestion_worker()
+
+st.markdown(
+    """
+    ## Sources Being Processed
+    """
+)
+render_active_ingestion_jobs()
+for failed_job in fetch_ingestion_jobs(["failed"])[:5]:
+    render_ingestion_job(failed_job)
+
 # load datasources
 chat_sources = fetch_all_chat_source()
 if len(chat_sources) == 0:
@@ -54,3 +69,17 @@ st.bar_chart(
     y_label="N. times retrieved",
     color=(255, 0, 0),
 )
+
+st.markdown(
+    """
+    ### Retrieval cache
+
+    Questions similar to previous ones reuse their retrieved documents.
+    Counters start with the app process.
+    """
+)
+cache_stats = get_retrieval_cache().stats()
+col1, col2, col3 = st.columns(3)
+col1.metric("Hits", cache_stats["retrieval_cache_hits"])
+col2.metric("Misses", cache_stats["retrieval_cache_misses"])
+col3.metric("Hit rate", f"{cache_stats['retrieval_cache_hit_rate']:.0%}")
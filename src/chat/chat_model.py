@@ -2,29 +2,66 @@
 Interface to interact with chat model
 """
 
+import asyncio
+import json
 import logging
-import sqlite3
-from typing import Any, Iterator
+import os
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, Iterator, Literal, NamedTuple
 
 import streamlit as st
 from dotenv import load_dotenv
-from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors.chain_filter import LLMChainFilter
 from langchain_core.documents import Document
-from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_core.runnables import RunnableConfig
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI, OpenAI
+from langchain_openai import ChatOpenAI
+from langgraph.constants import TAG_NOSTREAM
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.checkpoint.sqlite import SqliteSaver
-from langgraph.graph import END, MessagesState, StateGraph
+from langgraph.graph import END, StateGraph
 from langgraph.graph.state import CompiledStateGraph
 from langgraph.prebuilt import ToolNode, tools_condition
 
-from chat.db.database import save_conversation_title, update_chat_source_n_retrieved
-from chat.vector_store import vector_store
+from chat.conversation_memory import (
+    ChatState,
+    memory_messages,
+    memory_window_start,
+    summary_prompt,
+)
+from chat.db.database import (
+    DATABASE_PATH,
+    fetch_conversation_messages,
+    save_conversation_title,
+)
+from chat.lexical_index import reciprocal_rank_fusion
+from chat.relevance import RELEVANCE_FILTER, RelevanceFilterMode, make_relevance_filter
+from chat.retrieval_counters import get_retrieval_counter
+from chat.vector_store import (
+    EMBEDDING_MODEL,
+    VECTOR_STORE_BACKEND,
+    get_embeddings,
+    get_lexical_index,
+    get_retrieval_cache,
+    get_vector_store,
+)
+from utils.aio import GRAPH_EXECUTION, GraphExecution, run_coroutine
+from utils.lazy import lazy_singleton
+from utils.sqlite import connect_aiosqlite, connect_sqlite
+
+if TYPE_CHECKING:
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 
 load_dotenv()
 
+# where chat histories are read from: the `messages` table, written after each turn,
+# or the latest graph checkpoint, which already holds them
+ChatHistorySource = Literal["messages", "checkpoint"]
+CHAT_HISTORY_SOURCE: ChatHistorySource = os.environ.get(
+    "CHAT_HISTORY_SOURCE", "messages"
+)
+
 
 BASE_SYSTEM_MSG = """
     You are a helpful assistant, whose purpose is to help in learning and exploring the
@@ -64,7 +101,8 @@ def _parse_retrieved_into_context(retrieved_docs: list[Document]) -> str:
 
 def _update_source_retrieval_count(documents: list[Document]):
     """
-    Increases the retrival count of retrieved sources
+    Increases the retrival count of retrieved sources. Counts are written to the
+    database in batches, in the background.
 
     Args:
         documents (list[Document]): retrieved documents
@@ -75,13 +113,80 @@ def _update_source_retrieval_count(documents: list[Document]):
         if source_name not in retrieved_sources:
             retrieved_sources[source_name] = 0
         retrieved_sources[source_name] += 1
-    for source, retrieval_count in retrieved_sources.items():
-        update_chat_source_n_retrieved(source, retrieval_count)
+    get_retrieval_counter().add(retrieved_sources)
+
+
+class HistoryMessage(NamedTuple):
+    """Message of a conversation as displayed in the chat"""
+
+    seq: int
+    role: str
+    content: str
+
+
+@lazy_singleton
+def get_checkpointer() -> SqliteSaver:
+    """Checkpointer of the chat graph states, shared by all chat apps"""
+    return SqliteSaver(connect_sqlite(DATABASE_PATH))
+
+
+def project_chat_history(messages: list[BaseMessage]) -> list[tuple[str, str]]:
+    """(role, content) of the messages of a graph state shown in the chat, leaving
+    out tool calls and retrieved context"""
+    history = []
+    for message in messages:
+        if message.type == "human":
+            history.append(("human", message.text()))
+        elif message.type == "ai" and not message.tool_calls:
+            history.append(("ai", message.text()))
+    return history
+
+
+def fetch_checkpoint_history(
+    thread_id: str, before_seq: int | None = None, limit: int = 50
+) -> list[HistoryMessage]:
+    """Fetch a page of the history of a conversation from its latest checkpoint,
+    oldest first. Conversations without checkpoints are read from the database.
+
+    Args:
+        thread_id (str): id of the conversation
+        before_seq (int, optional): position of the first already loaded message.
+            Defaults to None, fetching the latest messages.
+        limit (int): maximum number of messages. Defaults to 50.
+    """
+    checkpoint = get_checkpointer().get({"configurable": {"thread_id": thread_id}})
+    if checkpoint is None:
+        return [
+            HistoryMessage(message.seq, message.role, message.content)
+            for message in fetch_conversation_messages(thread_id, before_seq, limit)
+        ]
+    history = project_chat_history(checkpoint["channel_values"].get("messages", []))
+    end = len(history) if before_seq is None else before_seq
+    return [
+        HistoryMessage(seq, *history[seq]) for seq in range(max(0, end - limit), end)
+    ]
+
+
+@lazy_singleton
+def get_async_checkpointer() -> "AsyncSqliteSaver":
+    """Checkpointer of the chat graphs run in async mode, bound to the graphs event
+    loop"""
+    # imports aiosqlite, only needed when graphs run in async mode
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    async def connect() -> AsyncSqliteSaver:
+        return AsyncSqliteSaver(await connect_aiosqlite(DATABASE_PATH))
+
+    return run_coroutine(connect())
 
 
 @st.cache_resource
 def init_chat_app(
-    model_name: str, temperature: float = 0.0, rag_n_docs: int = 5
+    model_name: str,
+    temperature: float = 0.0,
+    rag_n_docs: int = 5,
+    relevance_filter: RelevanceFilterMode = RELEVANCE_FILTER,
+    execution: GraphExecution = GRAPH_EXECUTION,
 ) -> CompiledStateGraph:
     """Initialize chat LangGraph application
 
@@ -89,68 +194,165 @@ def init_chat_app(
         model_name (str): name of the OpenAI's LLM model to use
         temperature (float): temperature setting for the chat model.
         rag_n_docs (int): number of documents used during RAG. Defaults to 5.
-        Defaults to None.
+        relevance_filter (RelevanceFilterMode): filter applied to retrieved documents.
+            Defaults to RELEVANCE_FILTER.
+        execution (GraphExecution): `async` checkpoints states with the async
+            checkpointer, for use with `chat_astream`. Defaults to GRAPH_EXECUTION.
 
     Returns:
         CompiledStateGraph: chat LangGraph application
     """
-
-    workflow = StateGraph(state_schema=MessagesState)
     model = ChatOpenAI(model_name=model_name, temperature=temperature)
-    llm = OpenAI(temperature=0)
-
-    _filter = LLMChainFilter.from_llm(llm)
-    base_retriever = vector_store.as_retriever(
-        search_kwargs={
-            "k": rag_n_docs,
-            "filter": {"detection_class_prob": {"$gte": 0.75}},
-        }
+    # grading output must not be streamed into the chat
+    filter_llm = ChatOpenAI(model_name=model_name, temperature=0, tags=[TAG_NOSTREAM])
+    checkpointer = (
+        get_async_checkpointer() if execution == "async" else get_checkpointer()
     )
-    compression_retriever = ContextualCompressionRetriever(
-        base_compressor=_filter, base_retriever=base_retriever
+    return build_chat_graph(
+        model, filter_llm, checkpointer, model_name, rag_n_docs, relevance_filter
     )
 
+
+def build_chat_graph(
+    model: BaseChatModel,
+    filter_llm: BaseChatModel,
+    checkpointer: BaseCheckpointSaver,
+    model_name: str,
+    rag_n_docs: int = 5,
+    relevance_filter: RelevanceFilterMode = RELEVANCE_FILTER,
+) -> CompiledStateGraph:
+    """Builds the chat LangGraph application. Models are called synchronously when
+    the graph is run with `stream`, and asynchronously with `astream`.
+
+    Args:
+        model (BaseChatModel): chat model
+        filter_llm (BaseChatModel): model grading retrieved documents
+        checkpointer (BaseCheckpointSaver): memory of the conversations
+        model_name (str): name of the chat model, identifying cached retrievals
+        rag_n_docs (int): number of documents used during RAG. Defaults to 5.
+        relevance_filter (RelevanceFilterMode): filter applied to retrieved documents.
+            Defaults to RELEVANCE_FILTER.
+
+    Returns:
+        CompiledStateGraph: chat LangGraph application
+    """
+    workflow = StateGraph(state_schema=ChatState)
+
+    embeddings = get_embeddings()
+    vector_store = get_vector_store()
+    lexical_index = get_lexical_index()
+    retrieval_cache = get_retrieval_cache()
+    _filter = make_relevance_filter(relevance_filter, filter_llm, embeddings)
+    search_filter = {"detection_class_prob": {"$gte": 0.75}}
+    # cached results are only reused with the same retrieval settings
+    cache_namespace = json.dumps(
+        ["hybrid", VECTOR_STORE_BACKEND, EMBEDDING_MODEL, rag_n_docs, relevance_filter]
+        + ([model_name] if relevance_filter == "batched_llm" else [])
+    )
+
+    def search(query: str, query_vector: list[float]) -> list[Document]:
+        # dense search misses exact terms (algorithm names, symbols, identifiers)
+        dense_docs = vector_store.similarity_search_by_vector(
+            query_vector, k=rag_n_docs, filter=search_filter
+        )
+        lexical_docs = lexical_index.search(query, k=rag_n_docs, _filter=search_filter)
+        retrieved_docs = reciprocal_rank_fusion([dense_docs, lexical_docs])[:rag_n_docs]
+        if _filter is not None:
+            start = time.perf_counter()
+            n_retrieved = len(retrieved_docs)
+            retrieved_docs = list(_filter.compress_documents(retrieved_docs, query))
+            logging.info(
+                "%s filter kept %s of %s documents in %.3fs",
+                relevance_filter,
+                len(retrieved_docs),
+                n_retrieved,
+                time.perf_counter() - start,
+            )
+        return retrieved_docs
+
     @tool(response_format="content_and_artifact")
     def retrieve(query: str):
         """Retrieve information related to a query"""
         logging.info("triggering document retrieval")
-        retrieved_docs = compression_retriever.invoke(query)
+        retrieved_docs = retrieval_cache.get_or_retrieve(
+            cache_namespace,
+            query,
+            embeddings.embed_query,
+            lambda query_vector: search(query, query_vector),
+        )
+        logging.info("Retrieval cache stats: %s", retrieval_cache.stats())
         serialized = _parse_retrieved_into_context(retrieved_docs)
         _update_source_retrieval_count(retrieved_docs)
         return serialized, retrieved_docs
 
     tools = ToolNode([retrieve])
 
-    def set_conversation_title(state: MessagesState, config: RunnableConfig):
+    # titles and summaries must not be streamed into the chat
+    title_model = model.with_config(tags=[TAG_NOSTREAM])
+    summary_model = model.with_config(tags=[TAG_NOSTREAM])
+    llm_with_retrieval = model.bind_tools([retrieve])
+
+    def title_prompt(state: ChatState) -> list[SystemMessage]:
+        return [
+            SystemMessage(f"""Based on user message, try to detect a conversation title
+            with a meaningful topic (max 5 words). If not possible, simply return UNKNOWN
+
+            Message is: {state["messages"]}""")
+        ]
+
+    def save_title(config: RunnableConfig, title: str):
+        if title != "UNKNOWN":
+            save_conversation_title(config["configurable"]["thread_id"], title)
+
+    def set_conversation_title(state: ChatState, config: RunnableConfig):
         if not config["configurable"]["has_title"]:
-            prompt = [
-                SystemMessage(
-                    f"""Based on user message, try to detect a conversation title
-                with a meaningful topic (max 5 words). If not possible, simply return UNKNOWN
-
-                Message is: {state["messages"]}"""
-                )
-            ]
-            model.disable_streaming = True
-            response = model.invoke(prompt)
-            model.disable_streaming = False
-            if response.content != "UNKNOWN":
-                save_conversation_title(
-                    config["configurable"]["thread_id"], response.content
-                )
+            response = title_model.invoke(title_prompt(state))
+            save_title(config, response.content)
 
         return {"messages": state["messages"]}
 
+    async def aset_conversation_title(state: ChatState, config: RunnableConfig):
+        if not config["configurable"]["has_title"]:
+            response = await title_model.ainvoke(title_prompt(state))
+            await asyncio.to_thread(save_title, config, response.content)
+
+        return {"messages": state["messages"]}
+
+    def memory_to_fold(state: ChatState) -> tuple[int, list[BaseMessage]]:
+        n_summarized = state.get("n_summarized", 0)
+        window_start = memory_window_start(state["messages"], n_summarized)
+        return window_start, state["messages"][n_summarized:window_start]
+
+    def update_memory(state: ChatState):
+        """Fold turns leaving the memory window into the conversation summary."""
+        window_start, to_fold = memory_to_fold(state)
+        if not to_fold:
+            return {}
+        response = summary_model.invoke(summary_prompt(state.get("summary"), to_fold))
+        return {"summary": response.content, "n_summarized": window_start}
+
+    async def aupdate_memory(state: ChatState):
+        window_start, to_fold = memory_to_fold(state)
+        if not to_fold:
+            return {}
+        response = await summary_model.ainvoke(
+            summary_prompt(state.get("summary"), to_fold)
+        )
+        return {"summary": response.content, "n_summarized": window_start}
+
     # Step 1: query retrieval or respond directly
-    def query_or_respond(state: MessagesState):
+    def query_or_respond(state: ChatState):
         """Generate tool call for retrieval or respond."""
-        llm_with_retrieval = model.bind_tools([retrieve])
-        prompt = [SystemMessage(BASE_SYSTEM_MSG)] + state["messages"]
+        prompt = [SystemMessage(BASE_SYSTEM_MSG)] + memory_messages(state)
         response = llm_with_retrieval.invoke(prompt)
         return {"messages": [response]}
 
-    def generate(state: MessagesState):
-        """Generate answer."""
+    async def aquery_or_respond(state: ChatState):
+        prompt = [SystemMessage(BASE_SYSTEM_MSG)] + memory_messages(state)
+        response = await llm_with_retrieval.ainvoke(prompt)
+        return {"messages": [response]}
+
+    def generation_prompt(state: ChatState) -> list[BaseMessage]:
         # Get generated ToolMessages
         recent_tool_messages = []
         for message in reversed(state["messages"]):
@@ -171,24 +373,38 @@ def init_chat_app(
         )
         conversation_messages = [
             message
-            for message in state["messages"]
+            for message in memory_messages(state)
             if message.type in ("human", "system")
             or (message.type == "ai" and not message.tool_calls)
         ]
-        prompt = [SystemMessage(system_message_content)] + conversation_messages
+        return [SystemMessage(system_message_content)] + conversation_messages
+
+    def generate(state: ChatState):
+        """Generate answer."""
+        response = model.invoke(generation_prompt(state))
+        return {"messages": [response]}
 
-        # Run
-        response = model.invoke(prompt)
+    async def agenerate(state: ChatState):
+        response = await model.ainvoke(generation_prompt(state))
         return {"messages": [response]}
 
     # add chat model to graph
-    workflow.add_node("set_conversation_title", set_conversation_title)
-    workflow.add_node("query_or_respond", query_or_respond)
+    workflow.add_node(
+        "set_conversation_title",
+        RunnableLambda(set_conversation_title, afunc=aset_conversation_title),
+    )
+    workflow.add_node(
+        "update_memory", RunnableLambda(update_memory, afunc=aupdate_memory)
+    )
+    workflow.add_node(
+        "query_or_respond", RunnableLambda(query_or_respond, afunc=aquery_or_respond)
+    )
     workflow.add_node("tools", tools)
-    workflow.add_node("generate", generate)
+    workflow.add_node("generate", RunnableLambda(generate, afunc=agenerate))
 
     workflow.set_entry_point("set_conversation_title")
-    workflow.add_edge("set_conversation_title", "query_or_respond")
+    workflow.add_edge("set_conversation_title", "update_memory")
+    workflow.add_edge("update_memory", "query_or_respond")
     workflow.add_conditional_edges(
         "query_or_respond",
         tools_condition,
@@ -197,12 +413,8 @@ def init_chat_app(
     workflow.add_edge("tools", "generate")
     workflow.add_edge("generate", END)
 
-    # add SQLite memory checkpoint
-    conn = sqlite3.connect("data/conversations.db", check_same_thread=False)
-    memory = SqliteSaver(conn)
-
-    # compile graph
-    workflow = workflow.compile(checkpointer=memory)
+    # compile graph, with SQLite memory checkpoint
+    workflow = workflow.compile(checkpointer=checkpointer)
 
     return workflow
 
@@ -221,3 +433,19 @@ def chat_stream(
     }
     messages = [HumanMessage(query)]
     return wf.stream({"messages": messages}, config=config, stream_mode="messages")
+
+
+def chat_astream(
+    wf: CompiledStateGraph, query: str, thread_id: str, has_title: bool
+) -> AsyncIterator[dict[str, Any] | Any]:
+    """
+    Trigger chat conversation stream, for apps initialized in async mode
+    """
+    config = {
+        "configurable": {
+            "thread_id": thread_id,
+            "has_title": has_title,
+        }
+    }
+    messages = [HumanMessage(query)]
+    return wf.astream({"messages": messages}, config=config, stream_mode="messages")
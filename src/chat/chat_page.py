@@ -4,30 +4,72 @@ Page for chating with LLM. User can upload documents and interact with them thro
 
 import os
 import uuid
+from collections import OrderedDict
 
 import streamlit as st
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 
-from chat.chat_model import chat_stream, init_chat_app
+from chat.chat_model import (
+    CHAT_HISTORY_SOURCE,
+    chat_astream,
+    chat_stream,
+    fetch_checkpoint_history,
+    init_chat_app,
+)
+from chat.checkpoint_retention import get_checkpoint_maintenance
 from chat.db.database import (
+    append_messages,
     delete_conversation,
-    fetch_conversation_title,
-    fetch_conversations_as_dict,
+    fetch_conversation_listing,
+    fetch_conversation_messages,
+    fetch_conversation_titles,
     save_conversation,
-    update_conversation,
 )
-from chat.vector_store import source_to_vector_store
+from chat.ingestion_jobs import get_ingestion_worker
+from chat.ingestion_progress import render_active_ingestion_jobs
+from chat.relevance import RELEVANCE_FILTER, RELEVANCE_FILTER_MODES
 from helpers import stream_llm_response_with_status
+from utils.aio import GRAPH_EXECUTION
 
 RAG_DOCUMENTS_DIR = "./data/rag"
+# messages of a conversation loaded at once
+HISTORY_PAGE_SIZE = 50
+# conversations listed in the sidebar at once
+CONVERSATIONS_PAGE_SIZE = 20
+# conversations whose history is kept in session state
+OPEN_CONVERSATIONS_LRU_SIZE = 5
 
 os.makedirs(RAG_DOCUMENTS_DIR, exist_ok=True)
 
+ingestion_worker = get_ingestion_worker()
+get_checkpoint_maintenance()
+
+
+def load_more_conversations():
+    """Adds the next page of conversations, most recent first, to the sidebar"""
+    page = fetch_conversation_listing(
+        limit=CONVERSATIONS_PAGE_SIZE, after=st.session_state.conversations_cursor
+    )
+    for conv_id, title, _ in page:
+        st.session_state.conversation_ids.append(conv_id)
+        # untitled conversations are cached too, so that they are not looked up again
+        st.session_state.conversations_titles[conv_id] = title
+    if page:
+        last_id, _, last_date = page[-1]
+        st.session_state.conversations_cursor = (last_date, last_id)
+    st.session_state.has_more_conversations = len(page) == CONVERSATIONS_PAGE_SIZE
+
+
 if "chat_history" not in st.session_state:
-    st.session_state.chat_history = fetch_conversations_as_dict()
-    st.session_state.conversation_ids = list(st.session_state.chat_history.keys())
+    # loaded pages of the history of recently opened conversations
+    st.session_state.chat_history = OrderedDict()
+    # position of the first loaded message of each opened conversation
+    st.session_state.history_start_seq = {}
+    st.session_state.conversation_ids = []
+    st.session_state.conversations_cursor = None
     st.session_state.conversations_titles = {}
     st.session_state.current_conversation = None
+    load_more_conversations()
 
 
 def render_human_msg(prompt_text: str):
@@ -52,11 +94,50 @@ def render_human_msg(prompt_text: str):
     )
 
 
+def load_earlier_messages(c_index: str):
+    """Loads the page of messages preceding the loaded history of a conversation"""
+    fetch_history = (
+        fetch_checkpoint_history
+        if CHAT_HISTORY_SOURCE == "checkpoint"
+        else fetch_conversation_messages
+    )
+    messages = fetch_history(
+        c_index,
+        before_seq=st.session_state.history_start_seq.get(c_index),
+        limit=HISTORY_PAGE_SIZE,
+    )
+    st.session_state.chat_history[c_index] = [
+        (message.role, message.content) for message in messages
+    ] + st.session_state.chat_history.get(c_index, [])
+    st.session_state.history_start_seq[c_index] = messages[0].seq if messages else 0
+
+
+def open_conversation_history(c_index: str) -> list[tuple[str, str]]:
+    """Loaded history of a conversation. Only the histories of the most recently
+    opened conversations are kept in session state."""
+    chat_history = st.session_state.chat_history
+    if c_index not in chat_history:
+        load_earlier_messages(c_index)
+    chat_history.move_to_end(c_index)
+    while len(chat_history) > OPEN_CONVERSATIONS_LRU_SIZE:
+        evicted, _ = chat_history.popitem(last=False)
+        st.session_state.history_start_seq.pop(evicted, None)
+    return chat_history[c_index]
+
+
 def render_chat_history():
-    """Renders the entire chat history of the current conversation"""
-    for role, msg in st.session_state.chat_history[
-        st.session_state.current_conversation
-    ]:
+    """Renders the loaded chat history of the current conversation"""
+    c_index = st.session_state.current_conversation
+    history = open_conversation_history(c_index)
+    if st.session_state.history_start_seq[c_index] > 0:
+        st.button(
+            "Show earlier messages",
+            icon="⬆️",
+            type="tertiary",
+            on_click=load_earlier_messages,
+            args=[c_index],
+        )
+    for role, msg in history:
         if role == "ai":
             st.text(" ")
             st.markdown(msg)
@@ -72,13 +153,15 @@ def on_set_conversation(c_index: str):
 
 def get_conversation_title(c_index: str) -> str | None:
     """Gets the conversation title, if any."""
-    if c_index in st.session_state.conversations_titles:
-        return st.session_state.conversations_titles[c_index]
-    conv_title = fetch_conversation_title(c_index)
-    if conv_title is None:
-        return None
-    st.session_state.conversations_titles[c_index] = conv_title.title
-    return conv_title.title
+    if c_index not in st.session_state.conversations_titles:
+        refresh_conversation_title(c_index)
+    return st.session_state.conversations_titles[c_index]
+
+
+def refresh_conversation_title(c_index: str):
+    """Fetches the title of a conversation, which may have been set by the chat app"""
+    titles = fetch_conversation_titles([c_index])
+    st.session_state.conversations_titles[c_index] = titles.get(c_index)
 
 
 @st.dialog("Confirm deletion")
@@ -94,9 +177,9 @@ def on_delete_conversation(c_index: str):
             if st.session_state.current_conversation == c_index
             else st.session_state.current_conversation
         )
-        if c_index in st.session_state.conversations_titles:
-            del st.session_state.conversations_titles[c_index]
-        del st.session_state.chat_history[c_index]
+        st.session_state.conversations_titles.pop(c_index, None)
+        st.session_state.chat_history.pop(c_index, None)
+        st.session_state.history_start_seq.pop(c_index, None)
         st.session_state.conversation_ids.remove(c_index)
         delete_conversation(c_index)
         st.rerun()
@@ -105,24 +188,25 @@ def on_delete_conversation(c_index: str):
 def on_new_conversation():
     """Adds a new conversation with a random id"""
     new_id = str(uuid.uuid4())
-    st.session_state.conversation_ids.append(new_id)
+    st.session_state.conversation_ids.insert(0, new_id)
+    st.session_state.conversations_titles[new_id] = None
     st.session_state.chat_history[new_id] = []
+    st.session_state.history_start_seq[new_id] = 0
     st.session_state.current_conversation = new_id
     save_conversation(new_id, [])
 
 
 def load_pdfs(files: list[UploadedFile]):
-    """Loads pdfs into vector store
+    """Queues pdfs for ingestion into vector store. Files are processed in background.
 
     Args:
         files (list[UploadedFile]): list of uploaded pdf files.
     """
     for uploaded_file in files:
-        st.write(f"adding {uploaded_file.name} to database")
         file_path = os.path.join(RAG_DOCUMENTS_DIR, uploaded_file.name)
         with open(file_path, "wb") as f:
             f.write(uploaded_file.getbuffer())
-        source_to_vector_store(file_path, source_type="pdf")
+        ingestion_worker.submit(file_path, "pdf")
 
 
 @st.dialog("Add material")
@@ -140,21 +224,22 @@ def on_new_rag_source():
             if confirm:
                 files_container.empty()
                 confirm_container.empty()
+                load_pdfs(files)
                 st.markdown(
-                    ":warning: Please **don't navigate away** while processing files"
+                    "Files are processed in the background, you can keep using the app."
                 )
-                with st.status("Processing files"):
-                    load_pdfs(files)
-                st.rerun()
+                render_active_ingestion_jobs()
     elif selected_option == "website":
         website_url = st.text_input("enter url here")
         confirm_container = st.empty()
         confirm = confirm_container.button("Confirm")
         if confirm and len(website_url) > 0:
             confirm_container.empty()
-            with st.status("Processing website"):
-                source_to_vector_store(website_url, "website")
-            st.rerun()
+            ingestion_worker.submit(website_url, "website")
+            st.markdown(
+                "Website is processed in the background, you can keep using the app."
+            )
+            render_active_ingestion_jobs()
 
 
 def render_chat_buttons():
@@ -198,6 +283,13 @@ def render_chat_buttons():
                 use_container_width=True,
                 type="tertiary",
             )
+    if st.session_state.has_more_conversations:
+        st.sidebar.button(
+            "Load more",
+            on_click=load_more_conversations,
+            use_container_width=True,
+            type="tertiary",
+        )
 
 
 def store_temperature_value():
@@ -210,6 +302,11 @@ def store_rag_n_docs():
     st.session_state["rag_n_docs"] = st.session_state["_rag_n_docs"]
 
 
+def store_relevance_filter():
+    """Stores RAG relevance filter into more persistant session state variable"""
+    st.session_state["relevance_filter"] = st.session_state["_relevance_filter"]
+
+
 temperature = st.sidebar.slider(
     "Model temperature",
     0.0,
@@ -229,9 +326,24 @@ rag_n_docs = st.sidebar.slider(
     on_change=store_rag_n_docs,
 )
 
+relevance_filter = st.sidebar.selectbox(
+    "RAG Relevance Filter",
+    RELEVANCE_FILTER_MODES,
+    index=RELEVANCE_FILTER_MODES.index(
+        st.session_state.get("relevance_filter", RELEVANCE_FILTER)
+    ),
+    key="_relevance_filter",
+    on_change=store_relevance_filter,
+)
+
 model_name = st.sidebar.selectbox("Chat model", ("gpt-4o-mini"))
 
-chat_app = init_chat_app(model_name, temperature=temperature, rag_n_docs=rag_n_docs)
+chat_app = init_chat_app(
+    model_name,
+    temperature=temperature,
+    rag_n_docs=rag_n_docs,
+    relevance_filter=relevance_filter,
+)
 
 
 render_chat_buttons()
@@ -249,9 +361,10 @@ if st.session_state.current_conversation is not None:
         current_conversation = st.session_state.current_conversation
         coco_title = get_conversation_title(current_conversation)
         render_human_msg(prompt.text)
+        stream_chat = chat_astream if GRAPH_EXECUTION == "async" else chat_stream
         llm_response = st.write_stream(
             stream_llm_response_with_status(
-                chat_stream(
+                stream_chat(
                     chat_app,
                     prompt.text,
                     current_conversation,
@@ -264,14 +377,13 @@ if st.session_state.current_conversation is not None:
         new_messages = [("human", prompt.text), ("ai", llm_response)]
         # update session state with new messages
         st.session_state.chat_history[current_conversation].extend(new_messages)
-        update_conversation(
-            current_conversation, st.session_state.chat_history[current_conversation]
-        )
-        if (
-            coco_title is None
-            and get_conversation_title(current_conversation) is not None
-        ):
-            st.rerun()
+        if CHAT_HISTORY_SOURCE == "messages":
+            append_messages(current_conversation, new_messages)
+        if coco_title is None:
+            # the chat app titles the conversation on its first turns
+            refresh_conversation_title(current_conversation)
+            if get_conversation_title(current_conversation) is not None:
+                st.rerun()
 else:
     _, col2, _ = st.columns((0.2, 0.6, 0.2), vertical_alignment="center")
     container = col2.container(border=True)
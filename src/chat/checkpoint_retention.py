@@ -0,0 +1,93 @@
+"""
+Retention of LangGraph checkpoints in the conversations database, and periodic
+compaction of the file
+"""
+
+import atexit
+import os
+import threading
+
+from chat.db.database import (
+    compact_database,
+    enable_incremental_vacuum,
+    prune_checkpoints,
+)
+from utils.lazy import lazy_singleton
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+CHECKPOINT_KEEP_LAST = int(os.environ.get("CHECKPOINT_KEEP_LAST", "10"))
+CHECKPOINT_COMPACTION_HOURS = float(os.environ.get("CHECKPOINT_COMPACTION_HOURS", "24"))
+# the first run waits, so that it does not compete with the app starting up
+CHECKPOINT_MAINTENANCE_DELAY_MINUTES = float(
+    os.environ.get("CHECKPOINT_MAINTENANCE_DELAY_MINUTES", "10")
+)
+
+
+class CheckpointMaintenance:
+    """
+    Background job pruning old checkpoints of every thread and compacting the
+    database, `delay_seconds` after start and then every `interval_seconds`
+    """
+
+    def __init__(
+        self,
+        keep_last: int = CHECKPOINT_KEEP_LAST,
+        interval_seconds: float = CHECKPOINT_COMPACTION_HOURS * 3600,
+        delay_seconds: float = CHECKPOINT_MAINTENANCE_DELAY_MINUTES * 60,
+    ):
+        """
+        Args:
+            keep_last (int): checkpoints kept per thread
+            interval_seconds (float): time between two runs
+            delay_seconds (float): time before the first run
+        """
+        self.keep_last = keep_last
+        self.interval_seconds = interval_seconds
+        self.delay_seconds = delay_seconds
+        self.last_reclaimed_bytes: int | None = None
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="checkpoint-maintenance", daemon=True
+        )
+        self._thread.start()
+
+    def run_once(self) -> int:
+        """Prunes checkpoints of all threads, then compacts the database
+
+        Returns:
+            int: bytes reclaimed
+        """
+        n_deleted = prune_checkpoints(self.keep_last)
+        logger.info("Pruned %s old checkpoints", n_deleted)
+        self.last_reclaimed_bytes = compact_database()
+        return self.last_reclaimed_bytes
+
+    def close(self):
+        """Stops the background thread, waiting for a running compaction"""
+        self._closed.set()
+        self._thread.join()
+
+    def _run(self):
+        self._closed.wait(self.delay_seconds)
+        while not self._closed.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Checkpoint maintenance failed")
+            self._closed.wait(self.interval_seconds)
+
+
+@lazy_singleton
+def get_checkpoint_maintenance() -> CheckpointMaintenance:
+    """Maintenance job of this process, started on first call"""
+    maintenance = CheckpointMaintenance()
+    atexit.register(maintenance.close)
+    return maintenance
+
+
+if __name__ == "__main__":
+    # databases created before incremental auto-vacuum are only compacted once
+    # switched, which rewrites the file. Run while the app is stopped, see README
+    enable_incremental_vacuum()
@@ -0,0 +1,88 @@
+"""
+Memory of a conversation given to the chat model: the last turns verbatim, within a
+token budget, and a rolling summary of the older ones
+"""
+
+import os
+
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langgraph.graph import MessagesState
+
+CHAT_MEMORY_MAX_TURNS = int(os.environ.get("CHAT_MEMORY_MAX_TURNS", "10"))
+CHAT_MEMORY_TOKEN_BUDGET = int(os.environ.get("CHAT_MEMORY_TOKEN_BUDGET", "4000"))
+CHAT_MEMORY_SUMMARY_WORDS = int(os.environ.get("CHAT_MEMORY_SUMMARY_WORDS", "250"))
+
+
+class ChatState(MessagesState):
+    """
+    Messages of a conversation, all kept for its history, with the summary of the
+    first `n_summarized` ones, which are no longer given to the chat model
+    """
+
+    summary: str
+    n_summarized: int
+
+
+def _turn_starts(messages: list[BaseMessage]) -> list[int]:
+    """Positions of the messages starting a turn, i.e. the user messages"""
+    return [i for i, message in enumerate(messages) if message.type == "human"]
+
+
+def memory_window_start(
+    messages: list[BaseMessage],
+    n_summarized: int = 0,
+    max_turns: int = CHAT_MEMORY_MAX_TURNS,
+    token_budget: int = CHAT_MEMORY_TOKEN_BUDGET,
+) -> int:
+    """Position of the first message kept verbatim: the last `max_turns` turns whose
+    messages fit in `token_budget`, and at least the current turn. Already summarized
+    messages are never kept.
+
+    Args:
+        messages (list[BaseMessage]): messages of the conversation
+        n_summarized (int): messages already folded into the summary
+        max_turns (int): maximum number of turns kept verbatim
+        token_budget (int): maximum number of tokens of the kept turns
+    """
+    starts = [start for start in _turn_starts(messages) if start >= n_summarized]
+    if not starts:
+        return n_summarized
+    window_start = starts[-1]
+    n_tokens = count_tokens_approximately(messages[window_start:])
+    for start in reversed(starts[-max_turns:-1]):
+        n_tokens += count_tokens_approximately(messages[start:window_start])
+        if n_tokens > token_budget:
+            break
+        window_start = start
+    return window_start
+
+
+def summary_prompt(summary: str, messages: list[BaseMessage]) -> list[SystemMessage]:
+    """Prompt folding messages leaving the memory window into the summary"""
+    lines = "\n".join(
+        f"{message.type}: {message.text()}"
+        for message in messages
+        if message.type == "human" or (message.type == "ai" and not message.tool_calls)
+    )
+    return [SystemMessage(f"""You keep a running summary of a conversation between a
+        user learning reinforcement learning and an assistant.
+
+        Current summary: {summary or "(empty)"}
+
+        Messages to add to the summary:
+        {lines}
+
+        Return the updated summary, in at most {CHAT_MEMORY_SUMMARY_WORDS} words. Keep
+        the topics discussed, what the user already knows or struggles with, and any
+        facts or preferences they shared. Only return the summary.""")]
+
+
+def memory_messages(state: ChatState) -> list[BaseMessage]:
+    """Messages of the conversation given to the chat model: the summary, if any,
+    followed by the messages kept verbatim"""
+    summary = state.get("summary")
+    recent = state["messages"][state.get("n_summarized", 0) :]
+    if not summary:
+        return recent
+    return [SystemMessage(f"Summary of the earlier conversation: {summary}")] + recent
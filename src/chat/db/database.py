@@ -3,30 +3,101 @@ Database helper functions for chat-related operations
 """
 
 import datetime
+import json
+import time
 from typing import Any
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import and_, func, inspect, or_, text
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import sessionmaker
-
-from chat.db.models import Base, ChatSource, Conversation, ConversationTitle
+from sqlalchemy.orm import Session, sessionmaker
+
+from chat.db.models import (
+    Base,
+    ChatSource,
+    ContentFingerprint,
+    Conversation,
+    ConversationTitle,
+    DuplicateChunk,
+    IngestionJob,
+    Message,
+)
+from utils.lazy import lazy_singleton
 from utils.logger import setup_logger
+from utils.sqlite import get_engine
 
 # Set up logging
 logger = setup_logger(__name__)
 
-DATABASE_URL = "sqlite:///data/conversations.db"
+DATABASE_PATH = "data/conversations.db"
+
+engine = get_engine(DATABASE_PATH)
+
+_session_factory = sessionmaker(bind=engine)
+
+
+def SessionLocal() -> Session:
+    """Opens a database session, initializing the database on first use"""
+    _init_db_once()
+    return _session_factory()
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 
-SessionLocal = sessionmaker(bind=engine)
+def _add_missing_columns():
+    """Adds columns and indexes declared in models but missing in tables created by
+    older versions"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = (
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                    f"{column.type.compile(engine.dialect)}"
+                )
+                if column.default is not None and column.default.is_scalar:
+                    ddl += f" DEFAULT {column.default.arg!r}"
+                conn.execute(text(ddl))
+                logger.info("Added column %s.%s", table.name, column.name)
+            # indexes of existing tables are not created by create_all
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def _migrate_conversation_messages():
+    """Moves histories stored in the legacy `conversations.messages` JSON column into
+    the `messages` table, one row per message"""
+    with engine.begin() as conn:
+        legacy = conn.execute(
+            text(
+                "SELECT id, messages FROM conversations WHERE messages IS NOT NULL "
+                "AND messages NOT IN ('null', '[]')"
+            )
+        ).fetchall()
+        for conv_id, messages in legacy:
+            rows = [
+                {"conversation_id": conv_id, "seq": seq, "role": role, "content": msg}
+                for seq, (role, msg) in enumerate(json.loads(messages))
+            ]
+            conn.execute(Message.__table__.insert(), rows)
+            conn.execute(
+                text("UPDATE conversations SET messages = NULL WHERE id = :id"),
+                {"id": conv_id},
+            )
+        if legacy:
+            logger.info("Migrated messages of %s conversations", len(legacy))
 
 
 def init_db():
     """Initialize the database and create tables if they don't exist"""
     try:
+        if not inspect(engine).get_table_names():
+            # instant on an empty file
+            enable_incremental_vacuum()
         # Create all tables
         Base.metadata.create_all(engine)
+        _add_missing_columns()
+        _migrate_conversation_messages()
         logger.info("Database tables created successfully")
 
         # Verify table exists
@@ -44,44 +115,93 @@ def init_db():
         raise
 
 
-# Initialize database on module import
-init_db()
+# initialized on first session rather than on import, to keep page loads fast
+_init_db_once = lazy_singleton(init_db)
 
 
-def fetch_conversations_as_dict() -> list[dict[str, Any]]:
-    """Fetch all conversations from the database"""
+def fetch_conversation_listing(
+    limit: int = 20, after: tuple[datetime.datetime, str] | None = None
+) -> list[tuple[str, str | None, datetime.datetime]]:
+    """Fetch a page of conversations, most recent first, without their messages
+
+    Args:
+        limit (int): maximum number of conversations. Defaults to 20.
+        after (tuple[datetime.datetime, str], optional): (date, id) of the last
+            conversation of the previous page. Defaults to None, fetching the first page.
+
+    Returns:
+        list[tuple[str, str | None, datetime.datetime]]: id, title and date of each
+            conversation
+    """
     with SessionLocal() as session:
-        conversations = session.query(Conversation).all()
-        return {conv.id: conv.messages for conv in conversations}
+        # correlated lookup through the conversation_id index, only for listed rows
+        title = (
+            session.query(ConversationTitle.title)
+            .filter(ConversationTitle.conversation_id == Conversation.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        query = session.query(Conversation.id, title, Conversation.date)
+        if after is not None:
+            date, conv_id = after
+            query = query.filter(
+                or_(
+                    Conversation.date < date,
+                    and_(Conversation.date == date, Conversation.id < conv_id),
+                )
+            )
+        rows = query.order_by(Conversation.date.desc(), Conversation.id.desc())
+        return [tuple(row) for row in rows.limit(limit)]
+
+
+def fetch_conversation_messages(
+    conv_id: str, before_seq: int | None = None, limit: int = 50
+) -> list[Message]:
+    """Fetch a page of messages of a conversation
 
+    Args:
+        conv_id (str): id of the conversation
+        before_seq (int, optional): only fetch messages preceding this position.
+            Defaults to None, fetching the latest messages.
+        limit (int): maximum number of messages. Defaults to 50.
 
-def fetch_conversation_titles() -> dict[str, str]:
-    """Fetch all conversation titles from db"""
+    Returns:
+        list[Message]: the `limit` messages preceding `before_seq`, oldest first
+    """
     with SessionLocal() as session:
-        titles = session.query(ConversationTitle).all()
-        return {title.conversation_id: title.title for title in titles}
+        query = session.query(Message).filter(Message.conversation_id == conv_id)
+        if before_seq is not None:
+            query = query.filter(Message.seq < before_seq)
+        messages = query.order_by(Message.seq.desc()).limit(limit).all()
+        return messages[::-1]
+
+
+def fetch_conversation_titles(conv_ids: list[str] | None = None) -> dict[str, str]:
+    """Fetch conversation titles from db
 
+    Args:
+        conv_ids (list[str], optional): conversations whose titles to fetch. Defaults
+            to None, fetching all of them.
 
-def fetch_conversation_title(conv_id: str) -> ConversationTitle | None:
-    """Fetch conversation title associated to id `conv_id`"""
+    Returns:
+        dict[str, str]: title of each conversation that has one
+    """
     with SessionLocal() as session:
-        title = (
-            session.query(ConversationTitle)
-            .filter(ConversationTitle.conversation_id == conv_id)
-            .first()
-        )
-        return title
+        query = session.query(ConversationTitle)
+        if conv_ids is not None:
+            query = query.filter(ConversationTitle.conversation_id.in_(conv_ids))
+        return {title.conversation_id: title.title for title in query}
 
 
 def save_conversation(conv_id: str, messages: list[tuple[str, str]]):
     """Save a conversation to the database"""
-    conversation = Conversation(
-        id=conv_id, messages=messages, date=datetime.datetime.now()
-    )
+    conversation = Conversation(id=conv_id, date=datetime.datetime.now())
     with SessionLocal() as session:
         session.add(conversation)
         session.commit()
         session.refresh(conversation)
+    if messages:
+        append_messages(conv_id, messages)
     return conversation
 
 
@@ -95,30 +215,159 @@ def save_conversation_title(conv_id: str, title: str):
     return conv_title
 
 
-def update_conversation(conv_id: str, messages: list[tuple[str, str]]):
-    """Update a conversation in the database"""
+def append_messages(conv_id: str, messages: list[tuple[str, str]]):
+    """Appends new messages at the end of a conversation
+
+    Args:
+        conv_id (str): id of the conversation
+        messages (list[tuple[str, str]]): (role, content) of the new messages
+    """
     with SessionLocal() as session:
-        conversation = (
-            session.query(Conversation).filter(Conversation.id == conv_id).first()
+        last_seq = (
+            session.query(func.max(Message.seq))
+            .filter(Message.conversation_id == conv_id)
+            .scalar()
         )
-        if conversation:
-            conversation.messages = messages
-            session.commit()
-            session.refresh(conversation)
-            return conversation
-        return None
+        first_seq = 0 if last_seq is None else last_seq + 1
+        session.add_all(
+            [
+                Message(conversation_id=conv_id, seq=seq, role=role, content=content)
+                for seq, (role, content) in enumerate(messages, start=first_seq)
+            ]
+        )
+        session.commit()
 
 
 def delete_conversation(conv_id: str):
-    """Deletes conversation from database"""
+    """Deletes conversation from database, along with its graph checkpoints"""
     with SessionLocal() as session:
+        session.query(Message).filter(Message.conversation_id == conv_id).delete()
         session.query(Conversation).filter(Conversation.id == conv_id).delete()
         session.query(ConversationTitle).filter(
             ConversationTitle.conversation_id == conv_id
         ).delete()
+        for table in _checkpoint_tables(session):
+            session.execute(
+                text(f"DELETE FROM {table} WHERE thread_id = :thread_id"),
+                {"thread_id": conv_id},
+            )
         session.commit()
 
 
+def _checkpoint_tables(session: Session) -> list[str]:
+    """Tables of the LangGraph SqliteSaver, once it has created them"""
+    rows = session.execute(
+        text(
+            "SELECT name FROM sqlite_master WHERE type='table' "
+            "AND name IN ('checkpoints', 'writes')"
+        )
+    )
+    return sorted(row[0] for row in rows)
+
+
+def prune_checkpoints(keep_last: int, thread_id: str | None = None) -> int:
+    """Deletes all but the most recent checkpoints of each conversation thread, and
+    the pending writes of deleted checkpoints
+
+    The chat state is cumulative, so the latest checkpoint alone holds the whole
+    history; older ones only serve time travel.
+
+    Args:
+        keep_last (int): checkpoints kept per thread
+        thread_id (str, optional): thread to prune. Defaults to None, pruning all.
+
+    Returns:
+        int: number of deleted checkpoints
+    """
+    thread_filter = "WHERE thread_id = :thread_id" if thread_id is not None else ""
+    params = {"keep_last": keep_last, "thread_id": thread_id}
+    with SessionLocal() as session:
+        if _checkpoint_tables(session) != ["checkpoints", "writes"]:
+            return 0
+        # checkpoint ids are time-ordered uuids
+        deleted = session.execute(
+            text(
+                "DELETE FROM checkpoints WHERE rowid IN (SELECT rowid FROM ("
+                "SELECT rowid, ROW_NUMBER() OVER (PARTITION BY thread_id, "
+                "checkpoint_ns ORDER BY checkpoint_id DESC) AS recency "
+                f"FROM checkpoints {thread_filter}) WHERE recency > :keep_last)"
+            ),
+            params,
+        ).rowcount
+        if deleted > 0:
+            session.execute(
+                text(
+                    f"DELETE FROM writes {thread_filter or 'WHERE 1'} AND NOT EXISTS "
+                    "(SELECT 1 FROM checkpoints WHERE "
+                    "checkpoints.thread_id = writes.thread_id AND "
+                    "checkpoints.checkpoint_ns = writes.checkpoint_ns AND "
+                    "checkpoints.checkpoint_id = writes.checkpoint_id)"
+                ),
+                params,
+            )
+        session.commit()
+    return deleted
+
+
+def enable_incremental_vacuum():
+    """Switches the database file to incremental auto-vacuum, which `compact_database`
+    needs to release free pages while the app runs.
+
+    The switch rewrites the whole file with a blocking VACUUM. New databases are
+    switched on creation, older ones must be switched once while the app is stopped.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # 2 is incremental auto-vacuum
+        if conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+            return
+        conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        conn.execute(text("VACUUM"))
+    # other pooled connections keep the previous mode until reopened
+    engine.dispose()
+    logger.info("Enabled incremental auto-vacuum of %s", engine.url.database)
+
+
+def compact_database(pages_per_step: int = 1000) -> int:
+    """Returns free pages of the database file to the file system.
+
+    Free pages are released in steps of `pages_per_step`, each a short write
+    transaction, so that chat sessions keep writing meanwhile. Files without
+    incremental auto-vacuum are left as they are, see `enable_incremental_vacuum`.
+
+    Returns:
+        int: bytes reclaimed
+    """
+    _init_db_once()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+
+        def pragma(statement: str) -> int:
+            return conn.execute(text(f"PRAGMA {statement}")).scalar()
+
+        if pragma("auto_vacuum") != 2:
+            logger.warning(
+                "Not compacting %s, incremental auto-vacuum is not enabled",
+                engine.url.database,
+            )
+            return 0
+        page_size = pragma("page_size")
+        n_pages = pragma("page_count")
+        n_free = pragma("freelist_count")
+        while n_free > 0:
+            # each row stepped through frees one page
+            cursor = conn.connection.cursor()
+            cursor.execute(f"PRAGMA incremental_vacuum({pages_per_step})")
+            cursor.fetchall()
+            cursor.close()
+            n_free, previous = pragma("freelist_count"), n_free
+            if n_free >= previous:
+                break
+        # the WAL file grows with the pages written by the vacuum
+        conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        reclaimed = (n_pages - pragma("page_count")) * page_size
+    logger.info("Compacted %s, reclaiming %s bytes", engine.url.database, reclaimed)
+    return reclaimed
+
+
 def fetch_chat_source_by_name(source_name: str) -> ChatSource | None:
     """Fetch chat source by its name
 
@@ -142,13 +391,20 @@ def fetch_all_chat_source() -> list[ChatSource]:
         return session.query(ChatSource).all()
 
 
-def add_chat_source(source_name: str, doc_type: str, n_related_documents: int):
+def add_chat_source(
+    source_name: str,
+    doc_type: str,
+    n_related_documents: int,
+    n_deduplicated_documents: int = 0,
+):
     """Stores new chat datasource. Replace existing one if already exists
 
     Args:
         source_name (str): name of this datasource. Can be filename, url, etc
         doc_type (str): document type
         n_related_documents (int): number of extracted documents associated to this datasource
+        n_deduplicated_documents (int): number of those documents not embedded because
+            their content already was in the vector store
     """
     with SessionLocal() as session:
         chat_source = (
@@ -161,6 +417,7 @@ def add_chat_source(source_name: str, doc_type: str, n_related_documents: int):
                 source_name=source_name,
                 doc_type=doc_type,
                 n_related_documents=n_related_documents,
+                n_deduplicated_documents=n_deduplicated_documents,
                 date_added=datetime.datetime.now(),
             )
             session.add(chat_source)
@@ -168,26 +425,295 @@ def add_chat_source(source_name: str, doc_type: str, n_related_documents: int):
         else:
             chat_source.doc_type = doc_type
             chat_source.n_related_documents = n_related_documents
+            chat_source.n_deduplicated_documents = n_deduplicated_documents
             chat_source.date_added = datetime.datetime.now()
             session.commit()
             session.refresh(chat_source)
 
 
-def update_chat_source_n_retrieved(source_name: str, new_calls: int):
-    """Updates the number of retrieval of source by summing new calls
+def increment_chat_sources_n_retrieved(new_calls: dict[str, int]):
+    """Adds new retrievals to the retrieval counts of data sources, in one statement
 
     Args:
-        source_name (str): data source name
-        new_calls (int): count of new retrievals for this data source
+        new_calls (dict[str, int]): count of new retrievals of each data source name
     """
+    if not new_calls:
+        return
     with SessionLocal() as session:
-        chat_source = (
-            session.query(ChatSource)
-            .filter(ChatSource.source_name == source_name)
-            .first()
+        session.execute(
+            text(
+                "UPDATE chat_source SET n_times_retrieved = "
+                "COALESCE(n_times_retrieved, 0) + :n WHERE source_name = :source_name"
+            ),
+            [{"source_name": name, "n": n} for name, n in new_calls.items()],
         )
-        if not chat_source:
-            return
-        chat_source.n_times_retrieved += new_calls
         session.commit()
-        session.refresh(chat_source)
+
+
+def add_ingestion_job(source_name: str, doc_type: str) -> IngestionJob:
+    """Queues a new ingestion job for a source
+
+    Args:
+        source_name (str): path to source file or url
+        doc_type (str): document type
+    """
+    job = IngestionJob(source_name=source_name, doc_type=doc_type, status="pending")
+    with SessionLocal() as session:
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+    return job
+
+
+def fetch_ingestion_jobs(statuses: list[str] | None = None) -> list[IngestionJob]:
+    """Fetches ingestion jobs, most recent first
+
+    Args:
+        statuses (list[str], optional): only fetch jobs with these statuses
+    """
+    with SessionLocal() as session:
+        query = session.query(IngestionJob)
+        if statuses is not None:
+            query = query.filter(IngestionJob.status.in_(statuses))
+        return query.order_by(IngestionJob.id.desc()).all()
+
+
+def claim_pending_ingestion_jobs() -> list[IngestionJob]:
+    """Marks every pending ingestion job as running and returns them"""
+    with SessionLocal() as session:
+        jobs = (
+            session.query(IngestionJob)
+            .filter(IngestionJob.status == "pending")
+            .order_by(IngestionJob.id)
+            .all()
+        )
+        for job in jobs:
+            job.status = "running"
+            job.date_updated = datetime.datetime.now()
+        session.commit()
+        for job in jobs:
+            session.refresh(job)
+        return jobs
+
+
+def update_ingestion_job(job_id: int, **fields: Any):
+    """Updates progress fields of an ingestion job"""
+    with SessionLocal() as session:
+        session.query(IngestionJob).filter(IngestionJob.id == job_id).update(
+            {**fields, IngestionJob.date_updated: datetime.datetime.now()}
+        )
+        session.commit()
+
+
+def increment_ingestion_job(job_id: int, **increments: int):
+    """Atomically increases progress counters of an ingestion job"""
+    with SessionLocal() as session:
+        session.query(IngestionJob).filter(IngestionJob.id == job_id).update(
+            {
+                **{
+                    getattr(IngestionJob, name): getattr(IngestionJob, name) + value
+                    for name, value in increments.items()
+                },
+                IngestionJob.date_updated: datetime.datetime.now(),
+            }
+        )
+        session.commit()
+
+
+def requeue_interrupted_ingestion_jobs() -> int:
+    """Puts jobs left running by a previous process back in the queue"""
+    with SessionLocal() as session:
+        n_jobs = (
+            session.query(IngestionJob)
+            .filter(IngestionJob.status == "running")
+            .update({IngestionJob.status: "pending"})
+        )
+        session.commit()
+    return n_jobs
+
+
+def register_content_fingerprints(
+    source_name: str,
+    doc_type: str,
+    fingerprints: list[tuple[str, int | None]],
+    documents: list[dict[str, Any]],
+    max_hamming_distance: int = 3,
+) -> list[bool]:
+    """Registers fingerprints of chunks of a source, detecting duplicated content.
+
+    A chunk is a duplicate if its content hash, or a simhash within
+    `max_hamming_distance` bits, is registered by another source. Duplicates are linked
+    to that fingerprint along with their document, other chunks are registered as owned
+    by `source_name`.
+
+    Args:
+        source_name (str): source the chunks belong to
+        doc_type (str): document type of the source
+        fingerprints (list[tuple[str, int | None]]): content hash and 64-bit simhash of
+            each chunk. Simhash is None for texts too short for near-duplicate detection.
+        documents (list[dict[str, Any]]): page content and metadata of each chunk
+        max_hamming_distance (int): maximum number of differing simhash bits of
+            near-duplicates. Must be lower than 4, the number of bands. Defaults to 3.
+
+    Returns:
+        list[bool]: whether each chunk is a duplicate
+    """
+    now = time.time()
+    is_duplicate = []
+    with SessionLocal() as session:
+        for (content_hash, simhash), document in zip(fingerprints, documents):
+            match = (
+                session.query(ContentFingerprint)
+                .filter(ContentFingerprint.content_hash == content_hash)
+                .first()
+            )
+            if match is None and simhash is not None:
+                bands = _simhash_bands(simhash)
+                candidates = session.query(ContentFingerprint).filter(
+                    ContentFingerprint.source_name != source_name,
+                    or_(
+                        *[
+                            getattr(ContentFingerprint, f"band_{i}") == band
+                            for i, band in enumerate(bands)
+                        ]
+                    ),
+                )
+                match = next(
+                    (
+                        candidate
+                        for candidate in candidates
+                        if _hamming_distance(candidate.simhash, simhash)
+                        <= max_hamming_distance
+                    ),
+                    None,
+                )
+            if match is not None and match.source_name != source_name:
+                is_duplicate.append(True)
+                link = (
+                    session.query(DuplicateChunk)
+                    .filter(
+                        DuplicateChunk.source_name == source_name,
+                        DuplicateChunk.content_hash == content_hash,
+                    )
+                    .first()
+                )
+                if link is None:
+                    link = DuplicateChunk(
+                        source_name=source_name, content_hash=content_hash
+                    )
+                    session.add(link)
+                link.fingerprint_id = match.id
+                link.doc_type = doc_type
+                link.simhash = _to_signed_64(simhash) if simhash is not None else None
+                link.document = document
+                link.last_seen = now
+                continue
+            is_duplicate.append(False)
+            if match is None:
+                match = ContentFingerprint(source_name=source_name)
+                _set_fingerprint(match, content_hash, simhash)
+                session.add(match)
+            match.last_seen = now
+            # make the fingerprint visible to the next chunks of this batch
+            session.flush()
+        session.commit()
+    return is_duplicate
+
+
+def hand_over_stale_content_fingerprints(
+    source_name: str, before: float
+) -> list[tuple[str, str, dict[str, Any]]]:
+    """Hands fingerprints of a source not seen since `before`, that duplicates of
+    other sources are linked to, over to the oldest of these duplicates. Its link is
+    removed, the other duplicates stay linked to the fingerprint.
+
+    Returns:
+        list[tuple[str, str, dict[str, Any]]]: source name, document type and document
+            of the duplicates now owning a fingerprint, which must be indexed
+    """
+    handed_over = []
+    with SessionLocal() as session:
+        stale = session.query(ContentFingerprint).filter(
+            ContentFingerprint.source_name == source_name,
+            ContentFingerprint.last_seen < before,
+        )
+        for fingerprint in stale.all():
+            heir = (
+                session.query(DuplicateChunk)
+                .filter(
+                    DuplicateChunk.fingerprint_id == fingerprint.id,
+                    DuplicateChunk.document.is_not(None),
+                )
+                .order_by(DuplicateChunk.id)
+                .first()
+            )
+            if heir is None:
+                continue
+            fingerprint.source_name = heir.source_name
+            fingerprint.last_seen = heir.last_seen
+            # stored signed, see `_to_signed_64`
+            simhash = heir.simhash % (1 << 64) if heir.simhash is not None else None
+            _set_fingerprint(fingerprint, heir.content_hash, simhash)
+            n_deduplicated = ChatSource.n_deduplicated_documents
+            session.query(ChatSource).filter(
+                ChatSource.source_name == heir.source_name
+            ).update({n_deduplicated: n_deduplicated - 1})
+            handed_over.append((heir.source_name, heir.doc_type, heir.document))
+            session.delete(heir)
+        session.commit()
+    return handed_over
+
+
+def delete_stale_content_fingerprints(source_name: str, before: float) -> int:
+    """Deletes fingerprints and duplicate links of a source not seen since `before`.
+    Fingerprints still linked to duplicates should be handed over first, see
+    `hand_over_stale_content_fingerprints`.
+
+    Returns:
+        int: number of chunks of the source currently deduplicated
+    """
+    with SessionLocal() as session:
+        stale = session.query(ContentFingerprint).filter(
+            ContentFingerprint.source_name == source_name,
+            ContentFingerprint.last_seen < before,
+        )
+        # links to the deleted fingerprints would point at nothing
+        session.query(DuplicateChunk).filter(
+            DuplicateChunk.fingerprint_id.in_(
+                stale.with_entities(ContentFingerprint.id).scalar_subquery()
+            )
+        ).delete(synchronize_session=False)
+        stale.delete()
+        session.query(DuplicateChunk).filter(
+            DuplicateChunk.source_name == source_name,
+            DuplicateChunk.last_seen < before,
+        ).delete()
+        session.commit()
+        return (
+            session.query(func.count(DuplicateChunk.id))
+            .filter(DuplicateChunk.source_name == source_name)
+            .scalar()
+        )
+
+
+def _set_fingerprint(
+    fingerprint: ContentFingerprint, content_hash: str, simhash: int | None
+):
+    fingerprint.content_hash = content_hash
+    fingerprint.simhash = _to_signed_64(simhash) if simhash is not None else None
+    bands = _simhash_bands(simhash) if simhash is not None else [None] * 4
+    for i, band in enumerate(bands):
+        setattr(fingerprint, f"band_{i}", band)
+
+
+def _to_signed_64(value: int) -> int:
+    """SQLite integers are signed 64-bit"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _simhash_bands(simhash: int) -> list[int]:
+    return [(simhash >> (16 * i)) & 0xFFFF for i in range(4)]
+
+
+def _hamming_distance(stored: int, simhash: int) -> int:
+    return bin((stored ^ simhash) & ((1 << 64) - 1)).count("1")
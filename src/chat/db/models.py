@@ -1,6 +1,15 @@
 import datetime
 
-from sqlalchemy import JSON, Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import (
+    JSON,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+)
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -11,16 +20,32 @@ class Conversation(Base):
 
     __tablename__ = "conversations"
     id = Column(String, primary_key=True)
-    date = Column(DateTime, default=datetime.datetime.now)
+    date = Column(DateTime, default=datetime.datetime.now, index=True)
+    # legacy storage of the whole history, migrated into the `messages` table
     messages = Column(JSON)
 
 
+class Message(Base):
+    """A message of a conversation, at position `seq`. Messages are only appended."""
+
+    __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_conversation_seq", "conversation_id", "seq", unique=True),
+    )
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(String, ForeignKey(Conversation.id), nullable=False)
+    seq = Column(Integer, nullable=False)
+    role = Column(String)
+    content = Column(String)
+    date = Column(DateTime, default=datetime.datetime.now)
+
+
 class ConversationTitle(Base):
     """A title for a conversation between user and LLM"""
 
     __tablename__ = "conversations_titles"
     id = Column(Integer, primary_key=True)
-    conversation_id = Column(String, ForeignKey(Conversation.id))
+    conversation_id = Column(String, ForeignKey(Conversation.id), index=True)
     title = Column(String)
 
 
@@ -36,3 +61,64 @@ class ChatSource(Base):
     n_related_documents = Column(Integer)
     date_added = Column(DateTime)
     n_times_retrieved = Column(Integer, default=0)
+    n_deduplicated_documents = Column(Integer, default=0)
+
+
+class IngestionJob(Base):
+    """
+    Background job adding a source to the vector store, with its progress
+    """
+
+    __tablename__ = "ingestion_jobs"
+    id = Column(Integer, primary_key=True)
+    source_name = Column(String)
+    doc_type = Column(String)
+    status = Column(String, default="pending", index=True)
+    pages_total = Column(Integer, default=0)
+    pages_partitioned = Column(Integer, default=0)
+    chunks_total = Column(Integer, default=0)
+    chunks_embedded = Column(Integer, default=0)
+    vectors_upserted = Column(Integer, default=0)
+    batches_committed = Column(Integer, default=0)
+    # record manager time at which indexing started, anything older is stale
+    index_started_at = Column(Float)
+    error = Column(String)
+    date_added = Column(DateTime, default=datetime.datetime.now)
+    date_updated = Column(DateTime, default=datetime.datetime.now)
+
+
+class ContentFingerprint(Base):
+    """
+    Fingerprint of a chunk stored in the vector store, used to detect duplicated content
+    across sources. `simhash` is split into 16-bit bands for near-duplicate lookups.
+    """
+
+    __tablename__ = "content_fingerprints"
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String, unique=True)
+    simhash = Column(Integer)
+    band_0 = Column(Integer, index=True)
+    band_1 = Column(Integer, index=True)
+    band_2 = Column(Integer, index=True)
+    band_3 = Column(Integer, index=True)
+    source_name = Column(String, index=True)
+    last_seen = Column(Float)
+
+
+class DuplicateChunk(Base):
+    """
+    Chunk of a source that was not embedded because its content already is in the
+    vector store, linked to the fingerprint of the stored chunk. The chunk is kept, to
+    be indexed under its own source once the stored chunk is removed.
+    """
+
+    __tablename__ = "duplicate_chunks"
+    id = Column(Integer, primary_key=True)
+    source_name = Column(String, index=True)
+    doc_type = Column(String)
+    content_hash = Column(String)
+    simhash = Column(Integer)
+    # page content and metadata of the chunk
+    document = Column(JSON)
+    fingerprint_id = Column(Integer, ForeignKey(ContentFingerprint.id), index=True)
+    last_seen = Column(Float)
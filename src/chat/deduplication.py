@@ -0,0 +1,72 @@
+"""
+Content fingerprints (exact hash and SimHash) detecting chunks already stored in the
+vector store under another source, before they are embedded
+"""
+
+import hashlib
+import re
+
+from langchain_core.documents import Document
+from sqlalchemy.exc import IntegrityError
+
+from chat.db.database import register_content_fingerprints
+from chat.embedding_cache import normalize_text, text_hash
+
+# texts with fewer shingles are only deduplicated when identical
+MIN_SHINGLES_FOR_SIMHASH = 8
+SHINGLE_SIZE = 3
+
+
+def simhash(text: str) -> int | None:
+    """64-bit SimHash of the word shingles of a text. Similar texts differ in few bits.
+
+    Returns:
+        int | None: the simhash, or None if the text is too short to be meaningful
+    """
+    words = re.findall(r"\w+", normalize_text(text).lower())
+    shingles = [
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    ]
+    if len(shingles) < MIN_SHINGLES_FOR_SIMHASH:
+        return None
+    weights = [0] * 64
+    for shingle in shingles:
+        digest = hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "big")
+        for bit in range(64):
+            weights[bit] += 1 if (value >> bit) & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def deduplicate_documents(
+    source_name: str, source_type: str, documents: list[Document]
+) -> list[Document]:
+    """Filters out documents whose content is already stored under another source.
+
+    Fingerprints of the kept documents are registered for `source_name`, duplicates
+    are linked to the fingerprint of the stored content and kept, to be indexed if the
+    stored content is removed from its source.
+
+    Args:
+        source_name (str): source the documents belong to
+        source_type (str): type of the source
+        documents (list[Document]): batch of documents about to be embedded
+
+    Returns:
+        list[Document]: documents that should be embedded
+    """
+    fingerprints = [
+        (text_hash(doc.page_content), simhash(doc.page_content)) for doc in documents
+    ]
+    serialized = [
+        {"page_content": doc.page_content, "metadata": doc.metadata}
+        for doc in documents
+    ]
+    args = (source_name, source_type, fingerprints, serialized)
+    try:
+        is_duplicate = register_content_fingerprints(*args)
+    except IntegrityError:
+        # a concurrent ingestion registered the same content first, now visible
+        is_duplicate = register_content_fingerprints(*args)
+    return [doc for doc, duplicate in zip(documents, is_duplicate) if not duplicate]
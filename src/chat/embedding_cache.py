@@ -0,0 +1,177 @@
+"""
+Persistent embedding cache keyed by (model name, normalized text hash), backed by SQLite
+"""
+
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utils.logger import setup_logger
+from utils.sqlite import connect_sqlite
+
+logger = setup_logger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Normalizes unicode and whitespace so that cosmetic differences share a cache entry"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def text_hash(text: str) -> str:
+    """sha256 hex digest of the normalized text"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only calls the underlying model for texts not embedded before.
+    Least recently used entries are evicted once the cache grows past `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        model_name: str,
+        db_path: str,
+        max_bytes: int = 512 * 1024 * 1024,
+    ):
+        """
+        Args:
+            underlying (Embeddings): embeddings model to cache
+            model_name (str): name of the model, part of the cache key
+            db_path (str): path to the SQLite file backing the cache
+            max_bytes (int): maximum size of stored vectors. Defaults to 512MB.
+        """
+        self.underlying = underlying
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path)
+        # the total size of the vectors is kept up to date by triggers in a one-row
+        # table, initialized from existing rows when the table is created
+        self._conn.executescript("""
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            );
+            CREATE INDEX IF NOT EXISTS ix_embeddings_last_access
+                ON embeddings (last_access);
+            CREATE TABLE IF NOT EXISTS embeddings_total (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                size INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO embeddings_total
+                SELECT 0, COALESCE(SUM(size), 0) FROM embeddings;
+            CREATE TRIGGER IF NOT EXISTS embeddings_total_insert
+                AFTER INSERT ON embeddings BEGIN
+                    UPDATE embeddings_total SET size = size + NEW.size;
+                END;
+            CREATE TRIGGER IF NOT EXISTS embeddings_total_update
+                AFTER UPDATE OF size ON embeddings BEGIN
+                    UPDATE embeddings_total SET size = size + NEW.size - OLD.size;
+                END;
+            CREATE TRIGGER IF NOT EXISTS embeddings_total_delete
+                AFTER DELETE ON embeddings BEGIN
+                    UPDATE embeddings_total SET size = size - OLD.size;
+                END;
+            COMMIT;
+            """)
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        """Hit/miss counters since creation"""
+        return {
+            "embedding_cache_hits": self.hits,
+            "embedding_cache_misses": self.misses,
+        }
+
+    def _lookup(self, hashes: list[str]) -> dict[str, list[float]]:
+        found = {}
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start : start + 500]
+            rows = self._conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                f"AND text_hash IN ({','.join('?' * len(chunk))})",
+                [self.model_name, *chunk],
+            ).fetchall()
+            found.update(
+                {h: np.frombuffer(blob, dtype=np.float32).tolist() for h, blob in rows}
+            )
+        return found
+
+    def _evict(self):
+        total = self._conn.execute("SELECT size FROM embeddings_total").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # evict down to 90% of the budget so that we don't evict on every insert
+        to_free = total - int(0.9 * self.max_bytes)
+        freed = 0
+        evicted = []
+        for model, _hash, size in self._conn.execute(
+            "SELECT model, text_hash, size FROM embeddings ORDER BY last_access"
+        ):
+            if freed >= to_free:
+                break
+            evicted.append((model, _hash))
+            freed += size
+        self._conn.executemany(
+            "DELETE FROM embeddings WHERE model = ? AND text_hash = ?", evicted
+        )
+        logger.info("Evicted %s embeddings (%s bytes) from cache", len(evicted), freed)
+
+    def embed_documents_with_stats(
+        self, texts: list[str]
+    ) -> tuple[list[list[float]], int, int]:
+        """Embeds texts, also returning the number of cache hits and misses of the call"""
+        hashes = [text_hash(text) for text in texts]
+        with self._lock:
+            cached = self._lookup(list(set(hashes)))
+        missing = {h: text for h, text in zip(hashes, texts) if h not in cached}
+        computed = {}
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+        now = time.time()
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? "
+                "WHERE model = ? AND text_hash = ?",
+                [(now, self.model_name, h) for h in cached],
+            )
+            rows = []
+            for h, vector in computed.items():
+                blob = np.asarray(vector, dtype=np.float32).tobytes()
+                rows.append((self.model_name, h, blob, len(blob), now))
+            # an upsert rather than INSERT OR REPLACE, whose implicit deletes do not
+            # fire the triggers keeping the total size
+            self._conn.executemany(
+                "INSERT INTO embeddings "
+                "(model, text_hash, vector, size, last_access) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (model, text_hash) DO UPDATE SET vector = excluded.vector, "
+                "size = excluded.size, last_access = excluded.last_access",
+                rows,
+            )
+            if rows:
+                self._evict()
+            self._conn.commit()
+        vectors = cached | computed
+        return [vectors[h] for h in hashes], len(texts) - len(missing), len(missing)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_documents_with_stats(texts)[0]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.underlying.embed_query(text)
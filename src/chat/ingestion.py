@@ -0,0 +1,279 @@
+"""
+Ingestion engine: splits PDFs into page ranges partitioned in a process pool and
+streams the resulting elements through bounded pipelines
+"""
+
+import datetime
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+
+from langchain_core.documents import Document
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+INGESTION_MAX_WORKERS = int(
+    os.environ.get("INGESTION_MAX_WORKERS", str(os.cpu_count() or 1))
+)
+INGESTION_PAGES_PER_SHARD = int(os.environ.get("INGESTION_PAGES_PER_SHARD", "10"))
+
+T = TypeVar("T")
+
+
+def count_pdf_pages(file_path: str) -> int:
+    """Number of pages of a pdf file"""
+    from pypdf import PdfReader
+
+    return len(PdfReader(file_path).pages)
+
+
+def page_ranges(n_pages: int, pages_per_shard: int) -> list[tuple[int, int]]:
+    """Splits `n_pages` into consecutive [first, last) page ranges (0-based)"""
+    return [
+        (first, min(first + pages_per_shard, n_pages))
+        for first in range(0, n_pages, pages_per_shard)
+    ]
+
+
+def _partition_pdf_pages(
+    file_path: str, first_page: int, last_page: int, n_pages: int
+) -> list[Document]:
+    """Partitions pages [first_page, last_page) of a pdf. Runs inside pool workers.
+
+    Element ids only depend on filename, text, page number and position on page, so
+    they are the same as when partitioning the whole file at once.
+    """
+    from langchain_unstructured import UnstructuredLoader
+    from pypdf import PdfReader, PdfWriter
+    from unstructured.cleaners.core import clean_extra_whitespace
+
+    last_modified = datetime.datetime.fromtimestamp(
+        os.path.getmtime(file_path)
+    ).isoformat()
+    loader_kwargs = {
+        "strategy": "hi_res",
+        "post_processors": [clean_extra_whitespace],
+        "metadata_filename": file_path,
+        "metadata_last_modified": last_modified,
+        "starting_page_number": first_page + 1,
+    }
+    if first_page == 0 and last_page == n_pages:
+        docs = list(
+            UnstructuredLoader(file_path=file_path, **loader_kwargs).lazy_load()
+        )
+    else:
+        writer = PdfWriter()
+        for page in PdfReader(file_path).pages[first_page:last_page]:
+            writer.add_page(page)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shard_path = os.path.join(tmp_dir, os.path.basename(file_path))
+            with open(shard_path, "wb") as shard_file:
+                writer.write(shard_file)
+            loader = UnstructuredLoader(file_path=shard_path, **loader_kwargs)
+            docs = list(loader.lazy_load())
+    for doc in docs:
+        doc.metadata["source"] = file_path
+    return docs
+
+
+class ShardMerger:
+    """Stitches partitioned shards back together in page order, fixing cross-shard parents.
+
+    Elements at the start of a shard that precede its first title belong under the
+    last title of the previous shard, which their worker could not see.
+    """
+
+    def __init__(self):
+        self.last_title_id = None
+
+    def merge(self, shard: list[Document]) -> list[Document]:
+        """Fixes parents of the next shard in page order and returns its elements"""
+        before_first_title = True
+        for doc in shard:
+            if doc.metadata.get("category") == "Title":
+                before_first_title = False
+            elif (
+                before_first_title
+                and self.last_title_id is not None
+                and doc.metadata.get("parent_id") is None
+            ):
+                doc.metadata["parent_id"] = self.last_title_id
+        for doc in reversed(shard):
+            if doc.metadata.get("category") == "Title":
+                self.last_title_id = doc.metadata.get("element_id")
+                break
+        return shard
+
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def get_partition_pool() -> ProcessPoolExecutor:
+    """Process pool shared by every ingestion, so that workers load layout models once"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking the multithreaded streamlit server is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=INGESTION_MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def iter_pdf_documents(
+    file_path: str,
+    pages_per_shard: int = INGESTION_PAGES_PER_SHARD,
+    on_pages_partitioned: Callable[[int], None] | None = None,
+) -> Iterator[Document]:
+    """Partitions a pdf by page shards in the process pool, yielding elements in order.
+
+    At most two shards per pool worker are in flight, so memory does not grow with the
+    size of the pdf.
+
+    Args:
+        file_path (str): path to the pdf file
+        pages_per_shard (int): pages handled by each task. Defaults to
+            INGESTION_PAGES_PER_SHARD.
+        on_pages_partitioned (Callable, optional): called with the number of pages of
+            each shard once its elements are yielded
+    """
+    pool = get_partition_pool()
+    n_pages = count_pdf_pages(file_path)
+    ranges = iter(page_ranges(n_pages, pages_per_shard))
+    logger.info("Partitioning %s (%s pages)", file_path, n_pages)
+    in_flight: deque[tuple[Future, int]] = deque()
+
+    def submit_next() -> bool:
+        page_range = next(ranges, None)
+        if page_range is None:
+            return False
+        first, last = page_range
+        future = pool.submit(_partition_pdf_pages, file_path, first, last, n_pages)
+        in_flight.append((future, last - first))
+        return True
+
+    for _ in range(2 * INGESTION_MAX_WORKERS):
+        if not submit_next():
+            break
+    merger = ShardMerger()
+    try:
+        while in_flight:
+            future, shard_pages = in_flight.popleft()
+            shard = future.result()
+            submit_next()
+            yield from merger.merge(shard)
+            if on_pages_partitioned is not None:
+                on_pages_partitioned(shard_pages)
+    finally:
+        for future, _ in in_flight:
+            future.cancel()
+
+
+def iter_batches(items: Iterable[T], batch_size: int) -> Iterator[list[T]]:
+    """Groups items into lists of `batch_size` (the last one may be shorter)"""
+    iterator = iter(items)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+class _StageError:
+    """Exception raised by a pipeline stage, forwarded downstream"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_DONE = object()
+
+
+def pipeline(
+    items: Iterable[Any], *stages: Callable[[Any], Any], queue_size: int = 2
+) -> Iterator[Any]:
+    """Runs a streaming pipeline and yields the outputs of its last stage, in order.
+
+    Items are pulled from `items` in one thread and every stage runs in its own
+    thread. Threads are connected by queues holding at most `queue_size` items, so a
+    slow stage makes the previous ones wait instead of buffering everything.
+
+    Args:
+        items (Iterable[Any]): pipeline input, consumed lazily
+        stages (Callable[[Any], Any]): functions applied to each item, in order
+        queue_size (int): capacity of the queues between stages. Defaults to 2.
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    def put(out_queue: queue.Queue, item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(in_queue: queue.Queue) -> Any:
+        while not stop.is_set():
+            try:
+                return in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def feed():
+        try:
+            for item in items:
+                if not put(queues[0], item):
+                    return
+        except BaseException as e:
+            put(queues[0], _StageError(e))
+            return
+        finally:
+            if hasattr(items, "close"):
+                items.close()
+        put(queues[0], _DONE)
+
+    def work(stage: Callable[[Any], Any], in_queue: queue.Queue, out_queue):
+        while True:
+            item = get(in_queue)
+            if item is _DONE or isinstance(item, _StageError):
+                put(out_queue, item)
+                return
+            try:
+                result = stage(item)
+            except BaseException as e:
+                put(out_queue, _StageError(e))
+                return
+            if not put(out_queue, result):
+                return
+
+    threads = [threading.Thread(target=feed, daemon=True)] + [
+        threading.Thread(
+            target=work, args=(stage, queues[i], queues[i + 1]), daemon=True
+        )
+        for i, stage in enumerate(stages)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
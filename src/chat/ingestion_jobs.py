@@ -0,0 +1,228 @@
+"""
+Persistent background queue adding sources to the vector store.
+
+Jobs are stored in the `ingestion_jobs` table and processed by a worker thread, so
+ingestion survives Streamlit reruns. Partitioned documents are spooled to disk as they
+stream through the pipeline and progress is committed after every indexed batch, so
+interrupted jobs resume from the last committed batch once their documents are fully
+spooled, and start over otherwise.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+
+import streamlit as st
+from langchain_core.documents import Document
+
+from chat.db.database import (
+    add_ingestion_job,
+    claim_pending_ingestion_jobs,
+    increment_ingestion_job,
+    requeue_interrupted_ingestion_jobs,
+    update_ingestion_job,
+)
+from chat.db.models import IngestionJob
+from chat.ingestion import count_pdf_pages, iter_pdf_documents
+from chat.vector_store import (
+    INGESTION_BATCH_SIZE,
+    backfill_lexical_index,
+    get_index_time,
+    load_website_documents,
+    prepare_documents,
+    source_to_vector_store,
+)
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+INGESTION_DIR = "data/ingestion"
+INGESTION_MAX_CONCURRENT_JOBS = int(
+    os.environ.get("INGESTION_MAX_CONCURRENT_JOBS", "2")
+)
+
+
+def _documents_path(job_id: int) -> str:
+    return os.path.join(INGESTION_DIR, f"job_{job_id}.jsonl")
+
+
+def _spool_documents(job_id: int, documents: Iterable[Document]) -> Iterator[Document]:
+    """Writes documents to disk as they stream by, so that the job can resume
+    without partitioning again. The file is only complete once fully consumed."""
+    os.makedirs(INGESTION_DIR, exist_ok=True)
+    path = _documents_path(job_id)
+    n_documents = 0
+    with open(f"{path}.partial", "w", encoding="utf-8") as file:
+        for doc in documents:
+            file.write(
+                json.dumps(
+                    {"page_content": doc.page_content, "metadata": doc.metadata},
+                    default=str,
+                )
+                + "\n"
+            )
+            n_documents += 1
+            if n_documents % INGESTION_BATCH_SIZE == 0:
+                increment_ingestion_job(job_id, chunks_total=INGESTION_BATCH_SIZE)
+            yield doc
+    os.replace(f"{path}.partial", path)
+    increment_ingestion_job(job_id, chunks_total=n_documents % INGESTION_BATCH_SIZE)
+
+
+def _load_spooled_documents(job_id: int) -> Iterator[Document] | None:
+    """Streams documents spooled by a previous run of the job, if it partitioned fully"""
+    path = _documents_path(job_id)
+    if not os.path.exists(path):
+        return None
+
+    def read() -> Iterator[Document]:
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                yield Document(**json.loads(line))
+
+    return read()
+
+
+def _remove_spool(job_id: int):
+    """Deletes the documents spooled by a job, complete or not"""
+    path = _documents_path(job_id)
+    for spool in (path, f"{path}.partial"):
+        if os.path.exists(spool):
+            os.remove(spool)
+
+
+class IngestionWorker:
+    """Thread processing queued ingestion jobs, several of them at once"""
+
+    def __init__(self, poll_interval: float = 5.0):
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="ingestion-worker", daemon=True
+        )
+        self._jobs_pool = ThreadPoolExecutor(
+            max_workers=INGESTION_MAX_CONCURRENT_JOBS,
+            thread_name_prefix="ingestion-job",
+        )
+
+    def start(self):
+        """Requeues jobs interrupted by a previous process and starts processing"""
+        n_requeued = requeue_interrupted_ingestion_jobs()
+        if n_requeued > 0:
+            logger.info("Resuming %s interrupted ingestion jobs", n_requeued)
+        self._thread.start()
+
+    def submit(self, source_name: str, doc_type: str) -> IngestionJob:
+        """Queues a source for ingestion
+
+        Args:
+            source_name (str): path to source file or url
+            doc_type (str): document type. Can be pdf or website for now.
+        """
+        job = add_ingestion_job(source_name, doc_type)
+        self._wake.set()
+        return job
+
+    def _run(self):
+        try:
+            # before any job runs, so that no source is being re-indexed meanwhile
+            backfill_lexical_index()
+        except Exception:
+            logger.exception("Lexical index backfill failed")
+        while True:
+            try:
+                jobs = claim_pending_ingestion_jobs()
+                if len(jobs) == 0:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+                    continue
+                # wait for the claimed jobs before claiming new ones
+                list(self._jobs_pool.map(self._process, jobs))
+            except Exception:
+                logger.exception("Ingestion worker error")
+                self._wake.wait(self.poll_interval)
+
+    def _documents(self, job: IngestionJob) -> Iterator[Document]:
+        """Streams the prepared documents of a job, partitioning only if needed"""
+        spooled = _load_spooled_documents(job.id)
+        if spooled is not None:
+            logger.info("Resuming %s from spooled documents", job.source_name)
+            return spooled
+        if job.doc_type == "pdf":
+            update_ingestion_job(
+                job.id,
+                pages_total=count_pdf_pages(job.source_name),
+                pages_partitioned=0,
+                chunks_total=0,
+            )
+            documents = iter_pdf_documents(
+                job.source_name,
+                on_pages_partitioned=lambda n_pages: increment_ingestion_job(
+                    job.id, pages_partitioned=n_pages
+                ),
+            )
+        else:
+            update_ingestion_job(
+                job.id, pages_total=1, pages_partitioned=0, chunks_total=0
+            )
+            documents = load_website_documents(job.source_name)
+        return _spool_documents(job.id, prepare_documents(documents, job.doc_type))
+
+    def _process(self, job: IngestionJob):
+        """Ingests the source of a job, committing progress after each batch"""
+        index_started_at = job.index_started_at
+        if index_started_at is None:
+            index_started_at = get_index_time()
+            update_ingestion_job(job.id, index_started_at=index_started_at)
+        # batches are only known to match the committed ones when read back from a
+        # complete spool, partitioning again may split documents differently
+        skip_batches = job.batches_committed
+        if skip_batches > 0 and not os.path.exists(_documents_path(job.id)):
+            logger.info(
+                "Restarting %s, its documents were not spooled", job.source_name
+            )
+            skip_batches = 0
+            update_ingestion_job(
+                job.id, batches_committed=0, chunks_embedded=0, vectors_upserted=0
+            )
+
+        def on_batch_committed(batch_number: int, result: dict[str, int]):
+            increment_ingestion_job(
+                job.id,
+                chunks_embedded=result["num_added"]
+                + result["num_updated"]
+                + result["num_skipped"],
+                vectors_upserted=result["num_added"] + result["num_updated"],
+            )
+            update_ingestion_job(job.id, batches_committed=batch_number + 1)
+
+        try:
+            source_to_vector_store(
+                job.source_name,
+                job.doc_type,
+                self._documents(job),
+                index_started_at=index_started_at,
+                skip_batches=skip_batches,
+                on_batch_committed=on_batch_committed,
+            )
+        except Exception as e:
+            logger.exception("Ingestion of %s failed", job.source_name)
+            update_ingestion_job(job.id, status="failed", error=str(e))
+            # failed jobs are not retried, their spool would never be read again
+            _remove_spool(job.id)
+            return
+        if job.doc_type == "website":
+            update_ingestion_job(job.id, pages_partitioned=1)
+        update_ingestion_job(job.id, status="done")
+        _remove_spool(job.id)
+        logger.info("Ingestion of %s done", job.source_name)
+
+
+@st.cache_resource
+def get_ingestion_worker() -> IngestionWorker:
+    """Starts the ingestion worker of this process"""
+    worker = IngestionWorker()
+    worker.start()
+    return worker
@@ -0,0 +1,47 @@
+"""
+Streamlit components displaying progress of background ingestion jobs
+"""
+
+import os
+
+import streamlit as st
+
+from chat.db.database import fetch_ingestion_jobs
+from chat.db.models import IngestionJob
+
+
+def _job_progress(job: IngestionJob) -> float:
+    """Fraction of the job done: partitioning and embedding weigh half each"""
+    if job.status == "done":
+        return 1.0
+    partitioned = job.pages_partitioned / job.pages_total if job.pages_total else 0.0
+    embedded = job.chunks_embedded / job.chunks_total if job.chunks_total else 0.0
+    return min(1.0, (partitioned + embedded) / 2)
+
+
+def render_ingestion_job(job: IngestionJob):
+    """Renders progress bar with per-stage counts of an ingestion job"""
+    name = os.path.basename(job.source_name) or job.source_name
+    if job.status == "failed":
+        st.error(f"**{name}** failed: {job.error}")
+        return
+    st.progress(
+        _job_progress(job),
+        text=(
+            f"**{name}** ({job.status}): "
+            f"{job.pages_partitioned}/{job.pages_total} pages partitioned · "
+            f"{job.chunks_embedded}/{job.chunks_total} chunks embedded · "
+            f"{job.vectors_upserted} vectors upserted"
+        ),
+    )
+
+
+@st.fragment(run_every=2)
+def render_active_ingestion_jobs():
+    """Renders progress of pending and running ingestion jobs, refreshing periodically"""
+    jobs = fetch_ingestion_jobs(["pending", "running"])
+    if len(jobs) == 0:
+        st.caption("No sources being processed")
+        return
+    for job in jobs:
+        render_ingestion_job(job)
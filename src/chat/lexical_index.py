@@ -0,0 +1,174 @@
+"""
+Local BM25 inverted index (SQLite FTS5) of the documents in the vector store, and
+reciprocal-rank fusion of lexical and dense results
+"""
+
+import json
+import re
+import threading
+import time
+from typing import Any
+
+from langchain_core.documents import Document
+
+from chat.embedding_cache import text_hash
+from chat.local_vector_store import match_metadata_filter
+from utils.logger import setup_logger
+from utils.sqlite import connect_sqlite
+
+logger = setup_logger(__name__)
+
+# smoothing constant of reciprocal-rank fusion, as in the original paper
+RRF_K = 60
+# matches fetched per requested document when a metadata filter may discard some
+FILTER_OVERFETCH = 4
+
+
+class LexicalIndex:
+    """
+    BM25 index of document chunks, updated incrementally as sources are indexed.
+    Chunks are keyed by source and content, so re-indexing a source only refreshes them.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path (str): path to the SQLite file backing the index
+        """
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                rowid INTEGER PRIMARY KEY,
+                source_name TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                last_seen REAL NOT NULL,
+                UNIQUE (source_name, content_hash)
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                content, content='chunks', content_rowid='rowid',
+                tokenize='porter unicode61'
+            );
+            CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts(rowid, content) VALUES (new.rowid, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts(chunks_fts, rowid, content)
+                VALUES ('delete', old.rowid, old.content);
+            END;
+            """)
+        self._conn.commit()
+
+    def add_documents(self, documents: list[Document], source_id_key: str):
+        """Adds documents, or marks them as seen if already indexed
+
+        Args:
+            documents (list[Document]): documents stored in the vector store
+            source_id_key (str): metadata key holding the source of the documents
+        """
+        now = time.time()
+        rows = [
+            (
+                doc.metadata[source_id_key],
+                text_hash(doc.page_content),
+                doc.page_content,
+                json.dumps(doc.metadata, default=str),
+                now,
+            )
+            for doc in documents
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE chunks SET last_seen = ? "
+                "WHERE source_name = ? AND content_hash = ?",
+                [(now, source, _hash) for source, _hash, *_ in rows],
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO chunks "
+                "(source_name, content_hash, content, metadata, last_seen) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def delete_stale(self, source_name: str, before: float) -> int:
+        """Deletes documents of a source not seen since `before`
+
+        Returns:
+            int: number of deleted documents
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM chunks WHERE source_name = ? AND last_seen < ?",
+                [source_name, before],
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def source_names(self) -> set[str]:
+        """Sources with indexed documents"""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT source_name FROM chunks")
+            return {source_name for (source_name,) in rows}
+
+    def is_backfilled(self) -> bool:
+        """Whether sources indexed before this index existed were queued again"""
+        with self._lock:
+            (user_version,) = self._conn.execute("PRAGMA user_version").fetchone()
+        return user_version >= 1
+
+    def mark_backfilled(self):
+        with self._lock:
+            self._conn.execute("PRAGMA user_version = 1")
+            self._conn.commit()
+
+    def search(
+        self, query: str, k: int = 4, _filter: dict[str, Any] | None = None
+    ) -> list[Document]:
+        """Documents matching the terms of a query, by decreasing BM25 score
+
+        Args:
+            query (str): free text query
+            k (int): number of documents to return. Defaults to 4.
+            _filter (dict[str, Any], optional): metadata filter, in vector store syntax
+        """
+        terms = set(re.findall(r"\w+", query.lower()))
+        if len(terms) == 0:
+            return []
+        # quoted terms, so that FTS5 operators in the query are taken literally
+        match = " OR ".join(f'"{term}"' for term in terms)
+        limit = k if _filter is None else k * FILTER_OVERFETCH
+        documents = []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunks.content, chunks.metadata FROM chunks_fts "
+                "JOIN chunks ON chunks.rowid = chunks_fts.rowid "
+                "WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?",
+                [match, limit],
+            )
+            for content, metadata in rows:
+                metadata = json.loads(metadata)
+                if _filter is None or match_metadata_filter(metadata, _filter):
+                    documents.append(Document(page_content=content, metadata=metadata))
+                    if len(documents) == k:
+                        break
+        return documents
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[Document]], k: int = RRF_K
+) -> list[Document]:
+    """Merges rankings of documents, scoring each by the sum of 1 / (k + rank)
+
+    Documents with the same content are considered the same document.
+    """
+    scores: dict[str, float] = {}
+    documents: dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = text_hash(doc.page_content)
+            scores[key] = scores.get(key, 0.0) + 1 / (k + rank)
+            documents.setdefault(key, doc)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)]
@@ -0,0 +1,508 @@
+"""
+In-process vector store keeping document embeddings in a local NumPy matrix.
+
+Supports exact (flat) cosine search and an approximate inverted-file (IVF) search,
+together with the subset of Pinecone's metadata filter language used by the app.
+
+The index is persisted as a log of segments, each written once as a single `.npz`
+file holding the rows added and the ids deleted by one call. A manifest, replaced
+atomically, lists the segments to replay, so a crash never leaves a half-written
+index. The log is folded into a snapshot once it outgrows the last snapshot.
+"""
+
+import json
+import os
+import threading
+import uuid
+from typing import Any, Callable, Iterable, Literal, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+SearchMode = Literal["flat", "ivf"]
+
+MANIFEST_FILE = "manifest.json"
+# beyond this number of segments, the log is folded into a snapshot
+MAX_SEGMENTS = 256
+
+_COMPARISON_OPERATORS: dict[str, Callable[[Any, Any], bool]] = {
+    "$eq": lambda value, target: value == target,
+    "$ne": lambda value, target: value != target,
+    "$gt": lambda value, target: value > target,
+    "$gte": lambda value, target: value >= target,
+    "$lt": lambda value, target: value < target,
+    "$lte": lambda value, target: value <= target,
+    "$in": lambda value, target: value in target,
+    "$nin": lambda value, target: value not in target,
+}
+
+
+def match_metadata_filter(metadata: dict[str, Any], _filter: dict[str, Any]) -> bool:
+    """Checks if metadata satisfies a Pinecone-style metadata filter
+
+    Missing fields never match a comparison, mirroring Pinecone's behaviour.
+
+    Args:
+        metadata (dict[str, Any]): document metadata
+        _filter (dict[str, Any]): filter, e.g. {"detection_class_prob": {"$gte": 0.75}}
+
+    Returns:
+        bool: True if the metadata satisfies every condition of the filter
+    """
+    for key, condition in _filter.items():
+        if key == "$and":
+            if not all(match_metadata_filter(metadata, sub) for sub in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(match_metadata_filter(metadata, sub) for sub in condition):
+                return False
+            continue
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, target in condition.items():
+            if operator == "$exists":
+                if (key in metadata) != target:
+                    return False
+                continue
+            if operator not in _COMPARISON_OPERATORS:
+                raise ValueError(f"Unsupported filter operator {operator}")
+            if key not in metadata:
+                return False
+            try:
+                if not _COMPARISON_OPERATORS[operator](metadata[key], target):
+                    return False
+            except TypeError:
+                return False
+    return True
+
+
+def _write_atomically(path: str, write: Callable[[Any], None], mode: str = "wb"):
+    """Writes a file through a temporary one, so readers see it whole or not at all"""
+    encoding = None if "b" in mode else "utf-8"
+    with open(f"{path}.tmp", mode, encoding=encoding) as file:
+        write(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(f"{path}.tmp", path)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class _IVFIndex:
+    """Inverted-file index: k-means centroids plus the list each row belongs to"""
+
+    def __init__(self, n_lists: Optional[int], n_probe: int, n_iter: int = 10):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments: Optional[np.ndarray] = None
+        self.trained_size = 0
+
+    def fit(self, matrix: np.ndarray):
+        """Trains centroids if the matrix outgrew the last training and assigns rows"""
+        n_rows = matrix.shape[0]
+        if self.centroids is None or n_rows > 2 * self.trained_size:
+            n_lists = self.n_lists or max(1, int(np.sqrt(n_rows)))
+            n_lists = min(n_lists, n_rows)
+            rng = np.random.default_rng(0)
+            centroids = matrix[rng.choice(n_rows, n_lists, replace=False)]
+            for _ in range(self.n_iter):
+                assignments = np.argmax(matrix @ centroids.T, axis=1)
+                for list_id in range(n_lists):
+                    members = matrix[assignments == list_id]
+                    if len(members) > 0:
+                        centroids[list_id] = members.mean(axis=0)
+                centroids = _normalize_rows(centroids)
+            self.centroids = centroids
+            self.trained_size = n_rows
+            logger.info("Trained IVF index with %s lists on %s rows", n_lists, n_rows)
+        self.assignments = np.argmax(matrix @ self.centroids.T, axis=1)
+
+    def candidates(self, query: np.ndarray) -> np.ndarray:
+        """Boolean mask of rows belonging to the `n_probe` closest lists"""
+        closest = np.argsort(-(self.centroids @ query))[: self.n_probe]
+        return np.isin(self.assignments, closest)
+
+
+class LocalVectorStore(VectorStore):
+    """Vector store holding normalized embeddings in memory, persisted to a directory"""
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        persist_dir: Optional[str] = None,
+        search_mode: SearchMode = "flat",
+        n_lists: Optional[int] = None,
+        n_probe: int = 8,
+        ivf_min_size: int = 1024,
+    ):
+        """
+        Args:
+            embedding (Embeddings): embeddings model
+            persist_dir (str, optional): directory where the index is stored. Kept only
+                in memory if None.
+            search_mode (SearchMode): "flat" for exact search or "ivf" for approximate
+                search over the `n_probe` closest clusters. Defaults to "flat".
+            n_lists (int, optional): number of IVF clusters. Defaults to sqrt(n_rows).
+            n_probe (int): number of IVF clusters scanned per query. Defaults to 8.
+            ivf_min_size (int): below this number of rows, IVF falls back to flat search.
+        """
+        if search_mode not in ("flat", "ivf"):
+            raise ValueError(f"Unrecognized search_mode {search_mode}")
+        self._embedding = embedding
+        self.persist_dir = persist_dir
+        self.search_mode = search_mode
+        self.ivf_min_size = ivf_min_size
+        self._ivf = _IVFIndex(n_lists=n_lists, n_probe=n_probe)
+        self._ivf_dirty = True
+        self._lock = threading.RLock()
+        self._ids: list[str] = []
+        self._texts: list[str] = []
+        self._metadatas: list[dict[str, Any]] = []
+        self._id_to_row: dict[str, int] = {}
+        # rows are appended into a buffer with spare capacity, `_matrix` views the
+        # used part
+        self._buffer = np.zeros((0, 0), dtype=np.float32)
+        self._matrix = self._buffer
+        self._filter_masks: dict[str, np.ndarray] = {}
+        self._segments: list[str] = []
+        self._next_segment = 0
+        # rows stored in the last snapshot, and rows and deletions logged since
+        self._snapshot_size = 0
+        self._log_size = 0
+        if persist_dir is not None:
+            self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _load(self):
+        manifest_path = os.path.join(self.persist_dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            self._load_legacy()
+            return
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+        self._segments = manifest["segments"]
+        self._next_segment = manifest["next_segment"]
+        for i, name in enumerate(self._segments):
+            with np.load(os.path.join(self.persist_dir, name)) as segment:
+                records = json.loads(str(segment["records"]))
+                n_rows = len(records["ids"])
+                self._upsert(
+                    records["ids"],
+                    records["texts"],
+                    records["metadatas"],
+                    segment["vectors"],
+                )
+                self._remove(records["deleted"])
+            if i == 0 and name.startswith("snapshot"):
+                self._snapshot_size = n_rows
+            else:
+                self._log_size += n_rows + len(records["deleted"])
+        # segments written by a call interrupted before updating the manifest
+        for name in os.listdir(self.persist_dir):
+            if name.endswith(".npz") and name not in self._segments:
+                os.remove(os.path.join(self.persist_dir, name))
+        logger.info(
+            "Loaded %s vectors from %s segments in %s",
+            len(self._ids),
+            len(self._segments),
+            self.persist_dir,
+        )
+
+    def _load_legacy(self):
+        """Loads an index stored by older versions as a records file and a matrix.
+        Without segments, the next write stores a snapshot replacing them."""
+        records_path = os.path.join(self.persist_dir, "records.json")
+        matrix_path = os.path.join(self.persist_dir, "embeddings.npy")
+        if not os.path.exists(records_path) or not os.path.exists(matrix_path):
+            return
+        with open(records_path, "r", encoding="utf-8") as file:
+            records = json.load(file)
+        self._upsert(
+            records["ids"], records["texts"], records["metadatas"], np.load(matrix_path)
+        )
+        logger.info(
+            "Loaded %s legacy vectors from %s", len(self._ids), self.persist_dir
+        )
+
+    def _write_segment(
+        self,
+        name: str,
+        ids: list[str],
+        texts: list[str],
+        metadatas: list[dict[str, Any]],
+        vectors: np.ndarray,
+        deleted: list[str],
+    ):
+        records = {"ids": ids, "texts": texts, "metadatas": metadatas}
+        records["deleted"] = deleted
+        _write_atomically(
+            os.path.join(self.persist_dir, name),
+            lambda file: np.savez(
+                file,
+                records=np.array(json.dumps(records, default=str)),
+                vectors=vectors,
+            ),
+        )
+
+    def _write_manifest(self):
+        manifest = {"segments": self._segments, "next_segment": self._next_segment}
+        _write_atomically(
+            os.path.join(self.persist_dir, MANIFEST_FILE),
+            lambda file: json.dump(manifest, file),
+            mode="w",
+        )
+
+    def _persist(
+        self,
+        ids: list[str],
+        texts: list[str],
+        metadatas: list[dict[str, Any]],
+        vectors: np.ndarray,
+        deleted: list[str],
+    ):
+        """Appends the changes of a call to the log, or folds the log into a
+        snapshot once it outgrew the last one"""
+        if self.persist_dir is None:
+            return
+        os.makedirs(self.persist_dir, exist_ok=True)
+        self._log_size += len(ids) + len(deleted)
+        previous = self._segments
+        if self._log_size > self._snapshot_size or len(previous) >= MAX_SEGMENTS:
+            name = f"snapshot-{self._next_segment:06d}.npz"
+            self._write_segment(
+                name, self._ids, self._texts, self._metadatas, self._matrix, []
+            )
+            self._segments = [name]
+            self._snapshot_size = len(self._ids)
+            self._log_size = 0
+        else:
+            name = f"segment-{self._next_segment:06d}.npz"
+            self._write_segment(name, ids, texts, metadatas, vectors, deleted)
+            self._segments = previous + [name]
+        self._next_segment += 1
+        self._write_manifest()
+        if self._segments == [name]:
+            for old in set(previous) | {"records.json", "embeddings.npy"}:
+                path = os.path.join(self.persist_dir, old)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _invalidate(self):
+        self._ivf_dirty = True
+        self._filter_masks = {}
+
+    def _append_rows(self, vectors: np.ndarray):
+        n_rows = len(self._matrix)
+        needed = n_rows + len(vectors)
+        if needed > len(self._buffer) or self._buffer.shape[1] != vectors.shape[1]:
+            buffer = np.zeros(
+                (max(needed, 2 * len(self._buffer)), vectors.shape[1]),
+                dtype=np.float32,
+            )
+            if n_rows > 0:
+                buffer[:n_rows] = self._matrix
+            self._buffer = buffer
+        self._buffer[n_rows:needed] = vectors
+        self._matrix = self._buffer[:needed]
+
+    def _upsert(
+        self,
+        ids: list[str],
+        texts: list[str],
+        metadatas: list[dict[str, Any]],
+        vectors: np.ndarray,
+    ):
+        new_rows = []
+        for _id, text, metadata, vector in zip(ids, texts, metadatas, vectors):
+            if _id in self._id_to_row:
+                row = self._id_to_row[_id]
+                self._texts[row] = text
+                self._metadatas[row] = dict(metadata)
+                self._matrix[row] = vector
+                continue
+            self._id_to_row[_id] = len(self._ids)
+            self._ids.append(_id)
+            self._texts.append(text)
+            self._metadatas.append(dict(metadata))
+            new_rows.append(vector)
+        if new_rows:
+            self._append_rows(np.stack(new_rows))
+
+    def _remove(self, ids: list[str]) -> list[str]:
+        """Removes rows, returning the ids that were stored"""
+        rows = {self._id_to_row[_id] for _id in ids if _id in self._id_to_row}
+        if not rows:
+            return []
+        keep = [row for row in range(len(self._ids)) if row not in rows]
+        removed = [self._ids[row] for row in sorted(rows)]
+        self._ids = [self._ids[row] for row in keep]
+        self._texts = [self._texts[row] for row in keep]
+        self._metadatas = [self._metadatas[row] for row in keep]
+        self._buffer[: len(keep)] = self._matrix[keep]
+        self._matrix = self._buffer[: len(keep)]
+        self._id_to_row = {_id: row for row, _id in enumerate(self._ids)}
+        return removed
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[list[dict]] = None,
+        *,
+        ids: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        texts = list(texts)
+        if len(texts) == 0:
+            return []
+        metadatas = [dict(metadata) for metadata in metadatas or [{} for _ in texts]]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = np.asarray(self._embedding.embed_documents(texts), dtype=np.float32)
+        vectors = _normalize_rows(vectors)
+        with self._lock:
+            self._upsert(ids, texts, metadatas, vectors)
+            self._invalidate()
+            self._persist(ids, texts, metadatas, vectors, [])
+        return ids
+
+    def delete(self, ids: Optional[list[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids is None:
+            return False
+        with self._lock:
+            removed = self._remove(ids)
+            if not removed:
+                return True
+            self._invalidate()
+            self._persist([], [], [], np.zeros((0, 0), dtype=np.float32), removed)
+        return True
+
+    def get_by_ids(self, ids: Sequence[str], /) -> list[Document]:
+        with self._lock:
+            return [
+                self._document_at(self._id_to_row[_id])
+                for _id in ids
+                if _id in self._id_to_row
+            ]
+
+    def _document_at(self, row: int) -> Document:
+        return Document(
+            id=self._ids[row],
+            page_content=self._texts[row],
+            metadata=dict(self._metadatas[row]),
+        )
+
+    def _filter_mask(self, _filter: Optional[dict[str, Any]]) -> Optional[np.ndarray]:
+        if not _filter:
+            return None
+        key = json.dumps(_filter, sort_keys=True, default=str)
+        if key not in self._filter_masks:
+            self._filter_masks[key] = np.fromiter(
+                (match_metadata_filter(meta, _filter) for meta in self._metadatas),
+                dtype=bool,
+                count=len(self._metadatas),
+            )
+        return self._filter_masks[key]
+
+    def similarity_search_by_vector_with_score(
+        self,
+        embedding: list[float],
+        k: int = 4,
+        filter: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> list[tuple[Document, float]]:
+        """Search the `k` most similar documents to an embedding vector
+
+        Args:
+            embedding (list[float]): query embedding
+            k (int): number of documents to return. Defaults to 4.
+            filter (dict[str, Any], optional): Pinecone-style metadata filter
+
+        Returns:
+            list[tuple[Document, float]]: documents and cosine similarities
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            if len(self._ids) == 0:
+                return []
+            mask = self._filter_mask(filter)
+            if self.search_mode == "ivf" and len(self._ids) >= self.ivf_min_size:
+                if self._ivf_dirty:
+                    self._ivf.fit(self._matrix)
+                    self._ivf_dirty = False
+                candidates = self._ivf.candidates(query)
+                if mask is not None:
+                    candidates &= mask
+                # not enough candidates in probed clusters, scan everything instead
+                if candidates.sum() < k:
+                    candidates = mask
+            else:
+                candidates = mask
+            if candidates is None:
+                rows = np.arange(len(self._ids))
+            else:
+                rows = np.flatnonzero(candidates)
+            if len(rows) == 0:
+                return []
+            scores = self._matrix[rows] @ query
+            k = min(k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._document_at(int(rows[i])), float(scores[i])) for i in top]
+
+    def similarity_search_by_vector(
+        self, embedding: list[float], k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return [
+            doc
+            for doc, _ in self.similarity_search_by_vector_with_score(
+                embedding, k, **kwargs
+            )
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        embedding = self._embedding.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k, **kwargs)
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # scores are cosine similarities, map them into [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: Optional[list[dict]] = None,
+        *,
+        ids: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        store = cls(embedding=embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
@@ -0,0 +1,175 @@
+"""
+Relevance filters applied to retrieved documents before they are used as RAG context
+"""
+
+import os
+from typing import Literal, Optional, Sequence
+
+import numpy as np
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import HumanMessage, SystemMessage
+from pydantic import BaseModel, ConfigDict, Field
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+RelevanceFilterMode = Literal["batched_llm", "embedding", "none"]
+RELEVANCE_FILTER_MODES: tuple[RelevanceFilterMode, ...] = (
+    "batched_llm",
+    "embedding",
+    "none",
+)
+
+
+def _relevance_filter_from_env(
+    default: RelevanceFilterMode = "batched_llm",
+) -> RelevanceFilterMode:
+    """Relevance filter mode set by the `RELEVANCE_FILTER` environment variable,
+    falling back to `default` if it is not a known mode"""
+    mode = os.environ.get("RELEVANCE_FILTER", default)
+    if mode not in RELEVANCE_FILTER_MODES:
+        logger.warning(
+            "Unknown RELEVANCE_FILTER %r, expected one of %s. Using %s",
+            mode,
+            RELEVANCE_FILTER_MODES,
+            default,
+        )
+        return default
+    return mode
+
+
+RELEVANCE_FILTER: RelevanceFilterMode = _relevance_filter_from_env()
+RELEVANCE_MIN_SCORE = int(os.environ.get("RELEVANCE_MIN_SCORE", "5"))
+RELEVANCE_SIMILARITY_THRESHOLD = float(
+    os.environ.get("RELEVANCE_SIMILARITY_THRESHOLD", "0.3")
+)
+
+BATCHED_FILTER_PROMPT = """
+    You are grading the relevance of retrieved documents to a user question.
+    Give each document a score from 0 (unrelated) to 10 (answers the question).
+    Score every document, referring to it by its number.
+"""
+
+
+class DocumentScore(BaseModel):
+    """Relevance score of one of the documents"""
+
+    document: int = Field(description="number of the document")
+    score: int = Field(description="relevance score from 0 to 10")
+
+
+class RelevanceScores(BaseModel):
+    """Relevance scores of the documents"""
+
+    scores: list[DocumentScore]
+
+
+class BatchedLLMFilter(BaseDocumentCompressor):
+    """Keeps documents that an LLM scores as relevant, grading all of them in one call"""
+
+    llm: BaseChatModel
+    min_score: int = RELEVANCE_MIN_SCORE
+
+    def _prompt(self, documents: Sequence[Document], query: str) -> list:
+        docs_str = "\n\n".join(
+            f"Document {i}:\n{doc.page_content}" for i, doc in enumerate(documents)
+        )
+        return [
+            SystemMessage(BATCHED_FILTER_PROMPT),
+            HumanMessage(f"Question: {query}\n\n{docs_str}"),
+        ]
+
+    def _filter(
+        self, documents: Sequence[Document], response: RelevanceScores
+    ) -> list[Document]:
+        scores = {item.document: item.score for item in response.scores}
+        return [
+            doc for i, doc in enumerate(documents) if scores.get(i, 0) >= self.min_score
+        ]
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        if len(documents) == 0:
+            return []
+        response = self.llm.with_structured_output(RelevanceScores).invoke(
+            self._prompt(documents, query), config={"callbacks": callbacks}
+        )
+        return self._filter(documents, response)
+
+    async def acompress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        if len(documents) == 0:
+            return []
+        response = await self.llm.with_structured_output(RelevanceScores).ainvoke(
+            self._prompt(documents, query), config={"callbacks": callbacks}
+        )
+        return self._filter(documents, response)
+
+
+class EmbeddingSimilarityFilter(BaseDocumentCompressor):
+    """Keeps documents whose embedding is similar enough to the query embedding"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    embeddings: Embeddings
+    similarity_threshold: float = RELEVANCE_SIMILARITY_THRESHOLD
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        if len(documents) == 0:
+            return []
+        doc_vectors = np.asarray(
+            self.embeddings.embed_documents([doc.page_content for doc in documents])
+        )
+        query_vector = np.asarray(self.embeddings.embed_query(query))
+        similarities = doc_vectors @ query_vector
+        similarities /= np.linalg.norm(doc_vectors, axis=1) * np.linalg.norm(
+            query_vector
+        )
+        return [
+            doc
+            for doc, similarity in zip(documents, similarities)
+            if similarity >= self.similarity_threshold
+        ]
+
+
+def make_relevance_filter(
+    mode: RelevanceFilterMode, llm: BaseChatModel, embeddings: Embeddings
+) -> BaseDocumentCompressor | None:
+    """Builds the relevance filter of the given mode
+
+    Args:
+        mode (RelevanceFilterMode): "batched_llm" grades all documents in a single LLM
+            call, "embedding" keeps documents similar enough to the query and "none"
+            does not filter
+        llm (BaseChatModel): model used by the batched LLM filter
+        embeddings (Embeddings): model used by the embedding filter. Retrieved
+            documents were embedded at ingestion, so only the query is embedded when
+            it is cached.
+
+    Returns:
+        BaseDocumentCompressor | None: the filter, None when not filtering
+    """
+    if mode == "batched_llm":
+        return BatchedLLMFilter(llm=llm)
+    if mode == "embedding":
+        return EmbeddingSimilarityFilter(embeddings=embeddings)
+    if mode == "none":
+        return None
+    raise ValueError(f"Unknown relevance filter: {mode}")
@@ -0,0 +1,221 @@
+"""
+Semantic cache of retrieval results keyed by query embedding, backed by SQLite
+"""
+
+import hashlib
+import json
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+from langchain_core.documents import Document
+
+from chat.embedding_cache import normalize_text
+from utils.logger import setup_logger
+from utils.sqlite import connect_sqlite
+
+logger = setup_logger(__name__)
+
+
+class SemanticRetrievalCache:
+    """
+    Cache returning the documents retrieved for a previous query similar enough to the
+    new one. Entries expire after `ttl_seconds` and least recently used entries are
+    evicted past `max_entries`. Results are grouped by namespace, which identifies the
+    retrieval settings they were obtained with.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        similarity_threshold: float = 0.95,
+        max_entries: int = 1000,
+        ttl_seconds: float = 24 * 3600,
+    ):
+        """
+        Args:
+            db_path (str): path to the SQLite file backing the cache
+            similarity_threshold (float): minimum cosine similarity between queries to
+                reuse results. Defaults to 0.95.
+            max_entries (int): maximum number of cached queries. Defaults to 1000.
+            ttl_seconds (float): lifetime of cached results. Defaults to 24 hours.
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS retrieval_cache (
+                id INTEGER PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                query_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                documents TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                UNIQUE (namespace, query_hash)
+            )
+            """)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS retrieval_cache_generation (value INTEGER)"
+        )
+        generation = self._conn.execute("SELECT value FROM retrieval_cache_generation")
+        if generation.fetchone() is None:
+            self._conn.execute("INSERT INTO retrieval_cache_generation VALUES (0)")
+        self._conn.commit()
+        # normalized query vectors per namespace, reloaded when the table changes
+        self._vectors: dict[str, tuple[list[int], np.ndarray]] = {}
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict[str, float]:
+        """Hit/miss counters since creation"""
+        n_lookups = self.hits + self.misses
+        return {
+            "retrieval_cache_hits": self.hits,
+            "retrieval_cache_misses": self.misses,
+            "retrieval_cache_hit_rate": self.hits / n_lookups if n_lookups else 0.0,
+        }
+
+    def invalidate(self):
+        """Drops every cached result, in this and other processes sharing the file"""
+        with self._lock:
+            self._conn.execute("DELETE FROM retrieval_cache")
+            self._conn.execute(
+                "UPDATE retrieval_cache_generation SET value = value + 1"
+            )
+            self._conn.commit()
+            self._vectors.clear()
+        logger.info("Retrieval cache invalidated")
+
+    def _sync(self):
+        """Forgets in-memory vectors if the cache was invalidated by another process"""
+        generation = self._conn.execute(
+            "SELECT value FROM retrieval_cache_generation"
+        ).fetchone()[0]
+        if generation != self._generation:
+            self._vectors.clear()
+            self._generation = generation
+
+    def _namespace_vectors(self, namespace: str) -> tuple[list[int], np.ndarray]:
+        if namespace not in self._vectors:
+            rows = self._conn.execute(
+                "SELECT id, vector FROM retrieval_cache WHERE namespace = ?",
+                [namespace],
+            ).fetchall()
+            ids = [row[0] for row in rows]
+            vectors = np.array(
+                [np.frombuffer(row[1], dtype=np.float32) for row in rows]
+            )
+            self._vectors[namespace] = (ids, vectors)
+        return self._vectors[namespace]
+
+    def _get(self, entry_id: int) -> list[Document] | None:
+        """Documents of a cache entry, if it has not expired"""
+        row = self._conn.execute(
+            "SELECT documents FROM retrieval_cache WHERE id = ? AND created_at >= ?",
+            [entry_id, time.time() - self.ttl_seconds],
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute(
+            "UPDATE retrieval_cache SET last_access = ? WHERE id = ?",
+            [time.time(), entry_id],
+        )
+        self._conn.commit()
+        return [Document(**doc) for doc in json.loads(row[0])]
+
+    def _put(
+        self,
+        namespace: str,
+        query_hash: str,
+        vector: np.ndarray,
+        documents: list[Document],
+    ):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO retrieval_cache (namespace, query_hash, vector, "
+            "documents, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                namespace,
+                query_hash,
+                vector.astype(np.float32).tobytes(),
+                json.dumps(
+                    [
+                        {"page_content": doc.page_content, "metadata": doc.metadata}
+                        for doc in documents
+                    ],
+                    default=str,
+                ),
+                now,
+                now,
+            ],
+        )
+        self._conn.execute(
+            "DELETE FROM retrieval_cache WHERE created_at < ?",
+            [now - self.ttl_seconds],
+        )
+        self._conn.execute(
+            "DELETE FROM retrieval_cache WHERE id NOT IN (SELECT id FROM "
+            "retrieval_cache ORDER BY last_access DESC LIMIT ?)",
+            [self.max_entries],
+        )
+        self._conn.commit()
+        self._vectors.clear()
+
+    def get_or_retrieve(
+        self,
+        namespace: str,
+        query: str,
+        embed_query: Callable[[str], list[float]],
+        retrieve: Callable[[list[float]], list[Document]],
+    ) -> list[Document]:
+        """Returns cached documents of a similar query, retrieving them on a miss
+
+        Args:
+            namespace (str): identifier of the retrieval settings
+            query (str): user query
+            embed_query (Callable): embeds the query. Skipped if the exact same query
+                is cached.
+            retrieve (Callable): retrieves documents given the query embedding
+        """
+        query_hash = hashlib.sha256(
+            normalize_text(query).lower().encode("utf-8")
+        ).hexdigest()
+        with self._lock:
+            self._sync()
+            row = self._conn.execute(
+                "SELECT id FROM retrieval_cache WHERE namespace = ? AND query_hash = ?",
+                [namespace, query_hash],
+            ).fetchone()
+            documents = self._get(row[0]) if row is not None else None
+            if documents is not None:
+                self.hits += 1
+                return documents
+
+        vector = np.asarray(embed_query(query), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self._lock:
+            self._sync()
+            generation = self._generation
+            ids, vectors = self._namespace_vectors(namespace)
+            if len(ids) > 0:
+                similarities = vectors @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    documents = self._get(ids[best])
+            if documents is not None:
+                self.hits += 1
+                return documents
+            self.misses += 1
+
+        documents = retrieve(vector.tolist())
+        with self._lock:
+            self._sync()
+            # results retrieved while sources changed may already be outdated
+            if self._generation == generation:
+                self._put(namespace, query_hash, vector, documents)
+        return documents
@@ -0,0 +1,99 @@
+"""
+Write-behind aggregation of source retrieval counts, keeping the database out of the
+retrieval path
+"""
+
+import atexit
+import os
+import threading
+from collections import Counter
+from typing import Callable
+
+from chat.db.database import increment_chat_sources_n_retrieved
+from utils.lazy import lazy_singleton
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+RETRIEVAL_COUNTS_FLUSH_SECONDS = float(
+    os.environ.get("RETRIEVAL_COUNTS_FLUSH_SECONDS", "5")
+)
+RETRIEVAL_COUNTS_FLUSH_EVENTS = int(
+    os.environ.get("RETRIEVAL_COUNTS_FLUSH_EVENTS", "50")
+)
+
+
+class RetrievalCountAggregator:
+    """
+    Accumulates retrieval counts in memory and writes them in a single batch every
+    `flush_seconds`, or as soon as `flush_events` retrievals are pending. Writes happen
+    in a background thread, never in the caller's.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[dict[str, int]], None] = increment_chat_sources_n_retrieved,
+        flush_seconds: float = RETRIEVAL_COUNTS_FLUSH_SECONDS,
+        flush_events: int = RETRIEVAL_COUNTS_FLUSH_EVENTS,
+    ):
+        """
+        Args:
+            flush (Callable): writes counts of new retrievals per source
+            flush_seconds (float): maximum time counts stay in memory
+            flush_events (int): pending retrievals triggering an early flush
+        """
+        self._flush = flush
+        self.flush_seconds = flush_seconds
+        self.flush_events = flush_events
+        self._lock = threading.Lock()
+        self._pending: Counter[str] = Counter()
+        self._n_events = 0
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="retrieval-counts", daemon=True
+        )
+        self._thread.start()
+
+    def add(self, counts: dict[str, int]):
+        """Records one retrieval, with the number of documents of each source"""
+        with self._lock:
+            self._pending.update(counts)
+            self._n_events += 1
+            if self._n_events >= self.flush_events:
+                self._wake.set()
+
+    def flush(self):
+        """Writes pending counts. They are kept for the next flush if writing fails."""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._n_events = 0
+        if not pending:
+            return
+        try:
+            self._flush(dict(pending))
+        except Exception:
+            logger.exception("Failed to flush retrieval counts")
+            with self._lock:
+                self._pending.update(pending)
+
+    def close(self):
+        """Stops the background thread and writes what is pending"""
+        self._closed.set()
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+
+@lazy_singleton
+def get_retrieval_counter() -> RetrievalCountAggregator:
+    """Aggregator of this process, flushed when the process exits"""
+    aggregator = RetrievalCountAggregator()
+    atexit.register(aggregator.close)
+    return aggregator
@@ -1,89 +1,330 @@
-"""Module for managing vector storage of documents using Pinecone and LangChain."""
+"""Module for managing vector storage of documents using Pinecone (or a local index)
+and LangChain."""
 
 import logging
 import os
-from typing import Literal
+import sys
+from itertools import groupby
+from operator import itemgetter
+from typing import Callable, Iterable, Iterator, Literal
 
-import pinecone as pc
 from dotenv import load_dotenv
-from langchain.indexes import SQLRecordManager, index
 from langchain_core.documents import Document
-from langchain_openai import OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from langchain_unstructured import UnstructuredLoader
-from unstructured.cleaners.core import clean_extra_whitespace
+from langchain_core.indexing import RecordManager
+from langchain_core.indexing.api import _HashedDocument
+from langchain_core.vectorstores import VectorStore
 
-from chat.db.database import add_chat_source
+from chat.db.database import (
+    add_chat_source,
+    delete_stale_content_fingerprints,
+    fetch_all_chat_source,
+    hand_over_stale_content_fingerprints,
+)
+from chat.deduplication import deduplicate_documents
+from chat.embedding_cache import CachedEmbeddings
+from chat.ingestion import iter_batches, pipeline
+from chat.lexical_index import LexicalIndex
+from chat.retrieval_cache import SemanticRetrievalCache
+from utils.lazy import lazy_singleton
+from utils.sqlite import get_engine
 
 load_dotenv()
 
-# initialize pinecone index
-pinecone_index = pc.Index(
-    api_key=os.environ["PINECONE_API_KEY"], host=os.environ["PINECONE_INDEX_HOST"]
-)
+# "pinecone" (remote index) or "local" (in-process NumPy index)
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", "pinecone")
+LOCAL_VECTOR_STORE_DIR = "data/local_vector_store"
+EMBEDDING_MODEL = "text-embedding-3-small"
 
-# initialize embeddings model
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+# clients, indexes and caches below are created on first use, so that importing this
+# module (and every page depending on it) stays fast
 
-# initialize vector store
-vector_store = PineconeVectorStore(index=pinecone_index, embedding=embeddings)
 
-# record manager (keeps track of document index)
-record_manager = SQLRecordManager(
-    "pinecone/rl-wizz-rag", db_url="sqlite:///data/record_manager_cache.sql"
-)
-record_manager.create_schema()
+@lazy_singleton
+def get_embeddings() -> CachedEmbeddings:
+    """Embeddings model, only embedding texts that were not embedded before"""
+    from langchain_openai import OpenAIEmbeddings
+
+    return CachedEmbeddings(
+        OpenAIEmbeddings(model=EMBEDDING_MODEL),
+        model_name=EMBEDDING_MODEL,
+        db_path="data/embedding_cache.db",
+        max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "512")) * 1024 * 1024,
+    )
 
 
-# TODO: avoid adding duplicate content from same pdf with different sources.
-def _add_documents_to_vector_store(
-    documents: list[Document], source_type: Literal["pdf", "website"]
-):
-    """Add documents to vector store"""
-    prep_docs = []
+def _init_vector_store(backend: str) -> VectorStore:
+    """Initializes the vector store for the configured backend"""
+    if backend == "pinecone":
+        import pinecone as pc
+        from langchain_pinecone import PineconeVectorStore
+
+        pinecone_index = pc.Index(
+            api_key=os.environ["PINECONE_API_KEY"],
+            host=os.environ["PINECONE_INDEX_HOST"],
+        )
+        return PineconeVectorStore(index=pinecone_index, embedding=get_embeddings())
+    if backend == "local":
+        from chat.local_vector_store import LocalVectorStore
+
+        return LocalVectorStore(
+            embedding=get_embeddings(),
+            persist_dir=LOCAL_VECTOR_STORE_DIR,
+            search_mode=os.environ.get("LOCAL_VECTOR_STORE_SEARCH", "flat"),
+            n_probe=int(os.environ.get("LOCAL_VECTOR_STORE_N_PROBE", "8")),
+        )
+    raise ValueError(f"Unrecognized vector store backend {backend}")
+
+
+@lazy_singleton
+def get_vector_store() -> VectorStore:
+    """Vector store of the configured backend"""
+    return _init_vector_store(VECTOR_STORE_BACKEND)
+
+
+@lazy_singleton
+def get_lexical_index() -> LexicalIndex:
+    """BM25 index of the documents in the vector store, for hybrid search"""
+    return LexicalIndex(f"data/{VECTOR_STORE_BACKEND}_lexical_index.db")
+
+
+@lazy_singleton
+def get_retrieval_cache() -> SemanticRetrievalCache:
+    """Results of previous similar queries, dropped whenever sources change"""
+    return SemanticRetrievalCache(
+        db_path="data/retrieval_cache.db",
+        similarity_threshold=float(
+            os.environ.get("RETRIEVAL_CACHE_SIMILARITY", "0.95")
+        ),
+        max_entries=int(os.environ.get("RETRIEVAL_CACHE_MAX_ENTRIES", "1000")),
+        ttl_seconds=float(os.environ.get("RETRIEVAL_CACHE_TTL_HOURS", "24")) * 3600,
+    )
+
+
+@lazy_singleton
+def get_record_manager() -> RecordManager:
+    """Record manager (keeps track of document index)"""
+    from langchain.indexes import SQLRecordManager
+
+    record_manager = SQLRecordManager(
+        f"{VECTOR_STORE_BACKEND}/rl-wizz-rag",
+        engine=get_engine("data/record_manager_cache.sql"),
+    )
+    record_manager.create_schema()
+    return record_manager
+
+
+INGESTION_BATCH_SIZE = int(os.environ.get("INGESTION_BATCH_SIZE", "64"))
+# batches buffered between ingestion stages
+INGESTION_QUEUE_SIZE = int(os.environ.get("INGESTION_QUEUE_SIZE", "2"))
+
+
+def load_website_documents(url: str) -> Iterator[Document]:
+    """Partitions a website into documents, lazily"""
+    from langchain_unstructured import UnstructuredLoader
+
+    loader = UnstructuredLoader(web_url=url)
+    for doc in loader.lazy_load():
+        if "torch" in sys.modules:
+            # fixes issue with torch loading when using streamlit. pdfs are partitioned
+            # in worker processes, so this is the only place torch loads into the app
+            sys.modules["torch"].classes.__path__ = []
+        yield doc
+
+
+def prepare_documents(
+    documents: Iterable[Document], source_type: Literal["pdf", "website"]
+) -> Iterator[Document]:
+    """Drops pdf elements without layout coordinates and metadata not stored in index"""
     for doc in documents:
+        if source_type == "pdf" and doc.metadata.pop("coordinates", None) is None:
+            continue
         if "links" in doc.metadata:
             del doc.metadata["links"]
-        prep_docs.append(doc)
+        yield doc
+
 
+def _source_id_key(source_type: Literal["pdf", "website"]) -> str:
+    """Metadata key holding the source of documents of a type"""
+    return "source" if source_type == "pdf" else "url"
+
+
+def _add_documents_to_vector_store(
+    documents: list[Document], source_type: Literal["pdf", "website"]
+) -> dict[str, int]:
+    """Add a batch of documents to vector store.
+
+    Documents are also added to the lexical index. Documents of the source that are
+    no longer present are not removed here, since a source spans several batches. See
+    `_delete_stale_documents`.
+    """
+    from langchain.indexes import index
+
+    source_id_key = _source_id_key(source_type)
     result = index(
-        prep_docs,
-        record_manager=record_manager,
-        vector_store=vector_store,
-        cleanup="incremental",
-        source_id_key="source" if source_type == "pdf" else "url",
+        documents,
+        record_manager=get_record_manager(),
+        vector_store=get_vector_store(),
+        cleanup=None,
+        source_id_key=source_id_key,
     )
-    logging.debug("Pinecone database op result: %s", result)
-    logging.info("Added documents to pinecone DB")
+    get_lexical_index().add_documents(documents, source_id_key)
+    return result
+
+
+def _delete_stale_documents(source_name: str, before: float) -> int:
+    """Deletes documents of a source that were not (re)indexed after `before`"""
+    record_manager = get_record_manager()
+    uids = record_manager.list_keys(group_ids=[source_name], before=before)
+    if uids:
+        get_vector_store().delete(uids)
+        record_manager.delete_keys(uids)
+    get_lexical_index().delete_stale(source_name, before)
+    return len(uids)
+
+
+def _index_handed_over_duplicates(source_name: str, before: float) -> int:
+    """Indexes chunks of other sources that were deduplicated against chunks of a
+    source not (re)indexed after `before`, under their own source, before these
+    chunks are deleted"""
+    handed_over = hand_over_stale_content_fingerprints(source_name, before)
+    for (_, doc_type), group in groupby(
+        sorted(handed_over, key=itemgetter(0, 1)), key=itemgetter(0, 1)
+    ):
+        documents = [Document(**document) for _, _, document in group]
+        _add_documents_to_vector_store(documents, doc_type)
+    return len(handed_over)
+
+
+def _fetch_stored_documents(ids: list[str]) -> list[Document]:
+    """Documents of the vector store, with their text and metadata"""
+    vector_store = get_vector_store()
+    try:
+        return vector_store.get_by_ids(ids)
+    except NotImplementedError:
+        pass
+    # PineconeVectorStore does not implement get_by_ids, texts are stored in metadata
+    response = vector_store.index.fetch(ids=ids, namespace=vector_store._namespace)
+    documents = []
+    for _id, vector in response.vectors.items():
+        metadata = dict(vector.metadata)
+        text = metadata.pop(vector_store._text_key)
+        documents.append(Document(id=_id, page_content=text, metadata=metadata))
+    return documents
+
+
+def backfill_lexical_index() -> int:
+    """Adds the documents of sources indexed before the lexical index existed to it,
+    once, from the texts stored in the vector store
+
+    Returns:
+        int: number of documents added
+    """
+    lexical_index = get_lexical_index()
+    if lexical_index.is_backfilled():
+        return 0
+    record_manager = get_record_manager()
+    indexed = lexical_index.source_names()
+    n_documents = 0
+    for source in fetch_all_chat_source():
+        if source.source_name in indexed:
+            continue
+        ids = record_manager.list_keys(group_ids=[source.source_name])
+        for batch in iter_batches(ids, INGESTION_BATCH_SIZE):
+            documents = _fetch_stored_documents(batch)
+            lexical_index.add_documents(documents, _source_id_key(source.doc_type))
+            n_documents += len(documents)
+    lexical_index.mark_backfilled()
+    logging.info("Added %s stored documents to the lexical index", n_documents)
+    return n_documents
+
+
+def get_index_time() -> float:
+    """Current time according to the record manager"""
+    return get_record_manager().get_time()
 
 
-def source_to_vector_store(source_path: str, source_type: Literal["pdf", "website"]):
+def source_to_vector_store(
+    source_path: str,
+    source_type: Literal["pdf", "website"],
+    documents: Iterable[Document],
+    index_started_at: float | None = None,
+    skip_batches: int = 0,
+    on_batch_committed: Callable[[int, dict[str, int]], None] | None = None,
+):
     """
-    Processes and adds a source into the vector store
+    Streams the prepared documents of a source into the vector store.
+
+    Documents are grouped in batches that flow through deduplication, embedding and
+    upsert stages connected by bounded queues, so embedding and upserting of early
+    batches overlap with partitioning of later pages while memory stays flat. Chunks
+    whose content is already stored under another source are not embedded again.
 
     Args:
         source_path (str): path to source file or url
         source_type (Literal[str]): type of source. Can be pdf or website for now.
+        documents (Iterable[Document]): documents of the source, consumed lazily. See
+            `prepare_documents`.
+        index_started_at (float, optional): time indexing of this source started at,
+            when resuming. Documents indexed before it and not since are deleted.
+        skip_batches (int): number of batches already committed, when resuming
+        on_batch_committed (Callable, optional): called with the batch number and the
+            indexing result of each committed batch
     """
-    if source_type == "pdf":
-        loader = UnstructuredLoader(
-            file_path=source_path,
-            strategy="hi_res",
-            post_processors=[clean_extra_whitespace],
-        )
-        docs = [
-            doc for doc in loader.lazy_load() if doc.metadata.pop("coordinates", None)
-        ]
-    elif source_type == "website":
-        loader = UnstructuredLoader(web_url=source_path)
-        docs = list(loader.lazy_load())
-    else:
-        raise ValueError("Unrecognized source_type %s", source_type)
-    logging.info("Retrieved: %s documents from pdf", len(docs))
-    if len(docs) > 0:
-        _add_documents_to_vector_store(docs, source_type)
-        add_chat_source(
-            source_name=source_path,
-            doc_type=source_type,
-            n_related_documents=len(docs),
-        )
+    if index_started_at is None:
+        index_started_at = get_index_time()
+    n_documents = 0
+
+    def numbered_batches() -> Iterator[tuple[int, list[Document]]]:
+        nonlocal n_documents
+        batches = iter_batches(documents, INGESTION_BATCH_SIZE)
+        for batch_number, batch in enumerate(batches):
+            n_documents += len(batch)
+            if batch_number >= skip_batches:
+                yield batch_number, batch
+
+    def deduplicate(item: tuple[int, list[Document]]):
+        batch_number, batch = item
+        unique = deduplicate_documents(source_path, source_type, batch)
+        return batch_number, unique, {"num_deduplicated": len(batch) - len(unique)}
+
+    def embed(item: tuple[int, list[Document], dict[str, int]]):
+        batch_number, batch, stats = item
+        # index() skips chunks already upserted, they need no embedding
+        uids = [_HashedDocument.from_document(doc).uid for doc in batch]
+        upserted = get_record_manager().exists(uids)
+        texts = [doc.page_content for doc, done in zip(batch, upserted) if not done]
+        hits, misses = 0, 0
+        if texts:
+            _, hits, misses = get_embeddings().embed_documents_with_stats(texts)
+        stats |= {"embedding_cache_hits": hits, "embedding_cache_misses": misses}
+        return batch_number, batch, stats
+
+    # upsert stage: index() finds the embeddings of the chunks it upserts in the cache,
+    # computed by the previous stage
+    for batch_number, batch, stats in pipeline(
+        numbered_batches(), deduplicate, embed, queue_size=INGESTION_QUEUE_SIZE
+    ):
+        result = _add_documents_to_vector_store(batch, source_type) | stats
+        logging.info("%s database op result: %s", VECTOR_STORE_BACKEND, result)
+        if on_batch_committed is not None:
+            on_batch_committed(batch_number, result)
+
+    logging.info("Retrieved: %s documents from %s", n_documents, source_type)
+    if n_documents == 0:
+        return
+    n_handed_over = _index_handed_over_duplicates(source_path, before=index_started_at)
+    logging.info("Indexed %s duplicates of stale documents", n_handed_over)
+    n_deleted = _delete_stale_documents(source_path, before=index_started_at)
+    logging.info("Removed %s stale documents of %s", n_deleted, source_path)
+    n_deduplicated = delete_stale_content_fingerprints(
+        source_path, before=index_started_at
+    )
+    logging.info("%s documents of %s are duplicates", n_deduplicated, source_path)
+    add_chat_source(
+        source_name=source_path,
+        doc_type=source_type,
+        n_related_documents=n_documents,
+        n_deduplicated_documents=n_deduplicated,
+    )
+    get_retrieval_cache().invalidate()
+    logging.info("Added documents to %s vector store", VECTOR_STORE_BACKEND)
@@ -2,11 +2,15 @@
 Project-wise utilities
 """
 
-from typing import Any, Iterator
+from typing import Any, AsyncIterator, Iterator
 
 import streamlit as st
 from langchain_core.messages import AIMessage, AIMessageChunk
 
+from utils.aio import iterate_async
+
+LLMStream = Iterator[dict[str, Any] | Any] | AsyncIterator[dict[str, Any] | Any]
+
 
 def _check_if_doing_retrieval(chunk: AIMessageChunk) -> bool:
     """Checks if chunk informs of document retrieval
@@ -24,12 +28,18 @@ def _check_if_doing_retrieval(chunk: AIMessageChunk) -> bool:
     return False
 
 
-def stream_llm_response_with_status(
-    stream: Iterator[dict[str, Any] | Any], status_message: str
-):
+def _as_iterator(stream: LLMStream) -> Iterator[dict[str, Any] | Any]:
+    """Streams of graphs run in async mode are consumed in the graphs event loop"""
+    if isinstance(stream, AsyncIterator):
+        return iterate_async(stream)
+    return stream
+
+
+def stream_llm_response_with_status(stream: LLMStream, status_message: str):
     """
     Yield content of LLM stream, with a status bar before any word is generated
     """
+    stream = _as_iterator(stream)
     container = st.empty()
     with container.status(status_message) as stat:
         first_word = None
@@ -47,11 +57,11 @@ def stream_llm_response_with_status(
     yield from stream_llm_response(stream)
 
 
-def stream_llm_response(stream: Iterator[dict[str, Any] | Any]):
+def stream_llm_response(stream: LLMStream):
     """
     Yield content of LLM stream
     """
-    for chunk, _ in stream:
+    for chunk, _ in _as_iterator(stream):
         if isinstance(chunk, AIMessage):
             yield chunk.content
 
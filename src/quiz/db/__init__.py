@@ -1,2 +1,26 @@
-from .database import add_question, fetch_past_questions
-from .models import ChatSource, PastQuestion
+from .database import (
+    add_pooled_questions,
+    add_question,
+    add_quiz_summary,
+    count_failed_questions,
+    count_past_questions,
+    count_pooled_questions,
+    count_quiz_summaries,
+    delete_outdated_pooled_questions,
+    fetch_learner_profile,
+    fetch_past_questions,
+    fetch_past_questions_page,
+    fetch_questions_after,
+    fetch_quiz_summaries,
+    fetch_summary_progress,
+    pop_pooled_question,
+)
+from .models import (
+    ChatSource,
+    LearnerTopic,
+    PastQuestion,
+    PooledQuestion,
+    QuizSummaryRecord,
+    RecentQuestion,
+    SummaryProgress,
+)
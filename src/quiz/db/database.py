@@ -3,19 +3,99 @@ Module for communicating to general SQLite database
 """
 
 import datetime
+import json
+import os
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import func
+from sqlalchemy.orm import Session, sessionmaker
 
-from .models import Base, PastQuestion
+from quiz.topics import classify_topic, question_fingerprint, question_gist
+from utils.lazy import lazy_singleton
+from utils.logger import setup_logger
+from utils.sqlite import get_engine
 
-DATABASE_URL = "sqlite:///data/database.db"
+from .models import (
+    Base,
+    LearnerTopic,
+    PastQuestion,
+    PooledQuestion,
+    QuizSummaryRecord,
+    RecentQuestion,
+    SummaryProgress,
+)
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+logger = setup_logger(__name__)
 
-SessionLocal = sessionmaker(bind=engine)
+DATABASE_PATH = "data/database.db"
+# questions kept in the learner profile: the last ones, and the last failures
+QUIZ_PROFILE_RECENT_QUESTIONS = int(
+    os.environ.get("QUIZ_PROFILE_RECENT_QUESTIONS", "20")
+)
+QUIZ_PROFILE_RECENT_FAILURES = int(os.environ.get("QUIZ_PROFILE_RECENT_FAILURES", "10"))
+# AI evaluation reports were stored in this file before the quiz_summaries table
+LEGACY_SUMMARIES_PATH = "data/quiz_ai_summaries.json"
+LEGACY_SUMMARIES_DATE_FORMAT = "%d/%m/%Y %H:%M:%S"
 
-Base.metadata.create_all(engine)
+engine = get_engine(DATABASE_PATH)
+
+_session_factory = sessionmaker(bind=engine)
+
+
+def _build_learner_profile():
+    """Builds the learner profile of questions answered before it existed"""
+    with _session_factory() as session:
+        if session.query(LearnerTopic).first() is not None:
+            return
+        past_questions = session.query(PastQuestion).order_by(PastQuestion.date).all()
+        for past_question in past_questions:
+            _add_to_learner_profile(session, past_question)
+        _prune_recent_questions(session)
+        session.commit()
+        if past_questions:
+            logger.info(
+                "Built learner profile from %s past questions", len(past_questions)
+            )
+
+
+def _import_legacy_summaries():
+    """Moves the AI evaluation reports of the legacy JSON file into the
+    quiz_summaries table, renaming the file once imported"""
+    if not os.path.exists(LEGACY_SUMMARIES_PATH):
+        return
+    with open(LEGACY_SUMMARIES_PATH, "r", encoding="utf-8") as file:
+        legacy = json.load(file)
+    with _session_factory() as session:
+        # a previous import may have stopped before renaming the file
+        if session.query(QuizSummaryRecord).first() is None:
+            for summary in legacy:
+                date = datetime.datetime.strptime(
+                    summary.pop("date"), LEGACY_SUMMARIES_DATE_FORMAT
+                )
+                session.add(QuizSummaryRecord(date=date, **summary))
+            session.commit()
+            logger.info("Imported %s AI evaluation reports", len(legacy))
+    os.replace(LEGACY_SUMMARIES_PATH, LEGACY_SUMMARIES_PATH + ".imported")
+
+
+def init_db():
+    """Creates the tables, the learner profile of questions answered before it
+    existed, and imports the reports of the legacy JSON file"""
+    Base.metadata.create_all(engine)
+    # indexes added to tables created by older versions
+    for index in PastQuestion.__table__.indexes:
+        index.create(engine, checkfirst=True)
+    _build_learner_profile()
+    _import_legacy_summaries()
+
+
+# tables are created on first session rather than on import, to keep page loads fast
+_create_tables_once = lazy_singleton(init_db)
+
+
+def SessionLocal() -> Session:
+    """Opens a database session, creating the tables on first use"""
+    _create_tables_once()
+    return _session_factory()
 
 
 def add_question(question: str, solved: bool, answer: str, feedback: str):
@@ -36,9 +116,73 @@ def add_question(question: str, solved: bool, answer: str, feedback: str):
             date=datetime.datetime.now(),
         )
         session.add(user)
+        session.flush()
+        _add_to_learner_profile(session, user)
+        _prune_recent_questions(session)
         session.commit()
 
 
+def _add_to_learner_profile(session: Session, past_question: PastQuestion):
+    topic = classify_topic(past_question.question)
+    learner_topic = session.get(LearnerTopic, topic)
+    if learner_topic is None:
+        learner_topic = LearnerTopic(topic=topic, n_solved=0, n_failed=0)
+        session.add(learner_topic)
+    if past_question.solved:
+        learner_topic.n_solved += 1
+    else:
+        learner_topic.n_failed += 1
+    learner_topic.last_date = past_question.date
+    session.add(
+        RecentQuestion(
+            question_id=past_question.id,
+            topic=topic,
+            fingerprint=question_fingerprint(past_question.question),
+            gist=question_gist(past_question.question),
+            solved=past_question.solved,
+            date=past_question.date,
+        )
+    )
+    session.flush()
+
+
+def _prune_recent_questions(session: Session):
+    """Deletes recent questions that are neither among the last questions nor the
+    last failures"""
+    last_questions = (
+        session.query(RecentQuestion.question_id)
+        .order_by(RecentQuestion.date.desc())
+        .limit(QUIZ_PROFILE_RECENT_QUESTIONS)
+    )
+    last_failures = (
+        session.query(RecentQuestion.question_id)
+        .filter(RecentQuestion.solved.isnot(True))
+        .order_by(RecentQuestion.date.desc())
+        .limit(QUIZ_PROFILE_RECENT_FAILURES)
+    )
+    session.query(RecentQuestion).filter(
+        RecentQuestion.question_id.not_in(last_questions.scalar_subquery()),
+        RecentQuestion.question_id.not_in(last_failures.scalar_subquery()),
+    ).delete(synchronize_session=False)
+
+
+def fetch_learner_profile() -> tuple[list[LearnerTopic], list[RecentQuestion]]:
+    """Fetch the learner profile
+
+    Returns:
+        tuple[list[LearnerTopic], list[RecentQuestion]]: results per topic, most
+        recently practiced first, and recent questions, most recent first
+    """
+    with SessionLocal() as session:
+        topics = (
+            session.query(LearnerTopic).order_by(LearnerTopic.last_date.desc()).all()
+        )
+        recent = (
+            session.query(RecentQuestion).order_by(RecentQuestion.date.desc()).all()
+        )
+        return topics, recent
+
+
 def fetch_past_questions() -> list[PastQuestion]:
     """Fetch all past questions
     Returns:
@@ -47,3 +191,204 @@ def fetch_past_questions() -> list[PastQuestion]:
 
     with SessionLocal() as session:
         return session.query(PastQuestion).order_by(PastQuestion.date.desc()).all()
+
+
+def fetch_past_questions_page(
+    limit: int = 10,
+    before: datetime.datetime | None = None,
+    solved: bool | None = None,
+) -> list[PastQuestion]:
+    """Fetch a page of past questions, most recent first
+
+    Args:
+        limit (int, optional): maximum number of questions. Defaults to 10.
+        before (datetime.datetime | None, optional): date of the last question of
+            the previous page, None for the first page. Defaults to None.
+        solved (bool | None, optional): only fetch questions answered correctly, or
+            only the others. Defaults to None, fetching both.
+    """
+    with SessionLocal() as session:
+        query = _filter_solved(session.query(PastQuestion), solved)
+        if before is not None:
+            query = query.filter(PastQuestion.date < before)
+        return query.order_by(PastQuestion.date.desc()).limit(limit).all()
+
+
+def count_past_questions(solved: bool | None = None) -> int:
+    """Number of past questions, optionally only the ones answered correctly or not
+
+    Args:
+        solved (bool | None, optional): see `fetch_past_questions_page`
+    """
+    with SessionLocal() as session:
+        query = _filter_solved(session.query(func.count(PastQuestion.id)), solved)
+        return query.scalar()
+
+
+def _filter_solved(query, solved: bool | None):
+    if solved is None:
+        return query
+    return query.filter(PastQuestion.solved.is_(solved))
+
+
+def fetch_questions_after(last_question_id: int | None) -> list[PastQuestion]:
+    """Fetch the questions stored after a given one, oldest first
+
+    Args:
+        last_question_id (int | None): id of the last question already processed,
+            None to fetch all questions
+    """
+    with SessionLocal() as session:
+        query = session.query(PastQuestion)
+        if last_question_id is not None:
+            query = query.filter(PastQuestion.id > last_question_id)
+        return query.order_by(PastQuestion.id).all()
+
+
+# the progress of the evaluation reports is stored in a single row
+_SUMMARY_PROGRESS_ID = 1
+
+
+def fetch_summary_progress() -> SummaryProgress | None:
+    """Fetch the progress of the evaluation reports, None if none was generated"""
+    with SessionLocal() as session:
+        return session.get(SummaryProgress, _SUMMARY_PROGRESS_ID)
+
+
+def add_quiz_summary(
+    overall_performance: str,
+    areas_improvement: list[str],
+    suggestion: str,
+    n_correct_questions: int,
+    n_incorrect_questions: int,
+    last_question_id: int,
+):
+    """Stores an AI evaluation report, and the progress of the reports up to it, in
+    a single transaction
+
+    Args:
+        overall_performance (str): overall assessment of the learner
+        areas_improvement (list[str]): topics to work on
+        suggestion (str): suggestion of what to improve
+        n_correct_questions (int): questions answered correctly up to the report
+        n_incorrect_questions (int): questions not answered correctly up to it
+        last_question_id (int): id of the last summarized question
+    """
+    now = datetime.datetime.now()
+    with SessionLocal() as session:
+        session.add(
+            QuizSummaryRecord(
+                overall_performance=overall_performance,
+                areas_improvement=areas_improvement,
+                suggestion=suggestion,
+                n_correct_questions=n_correct_questions,
+                n_incorrect_questions=n_incorrect_questions,
+                date=now,
+            )
+        )
+        session.merge(
+            SummaryProgress(
+                id=_SUMMARY_PROGRESS_ID,
+                last_question_id=last_question_id,
+                n_correct=n_correct_questions,
+                n_incorrect=n_incorrect_questions,
+                date=now,
+            )
+        )
+        session.commit()
+
+
+def fetch_quiz_summaries(
+    limit: int = 10, before_id: int | None = None
+) -> list[QuizSummaryRecord]:
+    """Fetch a page of AI evaluation reports, most recent first
+
+    Args:
+        limit (int, optional): maximum number of reports. Defaults to 10.
+        before_id (int | None, optional): id of the last report of the previous
+            page, None for the first page. Defaults to None.
+    """
+    with SessionLocal() as session:
+        query = session.query(QuizSummaryRecord)
+        if before_id is not None:
+            query = query.filter(QuizSummaryRecord.id < before_id)
+        return query.order_by(QuizSummaryRecord.id.desc()).limit(limit).all()
+
+
+def count_quiz_summaries() -> int:
+    """Number of AI evaluation reports"""
+    with SessionLocal() as session:
+        return session.query(QuizSummaryRecord).count()
+
+
+def count_failed_questions() -> int:
+    """Number of questions the learner did not answer correctly"""
+    with SessionLocal() as session:
+        return session.query(func.sum(LearnerTopic.n_failed)).scalar() or 0
+
+
+def add_pooled_questions(questions: list[str], n_failed_at_generation: int):
+    """Adds generated questions to the pool
+
+    Args:
+        questions (list[str]): new questions
+        n_failed_at_generation (int): failed questions of the learner when the
+            questions were generated
+    """
+    now = datetime.datetime.now()
+    with SessionLocal() as session:
+        session.add_all(
+            [
+                PooledQuestion(
+                    question=question,
+                    n_failed_at_generation=n_failed_at_generation,
+                    date=now,
+                )
+                for question in questions
+            ]
+        )
+        session.commit()
+
+
+def delete_outdated_pooled_questions(min_n_failed_at_generation: int) -> int:
+    """Deletes pooled questions generated before the learner's recent failures
+
+    Returns:
+        int: number of deleted questions
+    """
+    with SessionLocal() as session:
+        n_deleted = (
+            session.query(PooledQuestion)
+            .filter(PooledQuestion.n_failed_at_generation < min_n_failed_at_generation)
+            .delete()
+        )
+        session.commit()
+    return n_deleted
+
+
+def count_pooled_questions() -> int:
+    """Number of questions in the pool"""
+    with SessionLocal() as session:
+        return session.query(PooledQuestion).count()
+
+
+def pop_pooled_question() -> str | None:
+    """Removes the oldest question of the pool and returns it, if any"""
+    with SessionLocal() as session:
+        while True:
+            pooled = (
+                session.query(PooledQuestion.id, PooledQuestion.question)
+                .order_by(PooledQuestion.id)
+                .first()
+            )
+            if pooled is None:
+                return None
+            # another session may have taken it meanwhile
+            n_deleted = (
+                session.query(PooledQuestion)
+                .filter(PooledQuestion.id == pooled.id)
+                .delete()
+            )
+            session.commit()
+            if n_deleted == 1:
+                return pooled.question
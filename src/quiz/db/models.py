@@ -2,7 +2,16 @@
 Models for SQLite Database
 """
 
-from sqlalchemy import Boolean, Column, DateTime, Integer, String
+from sqlalchemy import (
+    JSON,
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+)
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -21,6 +30,79 @@ class PastQuestion(Base):
     solved = Column(Boolean)
     date = Column(DateTime, unique=True)
 
+    # pages of passed or failed questions, most recent first; the unique constraint
+    # on date indexes pages of all questions
+    __table_args__ = (Index("ix_past_questions_solved_date", "solved", "date"),)
+
+
+class LearnerTopic(Base):
+    """
+    Quiz results of the learner on a topic, updated with each answered question
+    """
+
+    __tablename__ = "learner_topics"
+    topic = Column(String, primary_key=True)
+    n_solved = Column(Integer, default=0)
+    n_failed = Column(Integer, default=0)
+    last_date = Column(DateTime)
+
+
+class RecentQuestion(Base):
+    """
+    Gist of a recently asked question, kept while among the last questions or the
+    last failures of the learner
+    """
+
+    __tablename__ = "learner_recent_questions"
+    question_id = Column(Integer, ForeignKey(PastQuestion.id), primary_key=True)
+    topic = Column(String)
+    fingerprint = Column(String, index=True)
+    gist = Column(String)
+    solved = Column(Boolean)
+    date = Column(DateTime, index=True)
+
+
+class PooledQuestion(Base):
+    """
+    Question generated ahead of time, waiting to be asked
+    """
+
+    __tablename__ = "question_pool"
+    id = Column(Integer, primary_key=True)
+    question = Column(String)
+    # failed questions of the learner when generated, to detect outdated questions
+    n_failed_at_generation = Column(Integer)
+    date = Column(DateTime)
+
+
+class SummaryProgress(Base):
+    """
+    Progress of the AI evaluation reports: last question summarized, and running
+    counts of the questions summarized so far
+    """
+
+    __tablename__ = "quiz_summary_progress"
+    id = Column(Integer, primary_key=True)
+    last_question_id = Column(Integer)
+    n_correct = Column(Integer, default=0)
+    n_incorrect = Column(Integer, default=0)
+    date = Column(DateTime)
+
+
+class QuizSummaryRecord(Base):
+    """
+    AI evaluation report on the answers to quiz questions
+    """
+
+    __tablename__ = "quiz_summaries"
+    id = Column(Integer, primary_key=True)
+    overall_performance = Column(String)
+    areas_improvement = Column(JSON)
+    suggestion = Column(String)
+    n_correct_questions = Column(Integer)
+    n_incorrect_questions = Column(Integer)
+    date = Column(DateTime, index=True)
+
 
 class ChatSource(Base):
     """
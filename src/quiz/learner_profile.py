@@ -0,0 +1,72 @@
+"""
+Summary of the learner profile given to the quiz-maker, within a fixed token budget
+"""
+
+import math
+import os
+
+from quiz.db import LearnerTopic, RecentQuestion
+
+DATE_FORMAT = "%d/%m/%Y"
+QUIZ_PROFILE_TOKEN_BUDGET = int(os.environ.get("QUIZ_PROFILE_TOKEN_BUDGET", "600"))
+# average length of a token of English text for OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate number of tokens of a text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _question_lines(questions: list[RecentQuestion]) -> list[str]:
+    """One line per question, skipping rewordings of questions already listed"""
+    lines = []
+    fingerprints = set()
+    for question in questions:
+        if question.fingerprint not in fingerprints:
+            fingerprints.add(question.fingerprint)
+            lines.append(f"- [{question.date.strftime(DATE_FORMAT)}] {question.gist}")
+    return lines
+
+
+def render_learner_profile(
+    topics: list[LearnerTopic],
+    recent: list[RecentQuestion],
+    token_budget: int = QUIZ_PROFILE_TOKEN_BUDGET,
+) -> str:
+    """Text of the learner profile, its most useful parts first, cut at the budget
+
+    Args:
+        topics (list[LearnerTopic]): results per topic
+        recent (list[RecentQuestion]): recent questions, most recent first
+        token_budget (int): maximum number of tokens of the text
+    """
+    sections = [
+        (
+            "Results per topic (solved / failed):",
+            [f"- {t.topic}: {t.n_solved} / {t.n_failed}" for t in topics],
+        ),
+        (
+            "Recent questions not answered correctly (format: [date] question):",
+            _question_lines([q for q in recent if not q.solved]),
+        ),
+        (
+            "Recent questions answered correctly (format: [date] question):",
+            _question_lines([q for q in recent if q.solved]),
+        ),
+    ]
+    lines = []
+    n_tokens = 0
+    for header, section_lines in sections:
+        # a header is only worth its tokens with at least one line under it
+        pending = [header]
+        for line in section_lines:
+            cost = sum(estimate_tokens(text) + 1 for text in pending + [line])
+            if n_tokens + cost > token_budget:
+                break
+            lines.extend(pending + [line])
+            n_tokens += cost
+            pending = []
+    if not lines:
+        return "The learner has not answered any question yet."
+    return "\n".join(lines)
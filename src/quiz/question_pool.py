@@ -0,0 +1,123 @@
+"""
+Pool of quiz questions generated ahead of time by a background worker, so that the
+next question is ready as soon as the learner asks for it
+"""
+
+import atexit
+import os
+import threading
+from typing import Callable
+
+import streamlit as st
+from langchain_openai import ChatOpenAI
+
+from quiz.db import (
+    add_pooled_questions,
+    count_failed_questions,
+    count_pooled_questions,
+    delete_outdated_pooled_questions,
+    pop_pooled_question,
+)
+from quiz.quiz_model import generate_question_batch
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+QUIZ_POOL_BATCH_SIZE = int(os.environ.get("QUIZ_POOL_BATCH_SIZE", "5"))
+QUIZ_POOL_LOW_WATERMARK = int(os.environ.get("QUIZ_POOL_LOW_WATERMARK", "2"))
+# new failures of the learner after which pooled questions no longer suit them
+QUIZ_POOL_INVALIDATE_FAILURES = int(
+    os.environ.get("QUIZ_POOL_INVALIDATE_FAILURES", "2")
+)
+
+
+class QuestionPool:
+    """
+    Questions stored in the database, generated `batch_size` at a time in a
+    background thread whenever fewer than `low_watermark` are left. Questions
+    generated before the learner failed `invalidate_failures` more questions are
+    dropped, as the learner profile they were based on has changed.
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[int], list[str]],
+        batch_size: int = QUIZ_POOL_BATCH_SIZE,
+        low_watermark: int = QUIZ_POOL_LOW_WATERMARK,
+        invalidate_failures: int = QUIZ_POOL_INVALIDATE_FAILURES,
+    ):
+        """
+        Args:
+            generate (Callable): generates the given number of questions
+            batch_size (int): questions generated per call
+            low_watermark (int): pool size below which questions are generated
+            invalidate_failures (int): new failures making pooled questions outdated
+        """
+        self._generate = generate
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark
+        self.invalidate_failures = invalidate_failures
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="question-pool", daemon=True
+        )
+        self._thread.start()
+        self._wake.set()
+
+    def take(self) -> str | None:
+        """Removes a question from the pool, None if no up-to-date one is ready.
+        Refills the pool in the background when running low."""
+        self._drop_outdated(count_failed_questions())
+        question = pop_pooled_question()
+        if count_pooled_questions() < self.low_watermark:
+            self._wake.set()
+        return question
+
+    def refill(self):
+        """Generates questions until the pool reaches the low watermark"""
+        n_failed = count_failed_questions()
+        self._drop_outdated(n_failed)
+        while count_pooled_questions() < self.low_watermark:
+            questions = self._generate(self.batch_size)
+            if not questions:
+                break
+            add_pooled_questions(questions, n_failed)
+            logger.info("Added %s questions to the pool", len(questions))
+
+    def close(self):
+        """Stops the background thread, waiting for a running generation"""
+        self._closed.set()
+        self._wake.set()
+        self._thread.join()
+
+    def _drop_outdated(self, n_failed: int):
+        n_deleted = delete_outdated_pooled_questions(
+            n_failed - self.invalidate_failures + 1
+        )
+        if n_deleted > 0:
+            logger.info("Dropped %s outdated pooled questions", n_deleted)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._closed.is_set():
+                return
+            try:
+                self.refill()
+            except Exception:
+                logger.exception("Failed to refill the question pool")
+
+
+@st.cache_resource
+def init_question_pool(model_name: str) -> QuestionPool:
+    """Question pool of the learner, filled with questions of the given model
+
+    Args:
+        model_name (str): LLM model name generating the questions
+    """
+    model = ChatOpenAI(model_name=model_name)
+    pool = QuestionPool(lambda n: generate_question_batch(model, n))
+    atexit.register(pool.close)
+    return pool
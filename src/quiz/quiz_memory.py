@@ -0,0 +1,106 @@
+"""
+In-memory checkpointer of quiz threads, bounded in number and lifetime
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.memory import MemorySaver
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+QUIZ_MAX_THREADS = int(os.environ.get("QUIZ_MAX_THREADS", "1000"))
+QUIZ_THREAD_TTL_MINUTES = float(os.environ.get("QUIZ_THREAD_TTL_MINUTES", "60"))
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    MemorySaver forgetting threads not accessed for `ttl_seconds`, and the least
+    recently used ones past `max_threads`. Threads of finished quizzes can also be
+    deleted right away.
+    """
+
+    def __init__(
+        self,
+        max_threads: int = QUIZ_MAX_THREADS,
+        ttl_seconds: float = QUIZ_THREAD_TTL_MINUTES * 60,
+    ):
+        """
+        Args:
+            max_threads (int): maximum number of threads kept in memory
+            ttl_seconds (float): time after which an untouched thread is forgotten
+        """
+        super().__init__()
+        self.max_threads = max_threads
+        self.ttl_seconds = ttl_seconds
+        self.n_evicted = 0
+        self._lock = threading.RLock()
+        # last access time of each thread, least recently used first
+        self._last_access: OrderedDict[str, float] = OrderedDict()
+
+    def stats(self) -> dict[str, int]:
+        """Live threads, and threads evicted since creation"""
+        with self._lock:
+            return {
+                "quiz_live_threads": len(self._last_access),
+                "quiz_evicted_threads": self.n_evicted,
+            }
+
+    def delete_thread(self, thread_id: str):
+        """Forgets the checkpoints and pending writes of a thread"""
+        with self._lock:
+            self._last_access.pop(thread_id, None)
+            self.storage.pop(thread_id, None)
+            for key in [key for key in self.writes if key[0] == thread_id]:
+                del self.writes[key]
+            for key in [key for key in self.blobs if key[0] == thread_id]:
+                del self.blobs[key]
+
+    def _touch(self, config: RunnableConfig):
+        thread_id = config["configurable"]["thread_id"]
+        now = time.monotonic()
+        with self._lock:
+            self._last_access[thread_id] = now
+            self._last_access.move_to_end(thread_id)
+            # expired threads are the least recently used ones
+            n_expired = 0
+            for last_access in self._last_access.values():
+                if now - last_access <= self.ttl_seconds:
+                    break
+                n_expired += 1
+            n_evicted = max(n_expired, len(self._last_access) - self.max_threads)
+            evicted = [
+                other
+                for other in list(self._last_access)[:n_evicted]
+                if other != thread_id
+            ]
+            for other in evicted:
+                self.delete_thread(other)
+            self.n_evicted += len(evicted)
+        if evicted:
+            logger.info(
+                "Evicted %s quiz threads, %s live", len(evicted), len(self._last_access)
+            )
+
+    def get_tuple(self, config: RunnableConfig):
+        with self._lock:
+            # a thread never written, e.g. probed for a new quiz, is not made live.
+            # storage is a defaultdict, reading it through super() would add the thread
+            if not self.storage.get(config["configurable"]["thread_id"]):
+                return None
+            self._touch(config)
+        return super().get_tuple(config)
+
+    def put(self, config: RunnableConfig, *args: Any, **kwargs: Any):
+        self._touch(config)
+        return super().put(config, *args, **kwargs)
+
+    def put_writes(self, config: RunnableConfig, *args: Any, **kwargs: Any):
+        self._touch(config)
+        return super().put_writes(config, *args, **kwargs)
@@ -2,23 +2,29 @@
 Interface to interact with the Quiz application
 """
 
-from typing import Any, Iterator
+import asyncio
+import re
+from typing import Any, AsyncIterator, Iterator
 
 import streamlit as st
 from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.runnables import RunnableLambda
 from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import START, MessagesState, StateGraph
 from langgraph.graph.state import CompiledStateGraph
 from langgraph.types import Command, interrupt
+from pydantic import BaseModel, Field
 from typing_extensions import TypedDict
 
-from quiz.db import add_question, fetch_past_questions
+from quiz.db import add_question, fetch_learner_profile
+from quiz.learner_profile import render_learner_profile
+from quiz.quiz_memory import BoundedMemorySaver
 
 load_dotenv()
 
-DATE_FORMAT = "%d/%m/%Y"
-
 
 class QuizState(TypedDict):
     """Quiz data"""
@@ -29,6 +35,51 @@ class QuizState(TypedDict):
     solved: bool | None = None
 
 
+class QuestionBatch(BaseModel):
+    """Questions generated in a single call"""
+
+    questions: list[str] = Field(description="the questions, without numbering")
+
+
+def question_prompt(n_questions: int = 1) -> str:
+    """Prompt asking for new questions suited to the learner profile"""
+    learner_profile = render_learner_profile(*fetch_learner_profile())
+    if n_questions == 1:
+        task = "Randomly choose a question"
+        response_format = "Your response should just contain the question."
+    else:
+        task = f"Randomly choose {n_questions} different questions, on varied topics,"
+        response_format = "Each question should be understandable on its own."
+    prompt = f"""
+        You are a helpful quizz-maker with the goal of teaching reinforcement learning.
+        Be gentle when interacting with user.
+
+        {task} to test his/her reinforcement learning knowledge. The question can be any of the types
+        listed below:
+
+        - Conceptual
+        - Multiple choice
+        - Understanding of a piece of code
+
+        When choosing the topic, structure and difficulty for the new question, consider the learner's
+        profile below: favour topics with failures or little practice, revisit questions not answered
+        correctly from another angle, and avoid repeating questions answered correctly.
+
+        {learner_profile}
+
+        {response_format}
+    """
+    return prompt
+
+
+def generate_question_batch(model: BaseChatModel, n_questions: int) -> list[str]:
+    """Generates several questions in a single LLM call"""
+    response = model.with_structured_output(QuestionBatch).invoke(
+        question_prompt(n_questions)
+    )
+    return [question for question in response.questions if question.strip()]
+
+
 @st.cache_resource
 def init_quiz_app(model_name: str) -> CompiledStateGraph:
     """Initialized a LangGraph app for quizzing user
@@ -39,45 +90,34 @@ def init_quiz_app(model_name: str) -> CompiledStateGraph:
     Returns:
         CompiledStateGraph: LangGraph quiz app
     """
+    return build_quiz_graph(ChatOpenAI(model_name=model_name))
 
-    workflow = StateGraph(state_schema=MessagesState)
-
-    model = ChatOpenAI(model_name=model_name)
 
-    def ask_question(state: QuizState):
-        """Random question to ask user"""
-        solved_quizzes = []
-        unsolved_quizzes = []
-        for q in fetch_past_questions():
-            date_str = q.date.strftime(DATE_FORMAT)
-            q_str = f"[{date_str}] " + q.question
-            if q.solved:
-                solved_quizzes.append(q_str)
-                continue
-            unsolved_quizzes.append(q_str)
-        prompt = f"""
-            You are a helpful quizz-maker with the goal of teaching reinforcement learning.
-            Be gentle when interacting with user.
+def build_quiz_graph(
+    model: BaseChatModel, checkpointer: BaseCheckpointSaver | None = None
+) -> CompiledStateGraph:
+    """Builds the LangGraph quiz app. The model is called synchronously when the
+    graph is run with `stream`, and asynchronously with `astream`.
 
-            Randomly choose a question to test his/her reinforcement learning knowledge. The question can be any of the types
-            listed below:
-
-            - Conceptual
-            - Multiple choice
-            - Understanding of a piece of code
-
-            When choosing the topic, structure and difficulty for the new question, try to avoid repeating past
-            questions answered correctly as specified by the following list (format: [date] question):
+    Args:
+        model (BaseChatModel): LLM asking questions and evaluating answers
+        checkpointer (BaseCheckpointSaver, optional): memory of the quiz threads.
+            Defaults to None, keeping a bounded number of threads in memory.
 
-            {" ; ".join(solved_quizzes)}
+    Returns:
+        CompiledStateGraph: LangGraph quiz app
+    """
 
-            And consider the following list of questions not answered correctly:
+    workflow = StateGraph(state_schema=MessagesState)
 
-            {" ; ".join(unsolved_quizzes)}
+    def ask_question(state: QuizState):
+        """Random question to ask user"""
+        question = model.invoke(question_prompt())
+        return {"question": question.content}
 
-            Your response should just contain the question.
-        """
-        question = model.invoke(prompt)
+    async def aask_question(state: QuizState):
+        prompt = await asyncio.to_thread(question_prompt)
+        question = await model.ainvoke(prompt)
         return {"question": question.content}
 
     def human_answer(state: QuizState):
@@ -85,9 +125,8 @@ def init_quiz_app(model_name: str) -> CompiledStateGraph:
         answer = interrupt("Please provide answer ... ")
         return {"answer": answer}
 
-    def evaluation(state: QuizState):
-        """Evaluation of answer provided by user"""
-        prompt = f"""
+    def evaluation_prompt(state: QuizState) -> str:
+        return f"""
         You are quizzing a user who is trying to learn so you should use second-person and be
         sympathetic while not condescending. Try to be funny if possible
 
@@ -98,16 +137,24 @@ def init_quiz_app(model_name: str) -> CompiledStateGraph:
         - Congratulations to user if correct. Be effusive in congratulations and consider using emojis.
         - Brief explanation of why the answer is right or wrong. Be more detailed when answer is wrong.
         """
-        model_evaluation = model.invoke(prompt)
+
+    def evaluation_update(evaluation_content: str) -> dict[str, Any]:
         return {
-            "model_evaluation": model_evaluation.content,
+            "model_evaluation": evaluation_content,
             "solved": (
-                True
-                if "correct" in model_evaluation.content[:10].strip().lower()
-                else False
+                True if "correct" in evaluation_content[:10].strip().lower() else False
             ),
         }
 
+    def evaluation(state: QuizState):
+        """Evaluation of answer provided by user"""
+        model_evaluation = model.invoke(evaluation_prompt(state))
+        return evaluation_update(model_evaluation.content)
+
+    async def aevaluation(state: QuizState):
+        model_evaluation = await model.ainvoke(evaluation_prompt(state))
+        return evaluation_update(model_evaluation.content)
+
     def save_question_in_database(state: QuizState):
         add_question(
             state["question"],
@@ -116,9 +163,16 @@ def init_quiz_app(model_name: str) -> CompiledStateGraph:
             state["model_evaluation"],
         )
 
-    workflow.add_node("ask_question", ask_question)
+    # nodes with an async variant read the quiz state, as the others infer from hints
+    workflow.add_node(
+        "ask_question",
+        RunnableLambda(ask_question, afunc=aask_question),
+        input=QuizState,
+    )
     workflow.add_node("human_answer", human_answer)
-    workflow.add_node("evaluation", evaluation)
+    workflow.add_node(
+        "evaluation", RunnableLambda(evaluation, afunc=aevaluation), input=QuizState
+    )
     workflow.add_node("save_quiz", save_question_in_database)
 
     workflow.add_edge(START, "ask_question")
@@ -126,28 +180,73 @@ def init_quiz_app(model_name: str) -> CompiledStateGraph:
     workflow.add_edge("human_answer", "evaluation")
     workflow.add_edge("evaluation", "save_quiz")
 
-    # checkpoint
-    memory = MemorySaver()
-
-    # compile graph
-    workflow = workflow.compile(checkpointer=memory)
+    # compile graph, with one checkpoint thread per quiz session
+    workflow = workflow.compile(checkpointer=checkpointer or BoundedMemorySaver())
 
     return workflow
 
 
-def ask_question_stream(wf: CompiledStateGraph) -> Iterator[dict[str, Any] | Any]:
+def is_awaiting_answer(wf: CompiledStateGraph, thread_id: str) -> bool:
+    """Whether the quiz thread asked a question and waits for the answer. Threads of
+    abandoned quizzes may have been evicted meanwhile."""
+    config = {"configurable": {"thread_id": thread_id}}
+    return wf.get_state(config).next == ("human_answer",)
+
+
+def finish_quiz_thread(wf: CompiledStateGraph, thread_id: str):
+    """Frees the memory of a quiz thread whose question was evaluated and saved"""
+    wf.checkpointer.delete_thread(thread_id)
+
+
+def pooled_question_stream(
+    wf: CompiledStateGraph, thread_id: str, question: str
+) -> Iterator[tuple[AIMessageChunk, dict[str, Any]]]:
+    """
+    Stream a question generated ahead of time, as if it was being formulated
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    wf.update_state(config, {"question": question}, as_node="ask_question")
+    # runs until the graph waits for the answer
+    wf.invoke(None, config)
+    for token in re.findall(r"\S+\s*", question):
+        yield AIMessageChunk(content=token), {"langgraph_node": "ask_question"}
+
+
+def ask_question_stream(
+    wf: CompiledStateGraph, thread_id: str
+) -> Iterator[dict[str, Any] | Any]:
     """
     Stream question formulation
     """
-    config = {"configurable": {"thread_id": "quizzer"}}
+    config = {"configurable": {"thread_id": thread_id}}
     return wf.stream(QuizState(), config=config, stream_mode="messages")
 
 
 def evaluate_answer_stream(
-    wf: CompiledStateGraph, answer: str
+    wf: CompiledStateGraph, answer: str, thread_id: str
 ) -> Iterator[dict[str, Any] | Any]:
     """
     Stream quiz evaluation and explanation
     """
-    config = {"configurable": {"thread_id": "quizzer"}}
+    config = {"configurable": {"thread_id": thread_id}}
     return wf.stream(Command(resume=answer), config=config, stream_mode="messages")
+
+
+def ask_question_astream(
+    wf: CompiledStateGraph, thread_id: str
+) -> AsyncIterator[dict[str, Any] | Any]:
+    """
+    Stream question formulation, running the graph asynchronously
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    return wf.astream(QuizState(), config=config, stream_mode="messages")
+
+
+def evaluate_answer_astream(
+    wf: CompiledStateGraph, answer: str, thread_id: str
+) -> AsyncIterator[dict[str, Any] | Any]:
+    """
+    Stream quiz evaluation and explanation, running the graph asynchronously
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    return wf.astream(Command(resume=answer), config=config, stream_mode="messages")
@@ -3,12 +3,30 @@ Streamlit page for an interactive quiz application that
 generates questions and evaluates answers using LLM.
 """
 
+import uuid
+
 import streamlit as st
 
 from helpers import stream_llm_response_with_status
-from quiz.quiz_model import ask_question_stream, evaluate_answer_stream, init_quiz_app
+from quiz.quiz_model import (
+    ask_question_astream,
+    ask_question_stream,
+    evaluate_answer_astream,
+    evaluate_answer_stream,
+    finish_quiz_thread,
+    init_quiz_app,
+    is_awaiting_answer,
+    pooled_question_stream,
+)
+from quiz.question_pool import init_question_pool
+from utils.aio import GRAPH_EXECUTION
 
 quiz_app = init_quiz_app("gpt-4o-mini")
+question_pool = init_question_pool("gpt-4o-mini")
+
+if "quiz_thread_id" not in st.session_state:
+    # quiz graph thread of this session, so that learners do not share interrupts
+    st.session_state.quiz_thread_id = str(uuid.uuid4())
 
 
 class QuizStageNames:
@@ -48,10 +66,17 @@ def question_stage():
     if QuizStageNames.quiz_question in st.session_state:
         render_stored_component(QuizStageNames.quiz_question)
     else:
+        thread_id = st.session_state.quiz_thread_id
+        pooled = question_pool.take()
+        if pooled is not None:
+            # generated ahead of time, only streamed for a consistent experience
+            stream = pooled_question_stream(quiz_app, thread_id, pooled)
+        elif GRAPH_EXECUTION == "async":
+            stream = ask_question_astream(quiz_app, thread_id)
+        else:
+            stream = ask_question_stream(quiz_app, thread_id)
         full_question = st.write_stream(
-            stream_llm_response_with_status(
-                ask_question_stream(quiz_app), "Generating quiz question ..."
-            )
+            stream_llm_response_with_status(stream, "Generating quiz question ...")
         )
         st.session_state[QuizStageNames.quiz_question] = full_question
 
@@ -88,15 +113,28 @@ def evaluation_stage():
         and QuizStageNames.quiz_answer in st.session_state
         and QuizStageNames.quiz_evaluation not in st.session_state
     ):
+        thread_id = st.session_state.quiz_thread_id
+        if not is_awaiting_answer(quiz_app, thread_id):
+            # the thread of an abandoned quiz was evicted
+            st.toast("This question expired, here is a new one")
+            del st.session_state[QuizStageNames.quiz_question]
+            del st.session_state[QuizStageNames.quiz_answer]
+            st.rerun()
+        stream_evaluation = (
+            evaluate_answer_astream
+            if GRAPH_EXECUTION == "async"
+            else evaluate_answer_stream
+        )
         evaluation = st.write_stream(
             stream_llm_response_with_status(
-                evaluate_answer_stream(
-                    quiz_app, st.session_state[QuizStageNames.quiz_answer]
+                stream_evaluation(
+                    quiz_app, st.session_state[QuizStageNames.quiz_answer], thread_id
                 ),
                 "Evaluating your answer ...",
             )
         )
         st.session_state.quiz_evaluation = evaluation
+        finish_quiz_thread(quiz_app, thread_id)
 
 
 def repeat_quiz_stage():
@@ -1,42 +1,54 @@
-import json
-import os
-
 import streamlit as st
 from streamlit_extras.stylable_container import stylable_container
 
-from quiz.db import PastQuestion, fetch_past_questions
-from quiz.quiz_summary_model import QuizSummary, init_quiz_summary_wf
+from quiz.db import PastQuestion, count_past_questions, fetch_past_questions_page
+from quiz.quiz_summary_model import (
+    QuizSummary,
+    init_quiz_summary_wf,
+    load_quiz_summaries,
+)
 
 # Display data
 st.header("Past Questions")
 
 N_QUESTIONS_SHOWN = 10
+QUESTION_FILTERS = {"All": None, "Passed": True, "Failed": False}
 
-# Past questions table
-past_questions = fetch_past_questions()
-past_questions = sorted(past_questions, key=lambda q: q.date, reverse=True)
-labels = [
-    (i, min(i + N_QUESTIONS_SHOWN, len(past_questions)))
-    for i in range(0, len(past_questions), N_QUESTIONS_SHOWN)
-]
+if "question_cursors" not in st.session_state:
+    # date of the last question of each previous page, for keyset pagination
+    st.session_state.question_cursors = []
 
-if "question_selections" not in st.session_state:
-    st.session_state.question_selections = [
-        0,
-        min(len(past_questions), N_QUESTIONS_SHOWN),
-    ]
 
+def on_select_question_filter():
+    """
+    Go back to the first page when filtering questions
+    """
+    st.session_state.question_cursors = []
 
-def format_question_selector(label: tuple[int, int]) -> str:
-    """Format question selector (from, to) into displayed text from-to
 
-    Args:
-        label (tuple[int, int]): ids from question to question
+question_filter = st.segmented_control(
+    "Questions",
+    options=list(QUESTION_FILTERS),
+    default="All",
+    key="question_filter",
+    on_change=on_select_question_filter,
+    label_visibility="collapsed",
+)
+solved_filter = QUESTION_FILTERS.get(question_filter)
+n_questions = count_past_questions()
+n_filtered = (
+    n_questions if solved_filter is None else count_past_questions(solved_filter)
+)
 
-    Returns:
-        str: how selector is displayed
-    """
-    return f"{label[0]} - {label[1]}"
+# Past questions table, one more question than shown to know if there are older ones
+cursors = st.session_state.question_cursors
+past_questions = fetch_past_questions_page(
+    N_QUESTIONS_SHOWN + 1,
+    before=cursors[-1] if cursors else None,
+    solved=solved_filter,
+)
+has_older = len(past_questions) > N_QUESTIONS_SHOWN
+past_questions = past_questions[:N_QUESTIONS_SHOWN]
 
 
 @st.dialog("Past Quiz", width="large")
@@ -54,17 +66,15 @@ def on_select_past_question(question: PastQuestion):
     st.write(question.feedback)
 
 
-def on_select_question_range(selection_range: tuple[int, int]):
-    """
-    Set selected past questions
-    """
-    st.session_state.question_selections = selection_range
+def on_show_newer_questions():
+    st.session_state.question_cursors.pop()
+
 
+def on_show_older_questions(last_question: PastQuestion):
+    st.session_state.question_cursors.append(last_question.date)
 
-for i in range(
-    st.session_state.question_selections[0], st.session_state.question_selections[1]
-):
-    past_question = past_questions[i]
+
+for i, past_question in enumerate(past_questions):
     with stylable_container(
         key=f"question_{i}",
         css_styles="""
@@ -88,12 +98,18 @@ for i in range(
             on_click=on_select_past_question,
             args=[past_question],
         )
-col1, _ = st.columns((0.15, 0.85))
-col1.selectbox(
-    " ",
-    options=labels,
-    format_func=format_question_selector,
-    on_change=on_select_question_range,
+first_shown = len(cursors) * N_QUESTIONS_SHOWN
+col1, col2, col3 = st.columns((0.15, 0.15, 0.7))
+col1.button("Newer", disabled=not cursors, on_click=on_show_newer_questions)
+col2.button(
+    "Older",
+    disabled=not has_older,
+    on_click=on_show_older_questions,
+    args=[past_questions[-1]] if past_questions else None,
+)
+col3.caption(
+    f"{min(first_shown + 1, n_filtered)} - {first_shown + len(past_questions)} "
+    f"of {n_filtered}"
 )
 
 
@@ -106,20 +122,18 @@ st.markdown(
 )
 
 PERFORMANCE_TO_ICON = {"Bad": "😔", "Average": "🙂", "Good": "🥳"}
+N_SUMMARIES_SHOWN = 5
 
+if "n_summaries_shown" not in st.session_state:
+    st.session_state.n_summaries_shown = N_SUMMARIES_SHOWN
 
-def load_quiz_summaries() -> list[QuizSummary]:
-    summaries_path = "data/quiz_ai_summaries.json"
-    if not os.path.exists(summaries_path):
-        return []
-    with open(summaries_path, "r", encoding="utf-8") as file:
-        data = json.load(file)
-    data_models = [QuizSummary(**summ) for summ in data]
-    return data_models
+
+def on_show_older_summaries():
+    st.session_state.n_summaries_shown += N_SUMMARIES_SHOWN
 
 
 def display_quiz_summaries(summaries: list[QuizSummary]):
-    for summary in summaries[::-1]:
+    for summary in summaries:
         section = st.expander(
             label=f"Evaluation report on {summary.date}",
             icon=PERFORMANCE_TO_ICON[summary.overall_performance],
@@ -145,18 +159,28 @@ def display_quiz_summaries(summaries: list[QuizSummary]):
         )
 
 
-summaries = load_quiz_summaries()
-display_quiz_summaries(summaries)
+# one more report than shown, to know whether there are older ones
+summaries = load_quiz_summaries(st.session_state.n_summaries_shown + 1)
+display_quiz_summaries(summaries[: st.session_state.n_summaries_shown])
+if len(summaries) > st.session_state.n_summaries_shown:
+    st.button("Show older reports", on_click=on_show_older_summaries)
 
 gen_new_container = st.empty()
-if len(past_questions) == 0:
+if n_questions == 0:
     st.info("No past questions available to run evaluation")
     st.stop()
+recompute = st.checkbox(
+    "Re-evaluate all answers",
+    help="By default, only answers given since the last report are evaluated",
+)
 gen_new = gen_new_container.button("New AI Evaluation")
 if gen_new:
     gen_new_container.empty()
     status = st.status("Generating evaluation report ...")
     quiz_summary_wf = init_quiz_summary_wf("gpt-4o-mini")
-    result = quiz_summary_wf.invoke({})
+    result = quiz_summary_wf.invoke({"recompute": recompute})
+    if result["summary"] is None:
+        status.update(label="No new answers since the last report", state="complete")
+        st.stop()
     status.update(label="Report generated", state="complete")
     st.rerun()
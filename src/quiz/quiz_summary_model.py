@@ -1,15 +1,22 @@
-import json
-import os
 from datetime import datetime
 from typing import Literal
 
 import streamlit as st
+from langchain_core.language_models import BaseChatModel
 from langchain_openai import ChatOpenAI
-from langgraph.graph import START, MessagesState, StateGraph
+from langgraph.graph import END, START, StateGraph
 from langgraph.graph.state import CompiledStateGraph
 from pydantic import BaseModel, Field
+from typing_extensions import TypedDict
 
-from quiz.db import fetch_past_questions
+from quiz.db import (
+    add_quiz_summary,
+    fetch_questions_after,
+    fetch_quiz_summaries,
+    fetch_summary_progress,
+)
+
+DATE_FORMAT = "%d/%m/%Y %H:%M:%S"
 
 
 class QuizSummaryFormatter(BaseModel):
@@ -32,58 +39,122 @@ class QuizSummary(QuizSummaryFormatter):
     n_incorrect_questions: int
 
 
+class QuizSummaryState(TypedDict):
+    # summarize all questions again, instead of only the ones since the last summary
+    recompute: bool
+    summary: QuizSummary | None
+    last_question_id: int | None
+
+
+def load_quiz_summaries(limit: int = 10) -> list[QuizSummary]:
+    """Last AI evaluation reports, most recent first"""
+    return [
+        QuizSummary(
+            date=record.date.strftime(DATE_FORMAT),
+            overall_performance=record.overall_performance,
+            areas_improvement=record.areas_improvement,
+            suggestion=record.suggestion,
+            n_correct_questions=record.n_correct_questions,
+            n_incorrect_questions=record.n_incorrect_questions,
+        )
+        for record in fetch_quiz_summaries(limit)
+    ]
+
+
+def summary_prompt(
+    solved_quizzes: list[str],
+    unsolved_quizzes: list[str],
+    previous: QuizSummary | None,
+) -> tuple[str, ...]:
+    """Prompt evaluating new answers, updating the previous summary if any"""
+    prompt = (
+        "Your goal is to evaluate different answers to questions about reinforcement learning.",
+    )
+    if previous is not None:
+        prompt += (
+            "You already evaluated earlier answers of the user "
+            f"({previous.n_correct_questions} correct, {previous.n_incorrect_questions} incorrect), "
+            f"with the following evaluation: {previous.model_dump_json(include=set(QuizSummaryFormatter.model_fields))}. "
+            "Update this evaluation with the new answers below, considering all answers.",
+        )
+    prompt += (
+        f"The questions that were note solved are the following: {'\n'.join(unsolved_quizzes)}"
+        f"And the questions that were correctly solved are: {'\n'.join(solved_quizzes)}",
+    )
+    return prompt
+
+
 @st.cache_resource
 def init_quiz_summary_wf(model_name: str) -> CompiledStateGraph:
-    wf = StateGraph(state_schema=MessagesState)
-    model = ChatOpenAI(model_name=model_name)
+    return build_quiz_summary_graph(ChatOpenAI(model_name=model_name))
+
+
+def build_quiz_summary_graph(model: BaseChatModel) -> CompiledStateGraph:
+    """Graph summarizing the answers given since the last summary, starting from it.
+    Invoked with `{"recompute": True}`, it summarizes all answers from scratch.
+
+    Args:
+        model (BaseChatModel): LLM evaluating the answers
+
+    Returns:
+        CompiledStateGraph: LangGraph summary app
+    """
+    wf = StateGraph(state_schema=QuizSummaryState)
 
     model = model.with_structured_output(QuizSummaryFormatter)
 
-    def generate_summary(state: MessagesState):
+    def generate_summary(state: QuizSummaryState):
         """
         Generate a summary evaluation of answers to reinforcement learning questions
         """
+        progress = None if state.get("recompute") else fetch_summary_progress()
+        summaries = load_quiz_summaries(limit=1) if progress is not None else []
+        previous = summaries[0] if summaries else None
+        if previous is None:
+            # the summary to build upon is missing, start over
+            progress = None
 
         solved_quizzes = []
         unsolved_quizzes = []
-        for q in fetch_past_questions():
+        new_questions = fetch_questions_after(
+            progress.last_question_id if progress is not None else None
+        )
+        if not new_questions:
+            return {"summary": None}
+        for q in new_questions:
             if q.solved:
                 solved_quizzes.append(q.question)
                 continue
             unsolved_quizzes.append(q.question)
 
-        prompt = (
-            "Your goal is to evaluate different answers to questions about reinforcement learning.",
-            f"The questions that were note solved are the following: {'\n'.join(unsolved_quizzes)}"
-            f"And the questions that were correctly solved are: {'\n'.join(solved_quizzes)}",
+        result = model.invoke(
+            summary_prompt(solved_quizzes, unsolved_quizzes, previous)
         )
-        result = model.invoke(prompt)
         summary = QuizSummary(
-            date=datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-            n_correct_questions=len(solved_quizzes),
-            n_incorrect_questions=len(unsolved_quizzes),
+            date=datetime.now().strftime(DATE_FORMAT),
+            n_correct_questions=len(solved_quizzes)
+            + (progress.n_correct if progress is not None else 0),
+            n_incorrect_questions=len(unsolved_quizzes)
+            + (progress.n_incorrect if progress is not None else 0),
             **result.model_dump(),
         )
-        return summary
-
-    def save_summary(state: QuizSummary):
-        json_path = "data/quiz_ai_summaries.json"
-        if os.path.exists(json_path):
-            with open(json_path, "r", encoding="utf-8") as file:
-                summaries = json.load(file)
-        else:
-            summaries = []
-        state_dict = state.model_dump()
-        summaries.append(state_dict)
-        with open(json_path, "w", encoding="utf-8") as file:
-            json.dump(summaries, file, indent=4)
-        return state
+        return {"summary": summary, "last_question_id": new_questions[-1].id}
+
+    def save_summary(state: QuizSummaryState):
+        add_quiz_summary(
+            **state["summary"].model_dump(exclude={"date"}),
+            last_question_id=state["last_question_id"],
+        )
+
+    def route_summary(state: QuizSummaryState):
+        # nothing new to summarize
+        return END if state["summary"] is None else "save_summary"
 
     wf.add_node("generate_summary", generate_summary)
     wf.add_node("save_summary", save_summary)
 
     wf.add_edge(START, "generate_summary")
-    wf.add_edge("generate_summary", "save_summary")
+    wf.add_conditional_edges("generate_summary", route_summary)
 
     wf = wf.compile()
     return wf
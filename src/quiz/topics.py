@@ -0,0 +1,61 @@
+"""
+Reinforcement learning topics of quiz questions, and compact fingerprints of them
+"""
+
+import hashlib
+import re
+
+# keywords of each topic, matched as word prefixes
+TOPIC_KEYWORDS: dict[str, list[str]] = {
+    "multi-armed bandits": ["bandit", "ucb", "upper confidence", "epsilon-greedy"],
+    "markov decision processes": ["mdp", "markov", "bellman", "transition", "reward"],
+    "dynamic programming": [
+        "dynamic programming",
+        "value iteration",
+        "policy iteration",
+    ],
+    "monte carlo methods": ["monte carlo", "episode", "first-visit", "every-visit"],
+    "temporal difference learning": ["temporal difference", "td(", "td ", "sarsa"],
+    "q-learning": ["q-learning", "q learning", "q-value", "off-policy"],
+    "function approximation": ["function approximation", "linear", "feature"],
+    "deep reinforcement learning": [
+        "dqn",
+        "deep",
+        "neural",
+        "replay",
+        "target network",
+    ],
+    "policy gradient methods": ["policy gradient", "ppo", "trpo"],
+    "actor-critic methods": ["actor", "critic", "advantage", "a2c", "a3c", "sac"],
+    "exploration": ["exploration", "exploit", "curiosity", "intrinsic"],
+    "model-based reinforcement learning": ["model-based", "planning", "dyna", "mcts"],
+}
+GENERAL_TOPIC = "general"
+GIST_MAX_WORDS = 25
+
+
+def classify_topic(question: str) -> str:
+    """Topic whose keywords appear the most in a question, GENERAL_TOPIC if none"""
+    text = " ".join(question.lower().split())
+    counts = {
+        topic: sum(len(re.findall(rf"\b{re.escape(kw)}", text)) for kw in keywords)
+        for topic, keywords in TOPIC_KEYWORDS.items()
+    }
+    topic = max(counts, key=counts.get)
+    return topic if counts[topic] > 0 else GENERAL_TOPIC
+
+
+def question_fingerprint(question: str) -> str:
+    """Hash of the set of content words of a question, identical for rewordings that
+    only change word order, case, punctuation or short words"""
+    words = sorted(
+        {word for word in re.findall(r"\w+", question.lower()) if len(word) > 3}
+    )
+    return hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def question_gist(question: str) -> str:
+    """First words of a question, on one line"""
+    words = question.split()
+    gist = " ".join(words[:GIST_MAX_WORDS])
+    return gist + " ..." if len(words) > GIST_MAX_WORDS else gist
@@ -0,0 +1,69 @@
+"""
+Event loop running the graphs in async mode, and bridges from the synchronous
+Streamlit scripts into it
+"""
+
+import asyncio
+import os
+import queue
+import threading
+from typing import Any, AsyncIterator, Coroutine, Iterator, Literal, TypeVar
+
+from utils.lazy import lazy_singleton
+
+T = TypeVar("T")
+
+# `sync` runs graphs in the Streamlit script threads; `async` runs every in-flight
+# LLM request of the process as a task of a single event loop
+GraphExecution = Literal["sync", "async"]
+GRAPH_EXECUTION: GraphExecution = os.environ.get("GRAPH_EXECUTION", "sync")
+
+_DONE = object()
+
+
+class _Raised:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+@lazy_singleton
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Event loop of the process, running in a background thread"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(
+        target=loop.run_forever, name="graph-event-loop", daemon=True
+    ).start()
+    return loop
+
+
+def run_coroutine(coro: Coroutine[Any, Any, T]) -> T:
+    """Runs a coroutine in the event loop, waiting for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+def iterate_async(aiterator: AsyncIterator[T]) -> Iterator[T]:
+    """Iterates over an async iterator consumed in the event loop.
+
+    Items are handed over as soon as they are produced. If the caller stops early
+    (e.g. a Streamlit rerun), the producing task is cancelled.
+    """
+    items: queue.Queue = queue.Queue()
+
+    async def drain():
+        try:
+            async for item in aiterator:
+                items.put(item)
+        except BaseException as error:
+            items.put(_Raised(error))
+            raise
+        finally:
+            items.put(_DONE)
+
+    future = asyncio.run_coroutine_threadsafe(drain(), get_event_loop())
+    try:
+        while (item := items.get()) is not _DONE:
+            if isinstance(item, _Raised):
+                raise item.error
+            yield item
+    finally:
+        future.cancel()
@@ -0,0 +1,26 @@
+"""
+Deferred initialization of expensive objects (clients, connections, schemas)
+"""
+
+import functools
+import threading
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+
+def lazy_singleton(factory: Callable[[], T]) -> Callable[[], T]:
+    """Turns a factory into a getter creating the object on first call, only once
+    even if first called from several threads at the same time"""
+    lock = threading.Lock()
+    instance: list[T] = []
+
+    @functools.wraps(factory)
+    def get() -> T:
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    return get
@@ -0,0 +1,100 @@
+"""
+SQLite connections and SQLAlchemy engines shared by every store of the app, tuned for
+concurrent Streamlit sessions: WAL journal, relaxed fsync, busy timeout and larger caches
+"""
+
+import os
+import sqlite3
+import threading
+from typing import TYPE_CHECKING
+
+from sqlalchemy import Engine, create_engine, event
+
+if TYPE_CHECKING:
+    import aiosqlite
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+SQLITE_MMAP_SIZE_MB = int(os.environ.get("SQLITE_MMAP_SIZE_MB", "256"))
+SQLITE_CACHE_SIZE_MB = int(os.environ.get("SQLITE_CACHE_SIZE_MB", "32"))
+# connections kept open per database by each engine, and extra ones under load
+SQLITE_POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "8"))
+SQLITE_MAX_OVERFLOW = int(os.environ.get("SQLITE_MAX_OVERFLOW", "16"))
+
+_engines: dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+# WAL lets readers proceed while a writer commits and, with synchronous=NORMAL, only
+# syncs at checkpoints (durable across app crashes, not power losses)
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 1024 * 1024}",
+    # negative values are in KiB
+    f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_MB * 1024}",
+]
+
+
+def configure_connection(conn: sqlite3.Connection):
+    """Applies the pragmas of the app to a new connection"""
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+
+
+def connect_sqlite(db_path: str) -> sqlite3.Connection:
+    """Opens a configured connection, usable from several threads (callers serialize
+    its use, e.g. with a lock)
+
+    Args:
+        db_path (str): path to the database file
+    """
+    conn = sqlite3.connect(
+        db_path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000
+    )
+    configure_connection(conn)
+    return conn
+
+
+async def connect_aiosqlite(db_path: str) -> "aiosqlite.Connection":
+    """Opens a configured asyncio connection, bound to the running event loop
+
+    Args:
+        db_path (str): path to the database file
+    """
+    # only needed by async graph execution, installed with langgraph-checkpoint-sqlite
+    import aiosqlite
+
+    conn = await aiosqlite.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+    for pragma in PRAGMAS:
+        await conn.execute(pragma)
+    return conn
+
+
+def get_engine(db_path: str) -> Engine:
+    """SQLAlchemy engine of a database file, shared by the whole process.
+
+    Connections are pooled, so that each thread checks out its own connection and
+    sessions of different threads do not share transactions.
+
+    Args:
+        db_path (str): path to the database file
+    """
+    with _engines_lock:
+        if db_path not in _engines:
+            engine = create_engine(
+                f"sqlite:///{db_path}",
+                connect_args={
+                    "check_same_thread": False,
+                    "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+                },
+                pool_size=SQLITE_POOL_SIZE,
+                max_overflow=SQLITE_MAX_OVERFLOW,
+            )
+            event.listen(
+                engine,
+                "connect",
+                lambda dbapi_connection, _: configure_connection(dbapi_connection),
+            )
+            _engines[db_path] = engine
+        return _engines[db_path]
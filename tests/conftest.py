@@ -1,8 +1,81 @@
 import logging
 
+import pytest
+from langchain.indexes import SQLRecordManager
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from sqlalchemy.orm import sessionmaker
+
+from chat import vector_store
+from chat.db import database as chat_database
+from chat.embedding_cache import CachedEmbeddings
+from chat.lexical_index import LexicalIndex
+from chat.local_vector_store import LocalVectorStore
+from quiz.db import database as quiz_database
+from utils.lazy import lazy_singleton
+from utils.sqlite import get_engine
+
 
 def pytest_sessionstart(session):
     # Libraries to shush should be specified here
     libraries_to_shush = [""]
     for library in libraries_to_shush:
-        logging.getLogger(library).setLevel(logging.WARNING)
\ No newline at end of file
+        logging.getLogger(library).setLevel(logging.WARNING)
+
+
+@pytest.fixture
+def conversations_db(tmp_path, monkeypatch):
+    """Engine of an empty conversations database, used by the chat db module"""
+    engine = get_engine(str(tmp_path / "conversations.db"))
+    monkeypatch.setattr(chat_database, "engine", engine)
+    monkeypatch.setattr(chat_database, "_session_factory", sessionmaker(bind=engine))
+    monkeypatch.setattr(
+        chat_database, "_init_db_once", lazy_singleton(chat_database.init_db)
+    )
+    return engine
+
+
+@pytest.fixture
+def quiz_db(tmp_path, monkeypatch):
+    """Engine of an empty quiz database, used by the quiz db module"""
+    engine = get_engine(str(tmp_path / "database.db"))
+    monkeypatch.setattr(quiz_database, "engine", engine)
+    monkeypatch.setattr(quiz_database, "_session_factory", sessionmaker(bind=engine))
+    monkeypatch.setattr(
+        quiz_database, "_create_tables_once", lazy_singleton(quiz_database.init_db)
+    )
+    # never import the reports of a real data/ directory
+    monkeypatch.setattr(
+        quiz_database, "LEGACY_SUMMARIES_PATH", str(tmp_path / "summaries.json")
+    )
+    return engine
+
+
+class _NoCache:
+    """Retrieval cache with nothing to invalidate"""
+
+    def invalidate(self):
+        pass
+
+
+@pytest.fixture
+def indexing(conversations_db, tmp_path, monkeypatch):
+    """Local vector store and lexical index, filled by `source_to_vector_store`"""
+    embeddings = CachedEmbeddings(
+        DeterministicFakeEmbedding(size=32),
+        model_name="fake",
+        db_path=str(tmp_path / "embedding_cache.db"),
+    )
+    store = LocalVectorStore(
+        embedding=embeddings, persist_dir=str(tmp_path / "vector_store")
+    )
+    lexical_index = LexicalIndex(str(tmp_path / "lexical_index.db"))
+    record_manager = SQLRecordManager(
+        "test", db_url=f"sqlite:///{tmp_path / 'record_manager.db'}"
+    )
+    record_manager.create_schema()
+    monkeypatch.setattr(vector_store, "get_embeddings", lambda: embeddings)
+    monkeypatch.setattr(vector_store, "get_vector_store", lambda: store)
+    monkeypatch.setattr(vector_store, "get_lexical_index", lambda: lexical_index)
+    monkeypatch.setattr(vector_store, "get_record_manager", lambda: record_manager)
+    monkeypatch.setattr(vector_store, "get_retrieval_cache", lambda: _NoCache())
+    return store, lexical_index
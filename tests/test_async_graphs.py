@@ -0,0 +1,171 @@
+"""
+Async execution path of the chat and quiz graphs, and a benchmark of concurrent
+sessions against stub models with a fixed latency
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from chat import chat_model
+from helpers import stream_llm_response
+from quiz import quiz_model
+from utils.aio import iterate_async, run_coroutine
+from utils.sqlite import connect_aiosqlite
+
+N_SESSIONS = 32
+LATENCY_S = 0.2
+
+
+class StubChatModel(BaseChatModel):
+    """Answers with a fixed reply after a fixed latency, counting calls"""
+
+    reply: str = "Correct! stub reply"
+    latency: float = LATENCY_S
+    n_sync_calls: int = 0
+    n_async_calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.n_sync_calls += 1
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(self.reply))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.n_async_calls += 1
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(self.reply))])
+
+
+@pytest.fixture
+def saved_questions(monkeypatch):
+    saved = []
+    monkeypatch.setattr(quiz_model, "fetch_learner_profile", lambda: ([], []))
+    monkeypatch.setattr(
+        quiz_model, "add_question", lambda *question: saved.append(question)
+    )
+    return saved
+
+
+def test_iterate_async():
+    async def numbers(n: int, fail: bool = False):
+        for i in range(n):
+            await asyncio.sleep(0)
+            yield i
+        if fail:
+            raise ValueError("stream failed")
+
+    assert list(iterate_async(numbers(5))) == [0, 1, 2, 3, 4]
+    with pytest.raises(ValueError):
+        list(iterate_async(numbers(2, fail=True)))
+    iterator = iterate_async(numbers(1000))
+    assert next(iterator) == 0
+    iterator.close()
+
+
+def test_concurrent_quiz_sessions(saved_questions):
+    """Benchmark: one script thread per session against a single event loop"""
+    sync_model = StubChatModel()
+    sync_app = quiz_model.build_quiz_graph(sync_model)
+
+    def sync_session(i: int):
+        thread_id = f"sync{i}"
+        list(quiz_model.ask_question_stream(sync_app, thread_id))
+        list(quiz_model.evaluate_answer_stream(sync_app, "an answer", thread_id))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=N_SESSIONS) as pool:
+        list(pool.map(sync_session, range(N_SESSIONS)))
+    sync_seconds = time.perf_counter() - start
+
+    async_model = StubChatModel()
+    async_app = quiz_model.build_quiz_graph(async_model)
+
+    async def async_session(i: int):
+        thread_id = f"async{i}"
+        async for _ in quiz_model.ask_question_astream(async_app, thread_id):
+            pass
+        async for _ in quiz_model.evaluate_answer_astream(
+            async_app, "an answer", thread_id
+        ):
+            pass
+
+    async def all_sessions():
+        await asyncio.gather(*(async_session(i) for i in range(N_SESSIONS)))
+
+    start = time.perf_counter()
+    run_coroutine(all_sessions())
+    async_seconds = time.perf_counter() - start
+    logging.info(
+        "%s quiz sessions: %.2fs with a thread per session, %.2fs in one event loop",
+        N_SESSIONS,
+        sync_seconds,
+        async_seconds,
+    )
+
+    assert len(saved_questions) == 2 * N_SESSIONS
+    assert all(solved for _, solved, _, _ in saved_questions)
+    assert async_model.n_async_calls == 2 * N_SESSIONS
+    assert async_model.n_sync_calls == 0
+    # the model latencies of all sessions overlap
+    assert async_seconds < N_SESSIONS * 2 * LATENCY_S / 4
+
+
+def test_concurrent_chat_sessions(tmp_path, monkeypatch):
+    for getter in [
+        "get_embeddings",
+        "get_vector_store",
+        "get_lexical_index",
+        "get_retrieval_cache",
+    ]:
+        monkeypatch.setattr(chat_model, getter, lambda: None)
+
+    async def connect():
+        conn = await connect_aiosqlite(str(tmp_path / "conversations.db"))
+        return AsyncSqliteSaver(conn)
+
+    model = StubChatModel()
+    app = chat_model.build_chat_graph(
+        model,
+        StubChatModel(),
+        run_coroutine(connect()),
+        "stub",
+        relevance_filter="none",
+    )
+
+    def session(i: int) -> list[str]:
+        replies = []
+        for turn in range(2):
+            stream = chat_model.chat_astream(app, f"q{turn}", f"conv{i}", True)
+            replies.append("".join(stream_llm_response(stream)))
+        return replies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=N_SESSIONS) as pool:
+        replies = list(pool.map(session, range(N_SESSIONS)))
+    logging.info(
+        "%s chat sessions of 2 turns in %.2fs", N_SESSIONS, time.perf_counter() - start
+    )
+
+    assert replies == [[model.reply, model.reply]] * N_SESSIONS
+    assert model.n_sync_calls == 0
+    state = run_coroutine(app.aget_state({"configurable": {"thread_id": "conv0"}}))
+    assert [m.content for m in state.values["messages"]] == [
+        "q0",
+        model.reply,
+        "q1",
+        model.reply,
+    ]
@@ -0,0 +1,60 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import END, MessagesState, StateGraph
+
+from chat import chat_model
+from chat.db import database
+from utils.sqlite import connect_sqlite
+
+
+@pytest.fixture
+def checkpointer(conversations_db, monkeypatch):
+    saver = SqliteSaver(connect_sqlite(conversations_db.url.database))
+    monkeypatch.setattr(chat_model, "get_checkpointer", lambda: saver)
+    return saver
+
+
+def _answer(state: MessagesState):
+    question = state["messages"][-1].content
+    return {
+        "messages": [
+            AIMessage("", tool_calls=[{"name": "retrieve", "args": {}, "id": "1"}]),
+            ToolMessage("retrieved context", tool_call_id="1"),
+            AIMessage(f"answer to {question}"),
+        ]
+    }
+
+
+def test_history_is_projected_from_the_latest_checkpoint(checkpointer):
+    workflow = StateGraph(state_schema=MessagesState)
+    workflow.add_node("answer", _answer)
+    workflow.set_entry_point("answer")
+    workflow.add_edge("answer", END)
+    app = workflow.compile(checkpointer=checkpointer)
+    config = {"configurable": {"thread_id": "conv"}}
+    for turn in range(3):
+        app.invoke({"messages": [HumanMessage(f"q{turn}")]}, config)
+
+    latest = chat_model.fetch_checkpoint_history("conv", limit=4)
+    assert [(m.seq, m.role, m.content) for m in latest] == [
+        (2, "human", "q1"),
+        (3, "ai", "answer to q1"),
+        (4, "human", "q2"),
+        (5, "ai", "answer to q2"),
+    ]
+    earlier = chat_model.fetch_checkpoint_history(
+        "conv", before_seq=latest[0].seq, limit=4
+    )
+    assert [m.content for m in earlier] == ["q0", "answer to q0"]
+    # nothing was written to the messages table
+    assert database.fetch_conversation_messages("conv") == []
+
+
+def test_conversations_without_checkpoints_are_read_from_messages(checkpointer):
+    database.save_conversation("legacy", [("human", "hi"), ("ai", "hello")])
+    history = chat_model.fetch_checkpoint_history("legacy")
+    assert [(m.seq, m.role, m.content) for m in history] == [
+        (0, "human", "hi"),
+        (1, "ai", "hello"),
+    ]
@@ -0,0 +1,102 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import END, MessagesState, StateGraph
+from sqlalchemy import text
+
+from chat import checkpoint_retention
+from chat.db import database
+from utils.sqlite import connect_sqlite
+
+
+@pytest.fixture
+def chat_app(conversations_db):
+    workflow = StateGraph(state_schema=MessagesState)
+    workflow.add_node("answer", lambda state: {"messages": [AIMessage("x" * 2000)]})
+    workflow.set_entry_point("answer")
+    workflow.add_edge("answer", END)
+    return workflow.compile(
+        checkpointer=SqliteSaver(connect_sqlite(conversations_db.url.database))
+    )
+
+
+def _chat(app, conv_id: str, n_turns: int):
+    database.save_conversation(conv_id, [])
+    config = {"configurable": {"thread_id": conv_id}}
+    for turn in range(n_turns):
+        app.invoke({"messages": [HumanMessage(f"q{turn}")]}, config)
+    return config
+
+
+def _count(table: str, conv_id: str) -> int:
+    with database.engine.connect() as conn:
+        return conn.execute(
+            text(f"SELECT COUNT(*) FROM {table} WHERE thread_id = :id"), {"id": conv_id}
+        ).scalar()
+
+
+def test_old_checkpoints_are_pruned(chat_app):
+    config = _chat(chat_app, "kept", 5)
+    _chat(chat_app, "other", 5)
+    n_checkpoints = _count("checkpoints", "kept")
+
+    assert database.prune_checkpoints(2, "kept") == n_checkpoints - 2
+    assert _count("checkpoints", "kept") == 2
+    assert _count("checkpoints", "other") == n_checkpoints
+    # the latest state, and the conversation, go on from where they were
+    assert len(chat_app.get_state(config).values["messages"]) == 10
+    chat_app.invoke({"messages": [HumanMessage("again")]}, config)
+    assert len(chat_app.get_state(config).values["messages"]) == 12
+
+    database.prune_checkpoints(2)
+    assert _count("checkpoints", "other") == 2
+    with database.engine.connect() as conn:
+        orphan_writes = conn.execute(
+            text(
+                "SELECT COUNT(*) FROM writes WHERE checkpoint_id NOT IN "
+                "(SELECT checkpoint_id FROM checkpoints)"
+            )
+        ).scalar()
+    assert orphan_writes == 0
+
+
+def test_deleted_conversations_are_purged_and_compacted(chat_app):
+    _chat(chat_app, "deleted", 20)
+    _chat(chat_app, "kept", 2)
+
+    database.delete_conversation("deleted")
+    assert _count("checkpoints", "deleted") == 0
+    assert _count("writes", "deleted") == 0
+    assert _count("checkpoints", "kept") > 0
+
+    assert database.compact_database() > 0
+    assert database.compact_database() == 0
+
+
+def test_pruning_without_checkpoints(conversations_db):
+    assert database.prune_checkpoints(2) == 0
+    database.save_conversation("conv", [])
+    database.delete_conversation("conv")
+
+
+def test_older_databases_are_only_compacted_once_switched(conversations_db):
+    with conversations_db.begin() as conn:
+        conn.execute(text("CREATE TABLE legacy (x)"))
+    database.save_conversation("conv", [])
+    database.delete_conversation("conv")
+    assert database.compact_database() == 0
+
+    database.enable_incremental_vacuum()
+    with conversations_db.connect() as conn:
+        assert conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2
+
+
+def test_maintenance_waits_before_first_run(conversations_db, monkeypatch):
+    runs = []
+    monkeypatch.setattr(
+        checkpoint_retention, "prune_checkpoints", lambda keep_last: runs.append(1)
+    )
+    monkeypatch.setattr(checkpoint_retention, "compact_database", lambda: 0)
+    maintenance = checkpoint_retention.CheckpointMaintenance(delay_seconds=60)
+    maintenance.close()
+    assert runs == []
@@ -0,0 +1,90 @@
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langgraph.checkpoint.memory import MemorySaver
+
+from chat import chat_model
+from chat.conversation_memory import CHAT_MEMORY_MAX_TURNS, memory_window_start
+
+
+class RecordingChatModel(BaseChatModel):
+    """Replies with the number of messages it was given, recording prompts"""
+
+    prompts: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.prompts.append(messages)
+        if "running summary" in messages[0].content:
+            reply = f"summary {len(self.prompts)}"
+        else:
+            reply = f"reply to {messages[-1].content}"
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(reply))])
+
+
+def _conversation(n_turns: int, words_per_message: int = 10) -> list:
+    messages = []
+    for turn in range(n_turns):
+        messages.append(HumanMessage(f"q{turn} " + "word " * words_per_message))
+        messages.append(AIMessage(f"a{turn} " + "word " * words_per_message))
+    return messages
+
+
+def test_window_keeps_last_turns_within_budget():
+    messages = _conversation(6)
+    # two messages per turn
+    assert memory_window_start(messages, max_turns=3, token_budget=10_000) == 6
+    turn_tokens = count_tokens_approximately(messages[:2])
+    assert memory_window_start(messages, token_budget=2 * turn_tokens + 5) == 8
+    # the current turn is kept even beyond the budget
+    assert memory_window_start(messages, token_budget=1) == 10
+    # summarized messages are never kept
+    assert memory_window_start(messages, n_summarized=9, max_turns=3) == 10
+    assert memory_window_start([], n_summarized=0) == 0
+
+
+def test_old_turns_are_folded_into_summary(monkeypatch):
+    for getter in [
+        "get_embeddings",
+        "get_vector_store",
+        "get_lexical_index",
+        "get_retrieval_cache",
+    ]:
+        monkeypatch.setattr(chat_model, getter, lambda: None)
+    model = RecordingChatModel()
+    app = chat_model.build_chat_graph(
+        model, model, MemorySaver(), "stub", relevance_filter="none"
+    )
+    config = {"configurable": {"thread_id": "conv", "has_title": True}}
+
+    n_turns = CHAT_MEMORY_MAX_TURNS + 3
+    prompt_sizes = []
+    for turn in range(n_turns):
+        n_prompts = len(model.prompts)
+        app.invoke({"messages": [HumanMessage(f"q{turn}")]}, config)
+        prompt_sizes.append(len(model.prompts[-1]))
+        if turn < CHAT_MEMORY_MAX_TURNS:
+            assert len(model.prompts) == n_prompts + 1
+        else:
+            # one summary call, folding the turn leaving the window
+            assert len(model.prompts) == n_prompts + 2
+            summary_lines = model.prompts[-2][0].content
+            assert f"human: q{turn - CHAT_MEMORY_MAX_TURNS}" in summary_lines
+
+    state = app.get_state(config).values
+    # the full history is kept, but not sent to the model
+    assert len(state["messages"]) == 2 * n_turns
+    assert state["n_summarized"] == 2 * (n_turns - CHAT_MEMORY_MAX_TURNS)
+    assert state["summary"] == f"summary {len(model.prompts) - 1}"
+    last_prompt = model.prompts[-1]
+    assert state["summary"] in last_prompt[1].content
+    assert last_prompt[2].content == f"q{n_turns - CHAT_MEMORY_MAX_TURNS}"
+    # system prompt, summary, and the turns of the window
+    assert prompt_sizes[-1] == prompt_sizes[-2] == 2 * CHAT_MEMORY_MAX_TURNS + 1
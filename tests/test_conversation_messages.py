@@ -0,0 +1,72 @@
+from sqlalchemy import inspect
+from sqlalchemy.orm import sessionmaker
+
+from chat.db import database
+from chat.db.models import Base, Conversation
+
+
+def test_legacy_histories_are_migrated(conversations_db):
+    Base.metadata.create_all(conversations_db)
+    with sessionmaker(bind=conversations_db)() as session:
+        session.add(
+            Conversation(id="legacy", messages=[["human", "hi"], ["ai", "hello"]])
+        )
+        session.add(Conversation(id="empty", messages=[]))
+        session.commit()
+
+    messages = database.fetch_conversation_messages("legacy")
+    assert [(m.seq, m.role, m.content) for m in messages] == [
+        (0, "human", "hi"),
+        (1, "ai", "hello"),
+    ]
+    assert database.fetch_conversation_messages("empty") == []
+    # migrating again does not duplicate messages
+    database.init_db()
+    assert len(database.fetch_conversation_messages("legacy")) == 2
+
+
+def test_messages_are_appended_and_paged(conversations_db):
+    database.save_conversation("conv", [])
+    for turn in range(3):
+        database.append_messages("conv", [("human", f"q{turn}"), ("ai", f"a{turn}")])
+
+    latest = database.fetch_conversation_messages("conv", limit=4)
+    assert [m.content for m in latest] == ["q1", "a1", "q2", "a2"]
+    earlier = database.fetch_conversation_messages(
+        "conv", before_seq=latest[0].seq, limit=4
+    )
+    assert [m.content for m in earlier] == ["q0", "a0"]
+
+    database.delete_conversation("conv")
+    assert database.fetch_conversation_messages("conv") == []
+    assert database.fetch_conversation_listing() == []
+
+
+def test_conversation_listing_pages_by_recency(conversations_db):
+    for i in range(5):
+        database.save_conversation(f"conv{i}", [("human", "hi")])
+    database.save_conversation_title("conv3", "Bellman")
+
+    first_page = database.fetch_conversation_listing(limit=3)
+    assert [(conv_id, title) for conv_id, title, _ in first_page] == [
+        ("conv4", None),
+        ("conv3", "Bellman"),
+        ("conv2", None),
+    ]
+    last_id, _, last_date = first_page[-1]
+    second_page = database.fetch_conversation_listing(
+        limit=3, after=(last_date, last_id)
+    )
+    assert [conv_id for conv_id, _, _ in second_page] == ["conv1", "conv0"]
+
+
+def test_titles_are_fetched_by_indexed_conversation_id(conversations_db):
+    database.save_conversation("titled", [])
+    database.save_conversation("untitled", [])
+    database.save_conversation_title("titled", "Q-learning")
+
+    assert database.fetch_conversation_titles(["titled", "untitled"]) == {
+        "titled": "Q-learning"
+    }
+    indexes = inspect(conversations_db).get_indexes("conversations_titles")
+    assert [index["column_names"] for index in indexes] == [["conversation_id"]]
@@ -0,0 +1,90 @@
+import time
+
+from langchain_core.documents import Document
+
+from chat import vector_store
+from chat.db import database
+from chat.deduplication import deduplicate_documents, simhash
+from chat.local_vector_store import LocalVectorStore
+
+TEXT = (
+    "Policy gradient methods optimize a parameterized policy directly by following "
+    "the gradient of the expected return with respect to the policy parameters"
+)
+OTHER_TEXT = (
+    "Temporal difference learning bootstraps value estimates from the current "
+    "estimate of the value of the next state instead of waiting for the return"
+)
+
+
+def _ingest(source: str, texts: list[str]):
+    documents = [Document(page_content=t, metadata={"source": source}) for t in texts]
+    vector_store.source_to_vector_store(source, "pdf", documents)
+    # record manager times have a millisecond resolution
+    time.sleep(0.01)
+
+
+def _stored(store: LocalVectorStore, query: str) -> set[tuple[str, str]]:
+    return {
+        (doc.page_content, doc.metadata["source"])
+        for doc in store.similarity_search(query, k=10)
+    }
+
+
+def test_simhash_of_near_duplicates_differ_in_few_bits():
+    near_duplicate = TEXT.replace("directly", "directly,").upper()
+    different = "Temporal difference learning bootstraps value estimates " * 3
+
+    assert bin(simhash(TEXT) ^ simhash(near_duplicate)).count("1") <= 3
+    assert bin(simhash(TEXT) ^ simhash(different)).count("1") > 3
+    assert simhash("too short") is None
+
+
+def test_content_of_other_sources_is_deduplicated(conversations_db):
+    docs = [Document(page_content=TEXT), Document(page_content="short chunk")]
+    assert deduplicate_documents("a.pdf", "pdf", docs) == docs
+    # re-ingesting the same source keeps its chunks
+    assert deduplicate_documents("a.pdf", "pdf", docs) == docs
+
+    copy = [
+        Document(page_content=TEXT + "."),
+        Document(page_content="short  chunk"),
+        Document(page_content="new chunk"),
+    ]
+    assert deduplicate_documents("b.pdf", "pdf", copy) == copy[2:]
+    assert database.delete_stale_content_fingerprints("b.pdf", before=0) == 2
+
+
+def test_duplicates_are_indexed_when_stored_chunk_is_removed(indexing):
+    store, lexical_index = indexing
+    near_duplicate = OTHER_TEXT.replace("state", "state,").upper()
+    _ingest("a.pdf", [TEXT, OTHER_TEXT])
+    _ingest("b.pdf", [TEXT, near_duplicate, "chunk only in b"])
+    _ingest("c.pdf", [TEXT])
+    assert _stored(store, TEXT) == {
+        (TEXT, "a.pdf"),
+        (OTHER_TEXT, "a.pdf"),
+        ("chunk only in b", "b.pdf"),
+    }
+
+    # a.pdf no longer contains the shared chunks
+    _ingest("a.pdf", ["chunk only in a"])
+    assert _stored(store, TEXT) == {
+        (TEXT, "b.pdf"),
+        (near_duplicate, "b.pdf"),
+        ("chunk only in b", "b.pdf"),
+        ("chunk only in a", "a.pdf"),
+    }
+    [best_match] = lexical_index.search(TEXT, k=1)
+    assert (best_match.page_content, best_match.metadata["source"]) == (TEXT, "b.pdf")
+    assert database.fetch_chat_source_by_name("b.pdf").n_deduplicated_documents == 0
+    # c.pdf is now deduplicated against the chunk of b.pdf
+    assert database.delete_stale_content_fingerprints("c.pdf", before=0) == 1
+
+    _ingest("b.pdf", ["chunk only in b"])
+    _ingest("c.pdf", [TEXT])
+    assert _stored(store, TEXT) == {
+        (TEXT, "c.pdf"),
+        ("chunk only in b", "b.pdf"),
+        ("chunk only in a", "a.pdf"),
+    }
@@ -0,0 +1,56 @@
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from chat.embedding_cache import CachedEmbeddings
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    n_embedded: int = 0
+
+    def embed_documents(self, texts):
+        self.n_embedded += len(texts)
+        return super().embed_documents(texts)
+
+
+def test_only_new_texts_are_embedded(tmp_path):
+    underlying = CountingEmbedding(size=8)
+    cache = CachedEmbeddings(underlying, "fake", str(tmp_path / "cache.db"))
+    first = cache.embed_documents(["alpha", "beta"])
+    second = cache.embed_documents(["alpha  ", "beta", "gamma"])
+
+    assert underlying.n_embedded == 3
+    assert cache.stats() == {"embedding_cache_hits": 2, "embedding_cache_misses": 3}
+    assert np.allclose(second[:2], first)
+
+    reopened = CachedEmbeddings(underlying, "fake", str(tmp_path / "cache.db"))
+    reopened.embed_documents(["gamma"])
+    assert underlying.n_embedded == 3
+
+
+def test_cache_is_bounded(tmp_path):
+    underlying = CountingEmbedding(size=8)
+    # each vector takes 32 bytes, so only a handful fit
+    cache = CachedEmbeddings(underlying, "fake", str(tmp_path / "c.db"), max_bytes=160)
+    cache.embed_documents([f"text {i}" for i in range(20)])
+    n_rows = cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    assert n_rows * 32 <= 160
+
+
+def test_total_size_is_kept_up_to_date(tmp_path):
+    underlying = CountingEmbedding(size=8)
+    path = str(tmp_path / "c.db")
+    cache = CachedEmbeddings(underlying, "fake", path, max_bytes=160)
+    cache.embed_documents([f"text {i}" for i in range(20)])
+
+    def sizes(conn):
+        total = conn.execute("SELECT size FROM embeddings_total").fetchone()[0]
+        return total, conn.execute("SELECT SUM(size) FROM embeddings").fetchone()[0]
+
+    total, actual = sizes(cache._conn)
+    assert total == actual <= 160
+    # caches created before the running total are initialized from their rows
+    cache._conn.executescript(
+        "DROP TABLE embeddings_total; DROP TRIGGER embeddings_total_insert;"
+    )
+    reopened = CachedEmbeddings(underlying, "fake", path, max_bytes=160)
+    assert sizes(reopened._conn) == (actual, actual)
@@ -0,0 +1,73 @@
+"""
+Cold start budget of the app pages: importing what a page needs must be fast and must
+not load heavy libraries nor touch the databases
+"""
+
+import ast
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+SRC_DIR = Path(__file__).parents[1] / "src"
+PAGES = [
+    "app.py",
+    "main_page.py",
+    "chat/chat_page.py",
+    "chat/chat_knowledge.py",
+    "quiz/quiz_page.py",
+    "quiz/quiz_results_page.py",
+]
+IMPORT_TIME_BUDGET_S = float(os.environ.get("IMPORT_TIME_BUDGET_S", "4"))
+# only needed once a source is ingested, or inside partition workers
+DEFERRED_MODULES = ["torch", "unstructured", "langchain_unstructured", "pinecone"]
+
+
+def _page_imports(page: str) -> list[str]:
+    tree = ast.parse((SRC_DIR / page).read_text(encoding="utf-8"))
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return modules
+
+
+@pytest.mark.parametrize("page", PAGES)
+def test_page_cold_import(page, tmp_path):
+    modules = _page_imports(page)
+    missing = [
+        module
+        for module in modules
+        if importlib.util.find_spec(module.split(".")[0]) is None
+    ]
+    if missing:
+        pytest.skip(f"{page} needs uninstalled {missing}")
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        + "".join(f"import {module}\n" for module in modules)
+        + "print(json.dumps({'seconds': time.perf_counter() - start, "
+        f"'loaded': [m for m in {DEFERRED_MODULES} if m in sys.modules]}}))\n"
+    )
+    # an empty working directory: importing must not need data/
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": str(SRC_DIR)},
+        capture_output=True,
+        text=True,
+        timeout=120,
+        check=False,
+    )
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.splitlines()[-1])
+
+    assert report["loaded"] == []
+    assert report["seconds"] < IMPORT_TIME_BUDGET_S
+    assert not (tmp_path / "data").exists()
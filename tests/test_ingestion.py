@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from chat import vector_store
+from chat.embedding_cache import CachedEmbeddings
+from chat.ingestion import ShardMerger, iter_batches, page_ranges, pipeline
+
+
+def _element(element_id: str, category: str, parent_id: str | None = None):
+    metadata = {"element_id": element_id, "category": category}
+    if parent_id is not None:
+        metadata["parent_id"] = parent_id
+    return Document(page_content=element_id, metadata=metadata)
+
+
+def test_page_ranges_cover_every_page():
+    assert page_ranges(25, 10) == [(0, 10), (10, 20), (20, 25)]
+    assert page_ranges(0, 10) == []
+
+
+def test_merge_keeps_order_and_links_orphans_to_previous_title():
+    shards = [
+        [_element("t1", "Title"), _element("a", "NarrativeText", "t1")],
+        [_element("b", "NarrativeText"), _element("t2", "Title")],
+        [_element("c", "ListItem"), _element("d", "NarrativeText", "x")],
+    ]
+    merger = ShardMerger()
+    merged = [doc for shard in shards for doc in merger.merge(shard)]
+    assert [doc.metadata["element_id"] for doc in merged] == [
+        "t1",
+        "a",
+        "b",
+        "t2",
+        "c",
+        "d",
+    ]
+    parents = {
+        doc.metadata["element_id"]: doc.metadata.get("parent_id") for doc in merged
+    }
+    assert parents["b"] == "t1"
+    assert parents["c"] == "t2"
+    assert parents["d"] == "x"
+    assert parents["t2"] is None
+
+
+def test_iter_batches():
+    assert list(iter_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_pipeline_keeps_order_and_bounds_buffering():
+    produced = []
+
+    def items():
+        for i in range(50):
+            produced.append(i)
+            yield i
+
+    outputs = []
+    for output in pipeline(items(), lambda x: x * 2, lambda x: x + 1, queue_size=2):
+        # the producer can only be a few items ahead of the slow consumer
+        assert len(produced) - len(outputs) <= 10
+        time.sleep(0.001)
+        outputs.append(output)
+    assert outputs == [2 * i + 1 for i in range(50)]
+
+
+def test_pipeline_overlaps_stages():
+    first_item_done = threading.Event()
+
+    def items():
+        yield 0
+        # the downstream stage must process item 0 while we are still producing
+        assert first_item_done.wait(timeout=5)
+        yield 1
+
+    def stage(x):
+        if x == 0:
+            first_item_done.set()
+        return x
+
+    assert list(pipeline(items(), stage)) == [0, 1]
+
+
+def test_pipeline_propagates_errors():
+    def failing_stage(x):
+        if x == 3:
+            raise RuntimeError("boom")
+        return x
+
+    with pytest.raises(RuntimeError, match="boom"):
+        list(pipeline(range(10), failing_stage))
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    """Fake embeddings counting the texts embedded"""
+
+    n_embedded: int = 0
+
+    def embed_documents(self, texts):
+        self.n_embedded += len(texts)
+        return super().embed_documents(texts)
+
+
+def test_upserted_chunks_are_not_embedded_again(indexing, tmp_path, monkeypatch):
+    documents = [
+        Document(page_content=f"chunk {i}", metadata={"source": "a.pdf"})
+        for i in range(3)
+    ]
+    vector_store.source_to_vector_store("a.pdf", "pdf", documents)
+    # the embedding cache was emptied meanwhile
+    underlying = CountingEmbedding(size=32)
+    embeddings = CachedEmbeddings(
+        underlying, model_name="fake", db_path=str(tmp_path / "cold_cache.db")
+    )
+    monkeypatch.setattr(vector_store, "get_embeddings", lambda: embeddings)
+    monkeypatch.setattr(indexing[0], "_embedding", embeddings)
+
+    new = Document(page_content="new chunk", metadata={"source": "a.pdf"})
+    vector_store.source_to_vector_store("a.pdf", "pdf", documents + [new])
+    assert underlying.n_embedded == 1
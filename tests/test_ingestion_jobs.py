@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+
+import pytest
+from langchain_core.documents import Document
+
+from chat import ingestion_jobs
+from chat.db import database
+from chat.ingestion import iter_batches
+from chat.ingestion_jobs import IngestionWorker
+
+
+class FakeIndexer:
+    """Indexes batches of documents like `source_to_vector_store`, recording calls"""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.calls = []
+
+    def __call__(self, source_path, source_type, documents, **kwargs):
+        documents = list(documents)
+        self.calls.append({"documents": documents, **kwargs})
+        if self.fail:
+            raise RuntimeError("embedding service down")
+        batches = iter_batches(documents, ingestion_jobs.INGESTION_BATCH_SIZE)
+        for batch_number, batch in enumerate(batches):
+            if batch_number >= kwargs["skip_batches"]:
+                result = {"num_added": len(batch), "num_updated": 0, "num_skipped": 0}
+                kwargs["on_batch_committed"](batch_number, result)
+
+
+def _documents(n: int) -> list[Document]:
+    return [Document(page_content=f"chunk {i}", metadata={"i": i}) for i in range(n)]
+
+
+def _job(job_id: int):
+    [job] = [job for job in database.fetch_ingestion_jobs() if job.id == job_id]
+    return job
+
+
+@pytest.fixture
+def worker(conversations_db, tmp_path, monkeypatch):
+    """Worker whose jobs are processed by the test, indexing with a `FakeIndexer`"""
+    monkeypatch.setattr(ingestion_jobs, "INGESTION_DIR", str(tmp_path / "ingestion"))
+    monkeypatch.setattr(ingestion_jobs, "INGESTION_BATCH_SIZE", 2)
+    monkeypatch.setattr(ingestion_jobs, "get_index_time", lambda: 1.0)
+    monkeypatch.setattr(ingestion_jobs, "source_to_vector_store", FakeIndexer())
+    monkeypatch.setattr(
+        ingestion_jobs, "load_website_documents", lambda url: _documents(5)
+    )
+    monkeypatch.setattr(
+        ingestion_jobs, "prepare_documents", lambda documents, doc_type: documents
+    )
+    worker = IngestionWorker()
+    worker._thread = threading.Thread(target=lambda: None)
+    return worker
+
+
+def _spool(job_id: int, documents: list[Document]):
+    path = ingestion_jobs._documents_path(job_id)
+    with open(path, "w", encoding="utf-8") as file:
+        for doc in documents:
+            file.write(json.dumps(doc.model_dump(include={"page_content", "metadata"})))
+            file.write("\n")
+
+
+def test_pending_jobs_are_claimed_once(worker):
+    first = worker.submit("https://a.org", "website")
+    second = worker.submit("https://b.org", "website")
+    claimed = database.claim_pending_ingestion_jobs()
+    assert [job.id for job in claimed] == [first.id, second.id]
+    assert all(job.status == "running" for job in claimed)
+    assert database.claim_pending_ingestion_jobs() == []
+
+
+def test_interrupted_jobs_are_requeued_on_start(worker):
+    running = worker.submit("https://a.org", "website")
+    database.claim_pending_ingestion_jobs()
+    done = worker.submit("https://b.org", "website")
+    database.update_ingestion_job(done.id, status="done")
+
+    worker.start()
+    assert _job(running.id).status == "pending"
+    assert _job(done.id).status == "done"
+
+
+def test_job_is_processed_and_spool_removed(worker):
+    job = worker.submit("https://a.org", "website")
+    [job] = database.claim_pending_ingestion_jobs()
+    worker._process(job)
+
+    job = _job(job.id)
+    assert job.status == "done"
+    assert (job.batches_committed, job.chunks_total, job.vectors_upserted) == (3, 5, 5)
+    assert job.index_started_at == 1.0
+    assert not os.listdir(ingestion_jobs.INGESTION_DIR)
+
+
+def test_failed_job_keeps_error(worker, monkeypatch):
+    monkeypatch.setattr(
+        ingestion_jobs, "source_to_vector_store", FakeIndexer(fail=True)
+    )
+    job = worker.submit("https://a.org", "website")
+    [job] = database.claim_pending_ingestion_jobs()
+    worker._process(job)
+
+    job = _job(job.id)
+    assert (job.status, job.error) == ("failed", "embedding service down")
+    assert database.claim_pending_ingestion_jobs() == []
+    assert not os.listdir(ingestion_jobs.INGESTION_DIR)
+
+
+def test_job_resumes_from_complete_spool(worker):
+    job = worker.submit("https://a.org", "website")
+    database.update_ingestion_job(
+        job.id, batches_committed=2, vectors_upserted=4, index_started_at=0.5
+    )
+    spooled = _documents(6)
+    os.makedirs(ingestion_jobs.INGESTION_DIR)
+    _spool(job.id, spooled)
+    [job] = database.claim_pending_ingestion_jobs()
+    worker._process(job)
+
+    [call] = ingestion_jobs.source_to_vector_store.calls
+    assert call["documents"] == spooled
+    assert (call["skip_batches"], call["index_started_at"]) == (2, 0.5)
+    job = _job(job.id)
+    assert (job.status, job.batches_committed, job.vectors_upserted) == ("done", 3, 6)
+
+
+def test_job_without_complete_spool_restarts(worker):
+    job = worker.submit("https://a.org", "website")
+    database.update_ingestion_job(job.id, batches_committed=2, vectors_upserted=4)
+    os.makedirs(ingestion_jobs.INGESTION_DIR)
+    partial = ingestion_jobs._documents_path(job.id) + ".partial"
+    with open(partial, "w", encoding="utf-8") as file:
+        file.write("{}\n")
+    [job] = database.claim_pending_ingestion_jobs()
+    worker._process(job)
+
+    [call] = ingestion_jobs.source_to_vector_store.calls
+    assert call["skip_batches"] == 0
+    assert call["documents"] == _documents(5)
+    job = _job(job.id)
+    assert (job.status, job.batches_committed, job.vectors_upserted) == ("done", 3, 5)
@@ -0,0 +1,85 @@
+import datetime
+
+from sqlalchemy.orm import sessionmaker
+
+from quiz.db import database
+from quiz.db.models import Base, PastQuestion
+from quiz.learner_profile import estimate_tokens, render_learner_profile
+from quiz.topics import GENERAL_TOPIC, classify_topic, question_fingerprint
+
+TD_QUESTION = "How does SARSA differ from temporal difference prediction of values?"
+DQN_QUESTION = "Why does DQN use a replay buffer and a target network?"
+
+
+def test_topics_and_fingerprints():
+    assert classify_topic(TD_QUESTION) == "temporal difference learning"
+    assert classify_topic(DQN_QUESTION) == "deep reinforcement learning"
+    assert classify_topic("What is your favourite colour?") == GENERAL_TOPIC
+    assert question_fingerprint(DQN_QUESTION) == question_fingerprint(
+        "why does dqn use a target network and a replay buffer"
+    )
+    assert question_fingerprint(DQN_QUESTION) != question_fingerprint(TD_QUESTION)
+
+
+def test_profile_is_updated_with_each_question(quiz_db, monkeypatch):
+    monkeypatch.setattr(database, "QUIZ_PROFILE_RECENT_QUESTIONS", 3)
+    monkeypatch.setattr(database, "QUIZ_PROFILE_RECENT_FAILURES", 2)
+    database.add_question(TD_QUESTION, False, "answer", "feedback")
+    database.add_question(DQN_QUESTION, False, "answer", "feedback")
+    for i in range(4):
+        database.add_question(f"{DQN_QUESTION} ({i})", True, "answer", "feedback")
+
+    topics, recent = database.fetch_learner_profile()
+    assert [(t.topic, t.n_solved, t.n_failed) for t in topics] == [
+        ("deep reinforcement learning", 4, 1),
+        ("temporal difference learning", 0, 1),
+    ]
+    # the last questions, and older failures
+    assert [(q.gist, q.solved) for q in recent] == [
+        (f"{DQN_QUESTION} (3)", True),
+        (f"{DQN_QUESTION} (2)", True),
+        (f"{DQN_QUESTION} (1)", True),
+        (DQN_QUESTION, False),
+        (TD_QUESTION, False),
+    ]
+
+
+def test_profile_is_built_from_past_questions(quiz_db):
+    Base.metadata.create_all(quiz_db)
+    with sessionmaker(bind=quiz_db)() as session:
+        for i, (question, solved) in enumerate(
+            [(TD_QUESTION, True), (DQN_QUESTION, False)]
+        ):
+            session.add(
+                PastQuestion(
+                    question=question,
+                    solved=solved,
+                    date=datetime.datetime(2025, 1, i + 1),
+                )
+            )
+        session.commit()
+
+    topics, recent = database.fetch_learner_profile()
+    assert {(t.topic, t.n_solved, t.n_failed) for t in topics} == {
+        ("temporal difference learning", 1, 0),
+        ("deep reinforcement learning", 0, 1),
+    }
+    assert [q.gist for q in recent] == [DQN_QUESTION, TD_QUESTION]
+
+
+def test_profile_prompt_fits_the_budget(quiz_db):
+    for i in range(200):
+        database.add_question(f"{TD_QUESTION} Variant {i}.", i % 3 == 0, "a", "f")
+        database.add_question(DQN_QUESTION, False, "a", "f")
+
+    profile = render_learner_profile(
+        *database.fetch_learner_profile(), token_budget=150
+    )
+    assert estimate_tokens(profile) <= 150
+    lines = profile.splitlines()
+    assert lines[0] == "Results per topic (solved / failed):"
+    assert "- temporal difference learning: 67 / 133" in lines
+    # rewordings of the same failed question are listed once
+    assert sum(DQN_QUESTION in line for line in lines) == 1
+
+    assert render_learner_profile([], []).startswith("The learner has not answered")
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+from langchain_core.documents import Document
+
+from chat import vector_store
+from chat.db import database
+from chat.lexical_index import LexicalIndex, reciprocal_rank_fusion
+
+
+def doc(text, source="a.pdf", prob=0.9):
+    return Document(
+        page_content=text, metadata={"source": source, "detection_class_prob": prob}
+    )
+
+
+def test_bm25_search_and_incremental_updates(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.db"))
+    index.add_documents(
+        [
+            doc("Q-learning is an off-policy TD control algorithm"),
+            doc("SARSA is an on-policy TD control algorithm"),
+            doc("the REINFORCE estimator", prob=0.5),
+        ],
+        "source",
+    )
+    index.add_documents([doc("REINFORCE with baseline", source="b.pdf")], "source")
+
+    results = index.search("sarsa algorithm", k=2)
+    assert [d.page_content for d in results][0].startswith("SARSA")
+    assert (
+        index.search("reinforce", _filter={"detection_class_prob": {"$gte": 0.75}})[
+            0
+        ].metadata["source"]
+        == "b.pdf"
+    )
+    assert index.search("AND OR (") == []
+
+    # re-indexing a.pdf with only one of its chunks
+    time.sleep(0.01)
+    reindex_started_at = time.time()
+    index.add_documents([doc("SARSA is an on-policy TD control algorithm")], "source")
+    assert index.delete_stale("a.pdf", before=reindex_started_at) == 2
+    assert index.search("q learning") == []
+    assert len(index.search("sarsa")) == 1
+
+
+def test_search_is_limited_to_best_matches(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.db"))
+    index.add_documents(
+        [doc(f"value of state {i}", prob=0.5) for i in range(2)]
+        + [doc("value of the initial state")]
+        + [doc(f"the value of state number {i}", prob=0.5) for i in range(10)],
+        "source",
+    )
+    assert len(index.search("value state", k=3)) == 3
+    # best matches discarded by the filter are made up for by over-fetching
+    [kept] = index.search(
+        "value state",
+        k=1,
+        _filter={"detection_class_prob": {"$gte": 0.75}},
+    )
+    assert kept.page_content == "value of the initial state"
+    assert index.source_names() == {"a.pdf"}
+
+    assert not index.is_backfilled()
+    index.mark_backfilled()
+    assert LexicalIndex(str(tmp_path / "lexical.db")).is_backfilled()
+
+
+def test_stored_documents_are_backfilled(indexing, tmp_path, monkeypatch):
+    vector_store.source_to_vector_store(
+        "a.pdf", "pdf", [doc("policy iteration"), doc("value iteration")]
+    )
+    website = Document(page_content="monte carlo tree search", metadata={"url": "b"})
+    vector_store.source_to_vector_store("b", "website", [website])
+    # lexical index created after the sources were indexed
+    index = LexicalIndex(str(tmp_path / "new_lexical.db"))
+    monkeypatch.setattr(vector_store, "get_lexical_index", lambda: index)
+    monkeypatch.setattr(
+        vector_store, "get_embeddings", lambda: pytest.fail("embedded again")
+    )
+
+    assert vector_store.backfill_lexical_index() == 3
+    assert index.source_names() == {"a.pdf", "b"}
+    assert index.search("tree search", k=1)[0].metadata["url"] == "b"
+    assert database.fetch_chat_source_by_name("a.pdf").n_related_documents == 2
+    assert vector_store.backfill_lexical_index() == 0
+
+
+def test_reciprocal_rank_fusion():
+    a, b, c = doc("a"), doc("b"), doc("c")
+    assert reciprocal_rank_fusion([[a, b], [c, b]]) == [b, a, c]
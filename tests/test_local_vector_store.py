@@ -0,0 +1,152 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from langchain.indexes import SQLRecordManager, index
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from chat.local_vector_store import (
+    MANIFEST_FILE,
+    LocalVectorStore,
+    match_metadata_filter,
+)
+
+
+def _store(tmp_path, **kwargs) -> LocalVectorStore:
+    return LocalVectorStore(
+        embedding=DeterministicFakeEmbedding(size=32),
+        persist_dir=str(tmp_path / "index"),
+        **kwargs,
+    )
+
+
+def test_metadata_filter():
+    _filter = {"detection_class_prob": {"$gte": 0.75}}
+    assert match_metadata_filter({"detection_class_prob": 0.9}, _filter)
+    assert not match_metadata_filter({"detection_class_prob": 0.5}, _filter)
+    assert not match_metadata_filter({}, _filter)
+    assert match_metadata_filter({"a": 1}, {"$or": [{"a": 2}, {"a": {"$in": [1]}}]})
+
+
+def test_flat_search_finds_exact_match_and_filters(tmp_path):
+    store = _store(tmp_path)
+    texts = [f"document number {i}" for i in range(20)]
+    metadatas = [{"detection_class_prob": 0.5 if i % 2 else 0.9} for i in range(20)]
+    store.add_texts(texts, metadatas, ids=[str(i) for i in range(20)])
+
+    assert store.similarity_search("document number 4", k=1)[0].id == "4"
+    filtered = store.similarity_search(
+        "document number 3", k=5, filter={"detection_class_prob": {"$gte": 0.75}}
+    )
+    assert len(filtered) == 5
+    assert all(doc.metadata["detection_class_prob"] == 0.9 for doc in filtered)
+
+
+def test_ivf_search_matches_flat_top_hit(tmp_path):
+    store = _store(tmp_path, search_mode="ivf", ivf_min_size=10, n_probe=2)
+    store.add_texts([f"chunk {i}" for i in range(200)])
+    for i in (0, 57, 199):
+        assert (
+            store.similarity_search(f"chunk {i}", k=1)[0].page_content == f"chunk {i}"
+        )
+
+
+def test_persistence_and_delete(tmp_path):
+    store = _store(tmp_path)
+    store.add_texts(["a", "b", "c"], ids=["1", "2", "3"])
+    store.delete(["2"])
+    reloaded = _store(tmp_path)
+    assert len(reloaded) == 2
+    assert [doc.id for doc in reloaded.get_by_ids(["1", "2", "3"])] == ["1", "3"]
+
+
+def _manifest(tmp_path) -> list[str]:
+    with open(tmp_path / "index" / MANIFEST_FILE, "r", encoding="utf-8") as file:
+        return json.load(file)["segments"]
+
+
+def test_writes_are_appended_to_a_log(tmp_path):
+    store = _store(tmp_path)
+    snapshots = set()
+    n_batches = 64
+    for batch in range(n_batches):
+        ids = [f"{batch}-{i}" for i in range(10)]
+        store.add_texts([f"chunk {_id}" for _id in ids], ids=ids)
+        snapshots.add(_manifest(tmp_path)[0])
+    # the log is folded into snapshots of doubling size, not rewritten per batch
+    assert len(snapshots) <= np.log2(n_batches) + 2
+    store.add_texts(["updated"], ids=["3-3"])
+    store.delete(["0-0", "63-9"])
+
+    reloaded = _store(tmp_path)
+    assert len(reloaded) == len(store) == 10 * n_batches - 2
+    assert reloaded.get_by_ids(["3-3"])[0].page_content == "updated"
+    assert reloaded.get_by_ids(["0-0", "63-9"]) == []
+    assert reloaded.similarity_search("chunk 42-7", k=1)[0].id == "42-7"
+    assert sorted(os.listdir(tmp_path / "index")) == sorted(
+        _manifest(tmp_path) + [MANIFEST_FILE]
+    )
+
+
+def test_interrupted_write_is_ignored(tmp_path, monkeypatch):
+    store = _store(tmp_path)
+    store.add_texts(["a", "b"], ids=["1", "2"])
+
+    def crash():
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "_write_manifest", crash)
+    with pytest.raises(OSError):
+        store.add_texts(["c"], ids=["3"])
+
+    reloaded = _store(tmp_path)
+    assert [doc.id for doc in reloaded.get_by_ids(["1", "2", "3"])] == ["1", "2"]
+    assert sorted(os.listdir(tmp_path / "index")) == sorted(
+        _manifest(tmp_path) + [MANIFEST_FILE]
+    )
+
+
+def test_legacy_index_is_converted(tmp_path):
+    legacy_dir = tmp_path / "index"
+    legacy_dir.mkdir()
+    vectors = DeterministicFakeEmbedding(size=32).embed_documents(["a", "b"])
+    np.save(legacy_dir / "embeddings.npy", np.asarray(vectors, dtype=np.float32))
+    records = {"ids": ["1", "2"], "texts": ["a", "b"], "metadatas": [{}, {}]}
+    (legacy_dir / "records.json").write_text(json.dumps(records), encoding="utf-8")
+
+    store = _store(tmp_path)
+    assert len(store) == 2
+    store.add_texts(["c"], ids=["3"])
+    assert not (legacy_dir / "records.json").exists()
+    assert len(_store(tmp_path)) == 3
+
+
+def test_plugs_into_record_manager_index(tmp_path):
+    store = _store(tmp_path)
+    record_manager = SQLRecordManager(
+        "local/test", db_url=f"sqlite:///{tmp_path / 'records.sql'}"
+    )
+    record_manager.create_schema()
+    docs = [
+        Document(page_content=f"page {i}", metadata={"source": "book.pdf"})
+        for i in range(5)
+    ]
+    result = index(
+        docs,
+        record_manager=record_manager,
+        vector_store=store,
+        cleanup="incremental",
+        source_id_key="source",
+    )
+    assert result["num_added"] == 5
+    result = index(
+        docs[:3],
+        record_manager=record_manager,
+        vector_store=store,
+        cleanup="incremental",
+        source_id_key="source",
+    )
+    assert result["num_skipped"] == 3 and result["num_deleted"] == 2
+    assert len(store) == 3
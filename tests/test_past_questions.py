@@ -0,0 +1,72 @@
+import datetime
+
+import pytest
+from sqlalchemy import event
+
+from quiz.db import database
+from quiz.db.models import PastQuestion
+
+N_QUESTIONS = 25
+
+
+@pytest.fixture
+def past_questions(quiz_db):
+    start = datetime.datetime(2025, 1, 1)
+    with database.SessionLocal() as session:
+        session.add_all(
+            [
+                PastQuestion(
+                    question=f"q{i}",
+                    solved=i % 3 == 0,
+                    date=start + datetime.timedelta(hours=i),
+                )
+                for i in range(N_QUESTIONS)
+            ]
+        )
+        session.commit()
+
+
+def _all_pages(solved: bool | None, limit: int = 10) -> list[list[str]]:
+    pages = []
+    before = None
+    while True:
+        page = database.fetch_past_questions_page(limit, before=before, solved=solved)
+        if not page:
+            return pages
+        pages.append([q.question for q in page])
+        before = page[-1].date
+
+
+def test_pages_cover_questions_most_recent_first(past_questions):
+    pages = _all_pages(None)
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert sum(pages, []) == [f"q{i}" for i in reversed(range(N_QUESTIONS))]
+    assert database.count_past_questions() == N_QUESTIONS
+
+    solved = sum(_all_pages(True, limit=4), [])
+    failed = sum(_all_pages(False, limit=4), [])
+    assert solved == [f"q{i}" for i in reversed(range(0, N_QUESTIONS, 3))]
+    assert len(failed) == database.count_past_questions(False) == N_QUESTIONS - 9
+    assert database.count_past_questions(True) == 9
+
+
+def test_pages_only_read_displayed_rows(past_questions):
+    plans = []
+
+    def explain(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            plans.extend(
+                row[-1]
+                for row in conn.exec_driver_sql(
+                    f"EXPLAIN QUERY PLAN {statement}", parameters
+                )
+            )
+
+    event.listen(database.engine, "before_cursor_execute", explain)
+    try:
+        database.fetch_past_questions_page(10, solved=False)
+        database.count_past_questions(False)
+    finally:
+        event.remove(database.engine, "before_cursor_execute", explain)
+    assert plans
+    assert all("ix_past_questions_solved_date" in plan for plan in plans)
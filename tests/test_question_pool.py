@@ -0,0 +1,71 @@
+from langchain_core.language_models import FakeListChatModel
+
+from helpers import stream_llm_response
+from quiz import quiz_model
+from quiz.db import database
+from quiz.question_pool import QuestionPool
+
+
+class _CountingGenerator:
+    """Numbered questions"""
+
+    def __init__(self):
+        self.n_generated = 0
+
+    def __call__(self, n: int) -> list[str]:
+        questions = [f"question {self.n_generated + i}" for i in range(n)]
+        self.n_generated += n
+        return questions
+
+
+def _new_pool(generate, **kwargs) -> QuestionPool:
+    """Pool refilled by the test only, once its background thread is stopped"""
+    pool = QuestionPool(generate, **kwargs)
+    pool.close()
+    pool.refill()
+    return pool
+
+
+def test_pool_serves_and_refills(quiz_db):
+    generate = _CountingGenerator()
+    pool = _new_pool(generate, batch_size=3, low_watermark=2)
+    assert database.count_pooled_questions() == 3
+
+    assert pool.take() == "question 0"
+    pool.refill()
+    # still above the watermark
+    assert generate.n_generated == 3
+    assert pool.take() == "question 1"
+    pool.refill()
+    assert generate.n_generated == 6
+    assert [pool.take() for _ in range(4)] == [f"question {i}" for i in range(2, 6)]
+    assert pool.take() is None
+
+
+def test_pool_is_invalidated_after_failures(quiz_db):
+    generate = _CountingGenerator()
+    pool = _new_pool(generate, batch_size=3, low_watermark=2, invalidate_failures=2)
+    database.add_question("What is a policy?", False, "answer", "feedback")
+    # one failure does not change the learner profile much
+    assert pool.take() == "question 0"
+
+    database.add_question("What is a value function?", False, "answer", "feedback")
+    assert pool.take() is None
+    pool.refill()
+    assert pool.take() == "question 3"
+
+
+def test_pooled_question_leaves_graph_awaiting_answer(quiz_db, monkeypatch):
+    monkeypatch.setattr(quiz_model, "fetch_learner_profile", lambda: ([], []))
+    model = FakeListChatModel(responses=["Correct! Well done"])
+    app = quiz_model.build_quiz_graph(model)
+    question = "What is the discount factor for?"
+
+    stream = quiz_model.pooled_question_stream(app, "thread", question)
+    assert "".join(stream_llm_response(stream)) == question
+    assert quiz_model.is_awaiting_answer(app, "thread")
+
+    evaluation = quiz_model.evaluate_answer_stream(app, "weighting rewards", "thread")
+    assert "".join(stream_llm_response(evaluation)) == "Correct! Well done"
+    [saved] = database.fetch_past_questions()
+    assert (saved.question, saved.solved) == (question, True)
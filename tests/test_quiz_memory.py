@@ -0,0 +1,72 @@
+import time
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from quiz import quiz_model
+from quiz.quiz_memory import BoundedMemorySaver
+
+
+@pytest.fixture
+def saved_questions(monkeypatch):
+    saved = []
+    monkeypatch.setattr(quiz_model, "fetch_learner_profile", lambda: ([], []))
+    monkeypatch.setattr(
+        quiz_model, "add_question", lambda *question: saved.append(question)
+    )
+    return saved
+
+
+def _ask(app, thread_id: str):
+    list(quiz_model.ask_question_stream(app, thread_id))
+
+
+def test_sessions_have_their_own_threads(saved_questions):
+    model = FakeListChatModel(responses=["question", "Correct!"])
+    app = quiz_model.build_quiz_graph(model)
+    # both learners are asked before either answers
+    _ask(app, "alice")
+    _ask(app, "bob")
+    assert quiz_model.is_awaiting_answer(app, "alice")
+    list(quiz_model.evaluate_answer_stream(app, "alice's answer", "alice"))
+    list(quiz_model.evaluate_answer_stream(app, "bob's answer", "bob"))
+    assert [answer for _, _, answer, _ in saved_questions] == [
+        "alice's answer",
+        "bob's answer",
+    ]
+
+    quiz_model.finish_quiz_thread(app, "alice")
+    assert app.checkpointer.stats()["quiz_live_threads"] == 1
+    assert not any(key[0] == "alice" for key in app.checkpointer.writes)
+    assert not any(key[0] == "alice" for key in app.checkpointer.blobs)
+
+
+def test_threads_are_evicted(saved_questions):
+    model = FakeListChatModel(responses=["question"])
+    memory = BoundedMemorySaver(max_threads=3, ttl_seconds=0.5)
+    app = quiz_model.build_quiz_graph(model, memory)
+    for i in range(5):
+        _ask(app, f"learner{i}")
+    # least recently used threads are evicted first
+    assert memory.stats() == {"quiz_live_threads": 3, "quiz_evicted_threads": 2}
+    assert not quiz_model.is_awaiting_answer(app, "learner0")
+    assert quiz_model.is_awaiting_answer(app, "learner4")
+
+    time.sleep(0.6)
+    _ask(app, "late")
+    assert memory.stats()["quiz_live_threads"] == 1
+    assert quiz_model.is_awaiting_answer(app, "late")
+
+
+def test_reading_unknown_threads_does_not_evict(saved_questions):
+    model = FakeListChatModel(responses=["question"])
+    memory = BoundedMemorySaver(max_threads=2)
+    app = quiz_model.build_quiz_graph(model, memory)
+    _ask(app, "learner0")
+    _ask(app, "learner1")
+    n_stored = len(memory.storage)
+    for _ in range(2):
+        assert not quiz_model.is_awaiting_answer(app, "new")
+    assert memory.stats() == {"quiz_live_threads": 2, "quiz_evicted_threads": 0}
+    assert len(memory.storage) == n_stored
+    assert quiz_model.is_awaiting_answer(app, "learner0")
@@ -0,0 +1,100 @@
+import json
+
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.runnables import RunnableLambda
+
+from quiz import quiz_summary_model
+from quiz.db import database
+from quiz.quiz_summary_model import QuizSummaryFormatter
+
+
+class StructuredStubModel(FakeListChatModel):
+    """Returns a fixed evaluation, recording the prompts it was given"""
+
+    responses: list[str] = []
+    prompts: list = []
+
+    def with_structured_output(self, schema, **kwargs):
+        def evaluate(prompt):
+            self.prompts.append(prompt)
+            return QuizSummaryFormatter(
+                overall_performance="Average",
+                areas_improvement=["bandits"],
+                suggestion="Practice more",
+            )
+
+        return RunnableLambda(evaluate)
+
+
+def _add_questions(names: list[str], solved: bool):
+    for name in names:
+        database.add_question(name, solved, "answer", "feedback")
+
+
+def test_summaries_only_process_new_answers(quiz_db):
+    model = StructuredStubModel()
+    app = quiz_summary_model.build_quiz_summary_graph(model)
+    _add_questions(["q1", "q2"], True)
+    _add_questions(["q3"], False)
+    app.invoke({})
+
+    _add_questions(["q4"], False)
+    _add_questions(["q5"], True)
+    result = app.invoke({})
+    assert (
+        result["summary"].n_correct_questions,
+        result["summary"].n_incorrect_questions,
+    ) == (3, 2)
+    # only new questions are sent, along with the previous evaluation
+    prompt = "".join(model.prompts[-1])
+    assert "q4" in prompt and "q5" in prompt
+    assert "q1" not in prompt and "q3" not in prompt
+    assert "Practice more" in prompt
+
+    # nothing to summarize
+    assert app.invoke({})["summary"] is None
+    assert len(model.prompts) == 2
+
+    result = app.invoke({"recompute": True})
+    prompt = "".join(model.prompts[-1])
+    assert all(f"q{i}" in prompt for i in range(1, 6))
+    assert "Practice more" not in prompt
+    assert (
+        result["summary"].n_correct_questions,
+        result["summary"].n_incorrect_questions,
+    ) == (3, 2)
+    assert len(quiz_summary_model.load_quiz_summaries()) == 3
+
+
+def test_summaries_are_paginated(quiz_db):
+    for i in range(5):
+        database.add_quiz_summary("Good", [], f"suggestion {i}", i, 0, i)
+    first_page = database.fetch_quiz_summaries(limit=2)
+    second_page = database.fetch_quiz_summaries(limit=2, before_id=first_page[-1].id)
+    assert [s.suggestion for s in first_page + second_page] == [
+        f"suggestion {i}" for i in [4, 3, 2, 1]
+    ]
+    assert database.count_quiz_summaries() == 5
+    assert database.fetch_summary_progress().last_question_id == 4
+
+
+def test_legacy_summaries_are_imported_once(quiz_db, tmp_path):
+    legacy = [
+        {
+            "overall_performance": "Bad",
+            "areas_improvement": ["bandits", "mdp"],
+            "suggestion": f"suggestion {i}",
+            "date": f"0{i + 1}/02/2025 10:00:00",
+            "n_correct_questions": i,
+            "n_incorrect_questions": 2,
+        }
+        for i in range(2)
+    ]
+    (tmp_path / "summaries.json").write_text(json.dumps(legacy), encoding="utf-8")
+
+    summaries = quiz_summary_model.load_quiz_summaries()
+    assert [s.model_dump() for s in summaries] == legacy[::-1]
+    assert not (tmp_path / "summaries.json").exists()
+    assert (tmp_path / "summaries.json.imported").exists()
+    database.init_db()
+    assert database.count_quiz_summaries() == 2
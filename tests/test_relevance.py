@@ -0,0 +1,75 @@
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.runnables import RunnableLambda
+
+from chat.relevance import (
+    BatchedLLMFilter,
+    DocumentScore,
+    EmbeddingSimilarityFilter,
+    RelevanceScores,
+    _relevance_filter_from_env,
+    make_relevance_filter,
+)
+
+
+class ScoringChatModel(FakeListChatModel):
+    """Grades documents by whether they mention the question, counting calls"""
+
+    n_calls: int = 0
+
+    def with_structured_output(self, schema, **kwargs):
+        def grade(messages):
+            self.n_calls += 1
+            docs = messages[-1].content.split("Document ")[1:]
+            return RelevanceScores(
+                scores=[
+                    DocumentScore(document=i, score=10 if "bellman" in doc else 0)
+                    for i, doc in enumerate(docs)
+                ]
+            )
+
+        return RunnableLambda(grade)
+
+
+def test_batched_llm_filter_grades_in_one_call():
+    llm = ScoringChatModel(responses=[])
+    docs = [
+        Document(page_content="the bellman equation"),
+        Document(page_content="unrelated text"),
+        Document(page_content="bellman backups"),
+    ]
+    kept = BatchedLLMFilter(llm=llm).compress_documents(docs, "bellman?")
+
+    assert kept == [docs[0], docs[2]]
+    assert llm.n_calls == 1
+
+
+def test_relevance_filter_modes():
+    llm = ScoringChatModel(responses=[])
+    embeddings = DeterministicFakeEmbedding(size=8)
+
+    assert isinstance(
+        make_relevance_filter("batched_llm", llm, embeddings), BatchedLLMFilter
+    )
+    assert isinstance(
+        make_relevance_filter("embedding", llm, embeddings), EmbeddingSimilarityFilter
+    )
+    assert make_relevance_filter("none", llm, embeddings) is None
+
+
+def test_unknown_relevance_filter_falls_back_to_default(monkeypatch):
+    monkeypatch.setenv("RELEVANCE_FILTER", "embedding")
+    assert _relevance_filter_from_env() == "embedding"
+    monkeypatch.setenv("RELEVANCE_FILTER", "llm")
+    assert _relevance_filter_from_env() == "batched_llm"
+    monkeypatch.delenv("RELEVANCE_FILTER")
+    assert _relevance_filter_from_env() == "batched_llm"
+
+
+def test_embedding_filter_keeps_similar_documents():
+    embeddings = DeterministicFakeEmbedding(size=32)
+    docs = [Document(page_content="q"), Document(page_content="other")]
+    _filter = EmbeddingSimilarityFilter(embeddings=embeddings, similarity_threshold=0.9)
+
+    assert _filter.compress_documents(docs, "q") == docs[:1]
@@ -0,0 +1,64 @@
+from langchain_core.documents import Document
+
+from chat.retrieval_cache import SemanticRetrievalCache
+
+VECTORS = {
+    "what is the bellman equation": [1.0, 0.0, 0.0],
+    "What is the Bellman equation?": [0.99, 0.05, 0.0],
+    "sarsa vs q-learning": [0.0, 1.0, 0.0],
+}
+
+
+class Retriever:
+    def __init__(self):
+        self.n_calls = 0
+
+    def __call__(self, vector):
+        self.n_calls += 1
+        return [Document(page_content=f"doc {self.n_calls}", metadata={"v": vector})]
+
+
+def lookup(cache, query, retriever, namespace="default"):
+    return cache.get_or_retrieve(namespace, query, VECTORS.__getitem__, retriever)
+
+
+def test_similar_queries_hit(tmp_path):
+    cache = SemanticRetrievalCache(
+        str(tmp_path / "cache.db"), similarity_threshold=0.95
+    )
+    retriever = Retriever()
+    first = lookup(cache, "what is the bellman equation", retriever)
+    assert lookup(cache, "What is the Bellman equation?", retriever) == first
+    assert lookup(cache, "what  is the bellman equation", retriever) == first
+    lookup(cache, "sarsa vs q-learning", retriever)
+    lookup(cache, "sarsa vs q-learning", retriever, namespace="other")
+
+    assert retriever.n_calls == 3
+    assert cache.stats()["retrieval_cache_hits"] == 2
+    assert cache.stats()["retrieval_cache_misses"] == 3
+
+    reopened = SemanticRetrievalCache(str(tmp_path / "cache.db"))
+    assert lookup(reopened, "what is the bellman equation", retriever) == first
+    assert retriever.n_calls == 3
+
+
+def test_invalidation_and_eviction(tmp_path):
+    cache = SemanticRetrievalCache(str(tmp_path / "cache.db"), max_entries=1)
+    other = SemanticRetrievalCache(str(tmp_path / "cache.db"))
+    retriever = Retriever()
+    lookup(cache, "what is the bellman equation", retriever)
+    lookup(other, "what is the bellman equation", retriever)
+    assert retriever.n_calls == 1
+
+    cache.invalidate()
+    lookup(other, "what is the bellman equation", retriever)
+    assert retriever.n_calls == 2
+
+    # only the most recent query is kept
+    lookup(cache, "sarsa vs q-learning", retriever)
+    lookup(cache, "what is the bellman equation", retriever)
+    assert retriever.n_calls == 4
+
+    expired = SemanticRetrievalCache(str(tmp_path / "cache.db"), ttl_seconds=-1)
+    lookup(expired, "what is the bellman equation", retriever)
+    assert retriever.n_calls == 5
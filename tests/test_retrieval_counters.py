@@ -0,0 +1,51 @@
+import threading
+
+from chat.retrieval_counters import RetrievalCountAggregator
+
+
+class RecordingFlush:
+    def __init__(self):
+        self.batches = []
+        self.flushed = threading.Event()
+
+    def __call__(self, counts):
+        self.batches.append(counts)
+        self.flushed.set()
+
+
+def test_counts_are_batched_until_shutdown():
+    flush = RecordingFlush()
+    aggregator = RetrievalCountAggregator(flush, flush_seconds=60, flush_events=100)
+    aggregator.add({"a.pdf": 2})
+    aggregator.add({"a.pdf": 1, "http://b": 3})
+    assert flush.batches == []
+
+    aggregator.close()
+    assert flush.batches == [{"a.pdf": 3, "http://b": 3}]
+
+
+def test_flush_after_n_events_in_background():
+    flush = RecordingFlush()
+    aggregator = RetrievalCountAggregator(flush, flush_seconds=60, flush_events=2)
+    aggregator.add({"a.pdf": 1})
+    aggregator.add({"a.pdf": 1})
+
+    assert flush.flushed.wait(5)
+    assert flush.batches == [{"a.pdf": 2}]
+    aggregator.close()
+
+
+def test_failed_flush_is_retried():
+    calls = []
+
+    def failing_once(counts):
+        calls.append(counts)
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+
+    aggregator = RetrievalCountAggregator(failing_once, flush_seconds=60)
+    aggregator.add({"a.pdf": 1})
+    aggregator.flush()
+    aggregator.add({"a.pdf": 1})
+    aggregator.close()
+    assert calls == [{"a.pdf": 1}, {"a.pdf": 2}]
@@ -0,0 +1,55 @@
+"""
+Concurrency stress test of the shared SQLite layer: many simulated chat sessions
+appending messages and checkpointing graph state in the same database at once
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import END, MessagesState, StateGraph
+from sqlalchemy import text
+
+from chat.db import database
+from utils.sqlite import connect_sqlite, get_engine
+
+N_SESSIONS = 16
+N_TURNS = 20
+
+
+def test_connections_are_configured(conversations_db):
+    db_path = conversations_db.url.database
+    assert get_engine(db_path) is get_engine(db_path)
+    with get_engine(db_path).connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() > 0
+    raw = connect_sqlite(db_path)
+    assert raw.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_concurrent_sessions(conversations_db):
+    db_path = conversations_db.url.database
+    workflow = StateGraph(state_schema=MessagesState)
+    workflow.add_node("answer", lambda state: {"messages": [AIMessage("ok")]})
+    workflow.set_entry_point("answer")
+    workflow.add_edge("answer", END)
+    app = workflow.compile(checkpointer=SqliteSaver(connect_sqlite(db_path)))
+
+    def session(i: int):
+        conv_id = f"conv{i}"
+        database.save_conversation(conv_id, [])
+        config = {"configurable": {"thread_id": conv_id}}
+        for turn in range(N_TURNS):
+            app.invoke({"messages": [HumanMessage(f"q{turn}")]}, config)
+            database.append_messages(conv_id, [("human", f"q{turn}"), ("ai", "ok")])
+        return conv_id
+
+    with ThreadPoolExecutor(max_workers=N_SESSIONS) as pool:
+        conv_ids = list(pool.map(session, range(N_SESSIONS)))
+
+    for conv_id in conv_ids:
+        messages = database.fetch_conversation_messages(conv_id, limit=1000)
+        assert [m.seq for m in messages] == list(range(2 * N_TURNS))
+        state = app.get_state({"configurable": {"thread_id": conv_id}})
+        assert len(state.values["messages"]) == 2 * N_TURNS